@@ -6,28 +6,44 @@ import datetime
 import logging
 import atexit
 import socket
+import json
 import time
 import re
 import os
 
-from flask import Flask
-from flask_graphql import GraphQLView
+from flask import Flask, Response, abort, jsonify, request, send_file
+from graphql import GraphQLError
 
 from zeroconf import ServiceInfo, Zeroconf
 
-import svn.remote
-import svn.local
-from svn.exception import SvnException
-
 from fgo import constants
 from fgo.gql import schema
 from fgo.gql import types
+from fgo.gql.persisted_queries import PersistedQueryBackend, PersistedQueryView
 
 from fgo.agent import util
 from fgo.agent import agent_errors
+from fgo.agent.property_client import PropertyClient
+from fgo.agent.install_queue import InstallQueue
+from fgo.agent.fgfs_log import FgfsLog
+from fgo.agent.metrics_sampler import MetricsSampler
+from fgo.agent.disk_budget import DiskBudget
+from fgo.agent.prefetcher import Prefetcher
+from fgo.agent.scenery_prefetch import SceneryPrefetcher
+from fgo.agent.page_cache import PageCacheWarmer
+from fgo.agent.terrasync_proxy import ProxyError, TerraSyncProxy
+from fgo.agent.ai_scenario_index import AIScenarioIndex
+from fgo.agent.aircraft_index import AircraftIndex
+from fgo.agent.aircraft_store import AircraftStore
+from fgo.agent import aircraft_share
+from fgo.agent import info_stream
 
 
 class Agent:
+    READINESS_POLL_INTERVAL = 1
+    # how often an idle /events stream sends a comment to keep it alive
+    EVENT_KEEPALIVE_INTERVAL = 15
+
     def __init__(self, config):
         logging.info("Initialising agent")
         self._config = config
@@ -35,16 +51,56 @@ class Agent:
         self._uuid = config.uuid
 
         self._context_lock = threading.Lock()
-        self._check_status_thread = threading.Thread()
+        self._wake_event = threading.Event()
+        self._supervisor_thread = threading.Thread()
+        self._aircraft_store = AircraftStore(config)
+        self._install_queue = InstallQueue(config, self._aircraft_store, self._wake_event.set)
+        self._prefetcher = Prefetcher(
+            config,
+            self._install_queue,
+            lambda: self._context['fg_process'],
+            lambda: self._context.get('aircraft_svn_base_url')
+        )
+        self._info_stream = info_stream.InfoStream()
+        self._fgfs_log = FgfsLog(
+            log_path=Path(config.logs_dir, 'fgfs.log') if config.fgfs_log_to_file and config.logs_dir else None
+        )
+        self._ai_scenario_index = AIScenarioIndex(config)
+        self._aircraft_index = AircraftIndex(config)
+        self._metrics_sampler = MetricsSampler(lambda: self._context['fg_process'])
+        self._disk_budget = DiskBudget(
+            config,
+            lambda: self._context['fg_process'],
+            self._install_queue.is_installing,
+            self._aircraft_store.forget,
+            self._aircraft_store.prune
+        )
+        self._terrasync_proxy = TerraSyncProxy(config)
+        self._scenery_prefetcher = SceneryPrefetcher(config)
+        self._page_cache_warmer = PageCacheWarmer(config)
+        self._query_backend = PersistedQueryBackend()
+        self._query_backend.document_from_string(schema.Schema, info_stream.DEFAULT_QUERY)
 
         self._context = {
             'running': False,
             'info': types.Info(status=types.Status.SCANNING),
             'context_lock': self._context_lock,
+            'wake_supervisor': self._wake_event.set,
+            'install_queue': self._install_queue,
+            'aircraft_store': self._aircraft_store,
+            'fgfs_log': self._fgfs_log,
+            'metrics_sampler': self._metrics_sampler,
+            'disk_budget': self._disk_budget,
+            'prefetcher': self._prefetcher,
+            'terrasync_proxy': self._terrasync_proxy,
+            'scenery_prefetcher': self._scenery_prefetcher,
+            'page_cache_warmer': self._page_cache_warmer,
+            'ai_scenario_index': self._ai_scenario_index,
             'config': self._config,
             'version': None,
             'state_meta': None,
-            'fg_process': None
+            'fg_process': None,
+            'fgfs_probe': None
         }
 
         self._zeroconf_enabled = config.zeroconf_enabled
@@ -77,155 +133,239 @@ class Agent:
             logging.info("Registration of a service, press Ctrl-C to exit...")
             self._m_zeroconf.register_service(self._zeroconf_info)
 
-        self._check_status_thread = threading.Timer(10, self._check_status)
-        self._check_status_thread.start()
-        flask_app.run(host='0.0.0.0')
+        self._supervisor_thread = threading.Thread(
+            target=self._supervise, name='fgo-supervisor', daemon=True)
+        self._supervisor_thread.start()
+        self._metrics_sampler.start()
+        self._disk_budget.start()
+        self._prefetcher.start()
+
+        if self._config.http_server == 'waitress':
+            # only needed when asked for, the development server works without it
+            import waitress
+            logging.info(f"Serving with waitress on {self._config.http_threads} threads")
+            waitress.serve(
+                flask_app,
+                host='0.0.0.0',
+                port=constants.AGENT_PORT,
+                threads=self._config.http_threads,
+                ident='fgo-agent'
+            )
+        else:
+            flask_app.run(host='0.0.0.0')
+
+    def _supervise(self):
+        # long-lived loop that ticks the state machine, then sleeps until a
+        # mutation, an FGFS exit or a state specific timer wakes it up
+        while True:
+            with self._context_lock:
+                if not self._context['running']:
+                    return
+
+            # mutations swap in a new Info before waking us
+            self._info_stream.publish(self._context['info'])
+            timeout = self._check_status()
+            self._info_stream.publish(self._context['info'])
+            self._wake_event.wait(timeout)
+            self._wake_event.clear()
+
+    def _wait_for_fgfs(self, fg_process):
+        fg_process.wait()
+        logging.debug(f"FGFS exited with returncode {fg_process.returncode}")
+        self._wake_event.set()
+
+    def _next_check_timeout(self):
+        '''
+        Returns the number of seconds until the state machine needs to run
+        again without being woken, or None to wait for the next event
+        '''
+        status = self._context['info'].status
+
+        if status in [
+            types.Status.SCANNING,
+            types.Status.FGFS_START_REQUESTED,
+            types.Status.FGFS_STOP_REQUESTED
+        ]:
+            return 0
+
+        if status == types.Status.FGFS_STARTING:
+            if self._context['fgfs_probe'].available:
+                return self.READINESS_POLL_INTERVAL
+
+            elapsed = (datetime.datetime.now() - self._context['state_meta']).total_seconds()
+            return max(0, self._config.fgfs_startup_time - elapsed)
+
+        return None
 
     def _check_status(self):
         # state machine that actually manages things
+        #
+        # the tick works from a snapshot taken under the context lock, does the
+        # slow work (scanning, starting fgfs) without holding it and then swaps in a
+        # new Info, so resolvers and mutations never wait behind it
         with self._context_lock:
-            if self._context['running']:
-                current_status = self._context['info'].status
-                current_errors = self._context['info'].errors
-                current_aircraft = self._context['info'].aircraft
-                current_os = self._context['info'].os
-                current_os_string = self._context['info'].os_string
-                current_fg_process = self._context['fg_process']
-
-                next_os = current_os
-                next_os_string = current_os_string
-                next_status = current_status
-                next_aircraft = current_aircraft
-                next_errors = current_errors
-                next_fg_process = current_fg_process
-
-                config = self._context['config']
-
-                if current_status == types.Status.SCANNING:
-                    next_os, next_os_string = util.discover_os()
-                    next_errors, memo = self._check_environment(
-                        next_os, self._config)
-                    self._context = {**self._context, **memo}
-
-                    if len(next_errors) == 0:
-                        next_status = types.Status.READY
-                    else:
-                        next_status = types.Status.ERROR
-
-                elif current_status == types.Status.INSTALLING_AIRCRAFT:
-                    #       the giant state machine will:
-                    #           - check if the aircraft has already been cloned
-                    #               - do an svn up on it if it already exists
-                    #               - or a fresh check out
-                    #               - progress state to READY or ERROR when done
-                    #
-                    svn_name = self._context['state_meta']
-                    logging.info(
-                        f"Installing or Updating aircraft '{svn_name}'")
-                    expected_aircraft_path = Path(
-                        config.aircraft_path,
-                        svn_name
-                    )
-                    logging.info(
-                        f"Checking if {expected_aircraft_path} exists")
-
-                    if expected_aircraft_path.exists():
-                        logging.info("Updating existing aircraft")
-                        lc = svn.local.LocalClient(f"{expected_aircraft_path}")
-                        try:
-                            lc.update()
-                            next_status = types.Status.READY
-                            logging.info("Done updating aircraft")
-                        except SvnException:
-                            next_status = types.Status.ERROR
-                            next_errors = [types.Error(
-                                code=types.ErrorCode.AIRCRAFT_NOT_IN_VERSION_CONTROL,
-                                description=f"Aircraft {svn_name} is not under version control. Delete the folder {expected_aircraft_path} and try reinstalling."
-                            )]
-                    else:
-                        upstream_repo_url = f"{self._context['aircraft_svn_base_url']}/{svn_name}"
-                        logging.info(f"Cloning from {upstream_repo_url}")
-                        rc = svn.remote.RemoteClient(upstream_repo_url)
-                        try:
-                            rc.checkout(f"{expected_aircraft_path}")
-                        except svn.exception.SvnException as e:
-                            logging.error(
-                                f"Unable to clone aircraft '{svn_name}': {e}")
-                            next_status = types.Status.ERROR
-                            next_errors = [
-                                types.Error(
-                                    code=types.ErrorCode.AIRCRAFT_INSTALL_FAILED,
-                                    description=f"{e}"
-                                )
-                            ]
-                        except FileNotFoundError:
-                            next_status = types.Status.ERROR
-                            next_errors = [types.Error(
-                                code=types.ErrorCode.SVN_NOT_INSTALLED,
-                                description=f"Aircraft {svn_name} could not be installed. Check that you have svn installed."
-                            )]
-                        else:
-                            logging.info("Done cloning aircraft")
-                            next_status = types.Status.READY
-
-                elif current_status == types.Status.FGFS_START_REQUESTED:
-                    # assemble arguments
-                    env = config.assemble_fgfs_env_vars()
-                    env_str = [f'{k}={v}' for k, v in env[0].items()]
-                    env_str = ' '.join(env_str)
-                    args = [f"{config.fgfs_path}"] + \
-                        self._context['state_meta']
-                    logging.info(f"***** About to trigger FGFS *****")
-                    logging.info("")
-                    logging.info(f"     env: {env_str}")
-                    logging.info(f"     cmd: {' '.join(args)}")
-                    logging.info("")
-                    logging.info(f"*********************************")
-                    next_fg_process = subprocess.Popen(
-                        args,
-                        text=True,
-                        env=env[1]
-                    )
-                    self._context['state_meta'] = datetime.datetime.now()
-                    next_status = types.Status.FGFS_STARTING
-
-                elif current_status == types.Status.FGFS_STARTING:
-                    # TODO: implement actual check whether FGFS is up
-                    if (datetime.datetime.now() - self._context['state_meta']).seconds >= config.fgfs_startup_time:
-                        next_status = types.Status.FGFS_RUNNING
-
-                elif current_status == types.Status.FGFS_RUNNING:
-                    # check that fgfs is still up, set error if it crashes
-                    logging.debug(f"current_fg_process = {current_fg_process}")
-                    logging.debug(
-                        f"current_fg_process.poll() = {current_fg_process.poll()}")
-
-                    if current_fg_process.poll() is not None:
-                        rc = current_fg_process.returncode
-                        if rc == 0:
-                            next_status = types.Status.READY
-                        else:
-                            msg = f"Abnormal FlightGear termination with returncode {rc}!"
-                            logging.error(msg)
-                            next_errors = [
-                                types.Error(
-                                    code=types.ErrorCode.FGFS_ABNORMAL_EXIT,
-                                    description=msg
-                                )
-                            ]
-                            next_status = types.Status.ERROR
-
-                        next_fg_process = None
-
-                elif current_status == types.Status.FGFS_STOP_REQUESTED:
-                    self._context['fg_process'].terminate()
-                    self._context['fg_process'] = None
+            if not self._context['running']:
+                return None
+
+            current_info = self._context['info']
+            current_state_meta = self._context['state_meta']
+            current_fg_process = self._context['fg_process']
+            current_fgfs_probe = self._context['fgfs_probe']
+
+        current_status = current_info.status
+
+        next_os = current_info.os
+        next_os_string = current_info.os_string
+        next_status = current_status
+        next_aircraft = current_info.aircraft
+        next_errors = current_info.errors
+        next_state_meta = current_state_meta
+        next_fg_process = current_fg_process
+        next_fgfs_probe = current_fgfs_probe
+        memo = {}
+
+        config = self._config
+        install_queue = self._install_queue
+
+        if current_status == types.Status.SCANNING:
+            next_os, next_os_string = util.discover_os()
+            next_errors, memo = self._check_environment(
+                next_os, self._config)
+
+            if len(next_errors) == 0:
+                next_status = types.Status.READY
+                self._ai_scenario_index.refresh_in_background()
+            else:
+                next_status = types.Status.ERROR
+
+        elif current_status == types.Status.INSTALLING_AIRCRAFT:
+            # the jobs run on the install queue, this state just summarises
+            # them for the director while the agent has nothing else to do
+            if not install_queue.active:
+                failures = install_queue.take_failures()
+
+                if len(failures) == 0:
+                    logging.info("Done installing aircraft")
+                    next_status = types.Status.READY
+                else:
+                    next_status = types.Status.ERROR
+                    next_errors = [job.error for job in failures]
+
+        elif current_status == types.Status.FGFS_START_REQUESTED:
+            # assemble arguments
+            env = config.assemble_fgfs_env_vars()
+            env_str = [f'{k}={v}' for k, v in env[0].items()]
+            env_str = ' '.join(env_str)
+            args = [f"{config.fgfs_path}"] + current_state_meta
+            logging.info(f"***** About to trigger FGFS *****")
+            logging.info("")
+            logging.info(f"     env: {env_str}")
+            logging.info(f"     cmd: {' '.join(args)}")
+            logging.info("")
+            logging.info(f"*********************************")
+            self._fgfs_log.append(f"***** {' '.join(args)} *****")
+            next_fg_process = subprocess.Popen(
+                args,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.STDOUT,
+                text=True,
+                errors='replace',
+                env=env[1]
+            )
+            self._fgfs_log.follow(next_fg_process.stdout)
+            threading.Thread(
+                target=self._wait_for_fgfs,
+                args=(next_fg_process,),
+                name='fgo-fgfs-waiter',
+                daemon=True
+            ).start()
+            next_state_meta = datetime.datetime.now()
+            next_fgfs_probe = PropertyClient.from_args(args)
+            self._disk_budget.session_started(args, next_fgfs_probe)
+            next_status = types.Status.FGFS_STARTING
+
+        elif current_status == types.Status.FGFS_STARTING and current_fg_process.poll() is not None:
+            rc = current_fg_process.returncode
+            msg = f"FlightGear exited with returncode {rc} while starting up!"
+            logging.error(msg)
+            next_errors = [
+                types.Error(
+                    code=types.ErrorCode.FGFS_ABNORMAL_EXIT,
+                    description=msg
+                )
+            ]
+            next_status = types.Status.ERROR
+            next_fg_process = None
+
+        elif current_status == types.Status.FGFS_STARTING:
+            if current_fgfs_probe.available:
+                # ask FGFS itself whether the scenery has loaded
+                if current_fgfs_probe.is_ready():
+                    logging.info("FGFS reports that it is ready")
+                    next_status = types.Status.FGFS_RUNNING
+            elif (datetime.datetime.now() - current_state_meta).total_seconds() >= config.fgfs_startup_time:
+                # no httpd or telnet server to ask, fall back to waiting
+                next_status = types.Status.FGFS_RUNNING
+
+        elif current_status == types.Status.FGFS_RUNNING:
+            # check that fgfs is still up, set error if it crashes
+            logging.debug(f"current_fg_process = {current_fg_process}")
+            logging.debug(
+                f"current_fg_process.poll() = {current_fg_process.poll()}")
+
+            if current_fg_process.poll() is not None:
+                rc = current_fg_process.returncode
+                if rc == 0:
                     next_status = types.Status.READY
-                elif current_status == types.Status.ERROR:
-                    pass
-                elif current_status == types.Status.READY:
-                    pass
+                else:
+                    msg = f"Abnormal FlightGear termination with returncode {rc}!"
+                    logging.error(msg)
+                    next_errors = [
+                        types.Error(
+                            code=types.ErrorCode.FGFS_ABNORMAL_EXIT,
+                            description=msg
+                        )
+                    ]
+                    next_status = types.Status.ERROR
+
+                next_fg_process = None
+
+        elif current_status == types.Status.FGFS_STOP_REQUESTED:
+            current_fg_process.terminate()
+            next_fg_process = None
+            next_status = types.Status.READY
+        elif current_status == types.Status.ERROR:
+            pass
+        elif current_status == types.Status.READY:
+            if install_queue.active:
+                # jobs queued while FGFS was running are still going
+                next_status = types.Status.INSTALLING_AIRCRAFT
+
+        if next_status in [
+            types.Status.READY,
+            types.Status.INSTALLING_AIRCRAFT,
+            types.Status.FGFS_RUNNING,
+            types.Status.ERROR
+        ]:
+            # cheap when nothing changed, install jobs wake us as they finish
+            next_aircraft = [
+                types.Aircraft(
+                    name=record.name,
+                    version=record.version,
+                    variants=record.variants,
+                    revision=record.revision
+                )
+                for record in self._aircraft_index.aircraft()
+            ]
 
+        with self._context_lock:
+            # whatever happened to the process has happened, keep track of it
+            self._context['fg_process'] = next_fg_process
+            self._context['fgfs_probe'] = next_fgfs_probe
+
+            if self._context['info'] is current_info:
+                self._context.update(memo)
+                self._context['state_meta'] = next_state_meta
                 self._context['info'] = types.Info(
                     status=next_status,
                     os=next_os,
@@ -235,11 +375,21 @@ class Agent:
                     aircraft=next_aircraft,
                     uuid=self._uuid
                 )
-                self._context['fg_process'] = next_fg_process
+            else:
+                # a mutation moved the state on while we were busy, its
+                # request takes precedence over our result
+                logging.info(
+                    f"Discarding result of {current_status}, state is now {self._context['info'].status}")
+
+                if next_fg_process is not None and next_fg_process is not current_fg_process and \
+                        self._context['info'].status != types.Status.FGFS_STOP_REQUESTED:
+                    # no state would watch or stop the FGFS we just started
+                    logging.info(f"Stopping the FGFS started by {current_status}")
+                    next_fg_process.terminate()
+                    self._context['fg_process'] = None
+                    self._context['fgfs_probe'] = None
 
-                self._check_status_thread = threading.Timer(
-                    10, self._check_status)
-                self._check_status_thread.start()
+            return self._next_check_timeout()
 
     def _assemble_fg_args(self):
         return [
@@ -297,8 +447,7 @@ class Agent:
 
             if fgfs_find_result:
                 logging.info(f"Found fgfs at {fgfs_find_result}!")
-                config.fgfs_path = fgfs_find_result
-                config.save()
+                self._save_config_value('fgfs_path', fgfs_find_result)
                 fgfs_error = None
 
         error_list += filter(None, [fgfs_error])
@@ -314,8 +463,7 @@ class Agent:
                 path_obj = Path(proposed_path)
                 if path_obj.exists():
                     logging.info(f"Found fgroot at {path_obj}!")
-                    config.fgroot_path = path_obj
-                    config.save()
+                    self._save_config_value('fgroot_path', path_obj)
                     fgroot_error = None
 
         error_list += filter(None, [fgroot_error])
@@ -348,8 +496,7 @@ class Agent:
 
             if path_obj.exists():
                 logging.info(f"Found fghome at {path_obj}!")
-                config.fghome_path = path_obj
-                config.save()
+                self._save_config_value('fghome_path', path_obj)
                 fghome_error = None
 
         error_list += filter(None, [fghome_error])
@@ -362,8 +509,7 @@ class Agent:
             proposed_path = Path(config.fghome_path, 'Aircraft')
             if proposed_path.exists():
                 logging.info(f"Found aircraft at {proposed_path}!")
-                config.aircraft_path = proposed_path
-                config.save()
+                self._save_config_value('aircraft_path', proposed_path)
                 aircraft_path_error = None
 
         error_list += filter(None, [aircraft_path_error])
@@ -411,6 +557,12 @@ class Agent:
 
         return error_list, memo
 
+    def _save_config_value(self, key, value):
+        # config is shared with the SetConfig mutation
+        with self._context_lock:
+            setattr(self._config, key, value)
+            self._config.save()
+
     def _check_path_set_and_exists(self, selector, allow_none=False):
         key = f"{selector}_path"
         value = getattr(self._config, key, None)
@@ -435,9 +587,18 @@ class Agent:
         with self._context_lock:
             self._context['running'] = False
 
-        if self._check_status_thread.is_alive():
+        self._wake_event.set()
+
+        if self._supervisor_thread.is_alive():
             logging.info("Waiting to status checker to quit...")
-            self._check_status_thread.join(5)
+            self._supervisor_thread.join(5)
+
+        self._install_queue.shutdown()
+        self._scenery_prefetcher.shutdown()
+        self._page_cache_warmer.shutdown()
+        self._metrics_sampler.stop()
+        self._disk_budget.stop()
+        self._prefetcher.stop()
 
         if self._zeroconf_enabled:
             logging.info("Unregistering service")
@@ -449,12 +610,108 @@ class Agent:
 
         app.add_url_rule(
             '/graphql',
-            view_func=GraphQLView.as_view(
+            view_func=PersistedQueryView.as_view(
                 'graphql',
                 schema=schema.Schema,
+                backend=self._query_backend,
                 graphiql=True,
                 get_context=lambda: self._context
             )
         )
+        app.add_url_rule('/events', 'events', view_func=self._events)
+        app.add_url_rule('/aircraft/<svn_name>', 'aircraft_manifest', view_func=self._aircraft_manifest)
+        app.add_url_rule('/aircraft/<svn_name>/tar', 'aircraft_tar', view_func=self._aircraft_tar)
+        app.add_url_rule('/terrasync/<path:path>', 'terrasync', view_func=self._terrasync)
 
         return app
+
+    def _is_installing(self, svn_name: str) -> bool:
+        # peers wait for aircraft we've been asked to prefetch as well
+        return self._install_queue.is_installing(svn_name) or self._prefetcher.is_pending(svn_name)
+
+    def _aircraft_manifest(self, svn_name):
+        ''' Tells peers whether we can share an aircraft with them '''
+        if not aircraft_share.is_valid_svn_name(svn_name) or not self._config.aircraft_path:
+            abort(404)
+
+        return jsonify(aircraft_share.manifest(
+            self._config.aircraft_path,
+            svn_name,
+            self._is_installing(svn_name)
+        ))
+
+    def _aircraft_tar(self, svn_name):
+        if not aircraft_share.is_valid_svn_name(svn_name) or not self._config.aircraft_path:
+            abort(404)
+
+        memo = aircraft_share.manifest(
+            self._config.aircraft_path,
+            svn_name,
+            self._is_installing(svn_name)
+        )
+
+        if memo['installing']:
+            abort(409)
+
+        if not memo['available']:
+            abort(404)
+
+        return Response(
+            aircraft_share.tar_stream(Path(self._config.aircraft_path, svn_name)),
+            mimetype='application/x-tar'
+        )
+
+    def _terrasync(self, path):
+        ''' See TerraSyncProxy, FGFS is pointed at http://<agent>:5000/terrasync '''
+        if not self._terrasync_proxy.enabled:
+            abort(404)
+
+        try:
+            local_path = self._terrasync_proxy.fetch(path)
+        except ProxyError as e:
+            abort(e.status)
+
+        return send_file(f"{local_path}", mimetype='application/octet-stream', conditional=True)
+
+    def _events(self):
+        '''
+        Server-Sent Events stream that re-runs a GraphQL query, INFO by
+        default, every time the agent publishes a new Info
+        '''
+        query = request.args.get('query', info_stream.DEFAULT_QUERY)
+
+        def generate():
+            version = 0
+
+            try:
+                document = self._query_backend.document_from_string(schema.Schema, query)
+            except GraphQLError as e:
+                yield f"event: error\ndata: {json.dumps([str(e)])}\n\n"
+                return
+
+            # a GET, cross-site ones included, must not be able to run mutations
+            if document.get_operation_type(None) != 'query':
+                yield f"event: error\ndata: {json.dumps(['Only queries can be streamed'])}\n\n"
+                return
+
+            while self._context['running']:
+                next_version, _info = self._info_stream.wait(version, self.EVENT_KEEPALIVE_INTERVAL)
+
+                if next_version == version:
+                    yield ": keep-alive\n\n"
+                    continue
+
+                version = next_version
+                result = document.execute(context_value=self._context)
+
+                if result.errors:
+                    yield f"event: error\ndata: {json.dumps([str(e) for e in result.errors])}\n\n"
+                    return
+
+                yield f"event: info\ndata: {json.dumps(result.data)}\n\n"
+
+        return Response(
+            generate(),
+            mimetype='text/event-stream',
+            headers={'Cache-Control': 'no-cache'}
+        )
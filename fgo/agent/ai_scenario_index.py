@@ -0,0 +1,122 @@
+from dataclasses import dataclass, field
+from xml.etree import ElementTree
+from pathlib import Path
+import threading
+import logging
+import typing
+
+
+@dataclass
+class AIScenarioRecord:
+    name: str
+    description: str = None
+    carriers: typing.List[str] = field(default_factory=list)
+    ships: typing.List[str] = field(default_factory=list)
+
+
+class AIScenarioIndex:
+    '''
+    Index of the scenarios in $FG_ROOT/AI, see
+    http://wiki.flightgear.org/AI_Systems#AI_Scenarios
+
+    Files are only parsed again when the AI directory's mtime changes, and
+    once there is an index that happens on a background thread so callers
+    always get an answer straight away.
+    '''
+    def __init__(self, config):
+        self._config = config
+        self._lock = threading.Lock()
+        self._scenarios: typing.List[AIScenarioRecord] = []
+        self._indexed_key = None
+        self._refreshing = False
+
+    def scenarios(self) -> typing.List[AIScenarioRecord]:
+        key = self._current_key()
+
+        with self._lock:
+            if key == self._indexed_key:
+                return self._scenarios
+
+            first_build = self._indexed_key is None
+            start_refresh = not first_build and not self._refreshing
+            self._refreshing = self._refreshing or start_refresh
+
+        if first_build:
+            self._refresh(key)
+        elif start_refresh:
+            threading.Thread(
+                target=self._refresh,
+                args=(key,),
+                name='fgo-ai-scenario-index',
+                daemon=True
+            ).start()
+
+        with self._lock:
+            return self._scenarios
+
+    def refresh_in_background(self):
+        threading.Thread(target=self.scenarios, name='fgo-ai-scenario-index', daemon=True).start()
+
+    def _current_key(self) -> typing.Tuple[typing.Union[Path, None], typing.Union[int, None]]:
+        fgroot_path = self._config.fgroot_path
+
+        if not fgroot_path:
+            return None, None
+
+        ai_path = Path(fgroot_path, 'AI')
+
+        try:
+            return ai_path, ai_path.stat().st_mtime_ns
+        except OSError:
+            return ai_path, None
+
+    def _refresh(self, key):
+        ai_path, mtime = key
+        scenarios = []
+
+        try:
+            if mtime is not None:
+                for scenario_path in sorted(ai_path.glob('*.xml')):
+                    scenarios.append(self._parse(scenario_path))
+
+            logging.info(f"Indexed {len(scenarios)} AI scenarios in {ai_path}")
+
+            with self._lock:
+                self._scenarios = scenarios
+                self._indexed_key = key
+        finally:
+            with self._lock:
+                self._refreshing = False
+
+    @staticmethod
+    def _parse(scenario_path: Path) -> AIScenarioRecord:
+        # scenarios are referred to by file name, not by their <name>
+        res = AIScenarioRecord(name=scenario_path.stem)
+
+        try:
+            scenario = ElementTree.parse(f"{scenario_path}").getroot().find('scenario')
+        except (ElementTree.ParseError, OSError) as e:
+            logging.warning(f"Unable to parse AI scenario {scenario_path}: {e}")
+            return res
+
+        if scenario is None:
+            return res
+
+        description = scenario.findtext('description')
+
+        if description:
+            res.description = ' '.join(description.split())
+
+        for entry in scenario.findall('entry'):
+            entry_type = (entry.findtext('type') or '').strip()
+            entry_name = (entry.findtext('name') or '').strip()
+
+            if not entry_name:
+                continue
+
+            if entry_type == 'carrier':
+                res.carriers.append(entry_name)
+            elif entry_type == 'ship':
+                res.ships.append(entry_name)
+
+        return res
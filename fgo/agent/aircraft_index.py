@@ -0,0 +1,139 @@
+from dataclasses import dataclass, field
+from contextlib import closing
+from xml.etree import ElementTree
+from pathlib import Path
+import threading
+import logging
+import sqlite3
+import typing
+import os
+
+
+def working_copy_revision(directory: Path) -> typing.Union[int, None]:
+    '''
+    Returns the revision the working copy was checked out or last updated
+    at, read straight from svn's working copy database so that we don't
+    have to run `svn info` for every aircraft
+    '''
+    wc_db = Path(directory, '.svn', 'wc.db')
+
+    if not wc_db.exists():
+        return None
+
+    try:
+        with closing(sqlite3.connect(f"{wc_db.resolve().as_uri()}?mode=ro", uri=True)) as connection:
+            row = connection.execute(
+                "SELECT revision FROM NODES WHERE local_relpath = '' AND op_depth = 0"
+            ).fetchone()
+    except sqlite3.Error as e:
+        logging.debug(f"Unable to read the svn revision of {directory}: {e}")
+        return None
+
+    if row is None:
+        return None
+
+    return row[0]
+
+
+@dataclass
+class AircraftRecord:
+    name: str
+    variants: typing.List[str] = field(default_factory=list)
+    version: str = None
+    revision: int = None
+
+
+class AircraftIndex:
+    '''
+    Inventory of the aircraft under aircraft_path, one per directory holding
+    *-set.xml files.
+
+    Each directory is only read again when its mtime, or the mtime of its
+    svn working copy database, has changed, so refreshing the index after an
+    install costs a stat or two per aircraft.
+    '''
+    def __init__(self, config):
+        self._config = config
+        self._lock = threading.Lock()
+        # directory -> (mtimes, record)
+        self._cache: typing.Dict[Path, typing.Tuple[tuple, typing.Union[AircraftRecord, None]]] = {}
+
+    def aircraft(self) -> typing.List[AircraftRecord]:
+        aircraft_path = self._config.aircraft_path
+        res = []
+
+        if not aircraft_path:
+            return res
+
+        try:
+            # dot directories are partial copies from peers, see aircraft_share
+            directories = sorted(
+                entry.path for entry in os.scandir(aircraft_path)
+                if entry.is_dir() and not entry.name.startswith('.')
+            )
+        except OSError as e:
+            logging.warning(f"Unable to list aircraft in {aircraft_path}: {e}")
+            return res
+
+        with self._lock:
+            cache = {}
+
+            for directory in directories:
+                directory = Path(directory)
+                mtimes = self._mtimes(directory)
+                memo = self._cache.get(directory)
+
+                if memo is None or memo[0] != mtimes:
+                    memo = (mtimes, self._read(directory))
+
+                cache[directory] = memo
+
+                if memo[1] is not None:
+                    res.append(memo[1])
+
+            # forget aircraft that have been deleted
+            self._cache = cache
+
+        return res
+
+    @staticmethod
+    def _mtimes(directory: Path) -> tuple:
+        res = []
+
+        for path in [directory, Path(directory, '.svn', 'wc.db')]:
+            try:
+                res.append(path.stat().st_mtime_ns)
+            except OSError:
+                res.append(None)
+
+        return tuple(res)
+
+    def _read(self, directory: Path) -> typing.Union[AircraftRecord, None]:
+        variants = sorted(path.name[:-len('-set.xml')] for path in directory.glob('*-set.xml'))
+
+        if not variants:
+            return None
+
+        return AircraftRecord(
+            name=directory.name,
+            variants=variants,
+            version=self._read_version(Path(directory, f"{directory.name}-set.xml")),
+            revision=working_copy_revision(directory)
+        )
+
+    @staticmethod
+    def _read_version(set_path: Path) -> typing.Union[str, None]:
+        ''' Returns /sim/aircraft-version from the aircraft's main -set.xml '''
+        if not set_path.exists():
+            return None
+
+        try:
+            version = ElementTree.parse(f"{set_path}").getroot().findtext('sim/aircraft-version')
+        except (ElementTree.ParseError, OSError) as e:
+            logging.debug(f"Unable to read the version from {set_path}: {e}")
+            return None
+
+        if version:
+            return version.strip()
+
+        return None
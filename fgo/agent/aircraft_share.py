@@ -0,0 +1,198 @@
+from pathlib import Path, PurePosixPath
+import tarfile
+import logging
+import shutil
+import typing
+import time
+import os
+import re
+
+import requests
+
+from fgo.agent.aircraft_index import working_copy_revision
+
+CHUNK_SIZE = 1024 * 1024
+
+# svn names are single directory names, e.g. c172p or A320-family
+SVN_NAME = re.compile(r'^[A-Za-z0-9][A-Za-z0-9._-]*$')
+
+
+def is_valid_svn_name(svn_name: str) -> bool:
+    return SVN_NAME.search(svn_name) is not None
+
+
+def manifest(aircraft_path: Path, svn_name: str, installing: bool) -> typing.Dict[str, typing.Any]:
+    directory = Path(aircraft_path, svn_name)
+    revision = working_copy_revision(directory)
+
+    return {
+        'name': svn_name,
+        'installing': installing,
+        'available': revision is not None and not installing,
+        'revision': revision,
+    }
+
+
+def tar_stream(directory: Path) -> typing.Iterator[bytes]:
+    '''
+    Yields directory as an uncompressed tar, .svn included so that the copy
+    is a working copy svn can carry on updating. Files are read in chunks so
+    large textures are never held in memory.
+    '''
+    directory = Path(directory)
+
+    for dirpath, dirnames, filenames in os.walk(directory):
+        dirnames.sort()
+        dirpath = Path(dirpath)
+
+        if dirpath != directory:
+            yield _tar_info(dirpath, directory, tarfile.DIRTYPE).tobuf(format=tarfile.PAX_FORMAT)
+
+        for name in sorted(filenames):
+            path = Path(dirpath, name)
+
+            if path.is_symlink() or not path.is_file():
+                continue
+
+            info = _tar_info(path, directory, tarfile.REGTYPE)
+            yield info.tobuf(format=tarfile.PAX_FORMAT)
+
+            with open(path, 'rb') as fh:
+                remaining = info.size
+
+                while remaining > 0:
+                    chunk = fh.read(min(CHUNK_SIZE, remaining))
+
+                    if not chunk:
+                        # the file shrank under us, keep the archive consistent
+                        chunk = b'\0' * remaining
+
+                    remaining -= len(chunk)
+                    yield chunk
+
+            if info.size % tarfile.BLOCKSIZE:
+                yield b'\0' * (tarfile.BLOCKSIZE - info.size % tarfile.BLOCKSIZE)
+
+    yield b'\0' * (tarfile.BLOCKSIZE * 2)
+
+
+def _tar_info(path: Path, directory: Path, type_: bytes) -> tarfile.TarInfo:
+    stat = path.stat()
+    info = tarfile.TarInfo(path.relative_to(directory).as_posix())
+    info.type = type_
+    info.mtime = int(stat.st_mtime)
+    info.mode = stat.st_mode & 0o777
+
+    if type_ == tarfile.REGTYPE:
+        info.size = stat.st_size
+
+    return info
+
+
+class PeerInstaller:
+    '''
+    Copies an aircraft from the first peer agent that has it, waiting for
+    peers that are still installing it themselves, for as long as they are
+    while keep_waiting() is true.
+    '''
+    CONNECT_TIMEOUT = 5
+    READ_TIMEOUT = 60
+    POLL_INTERVAL = 2
+    # how long we wait for a peer to finish installing before using svn,
+    # unless keep_waiting() is true
+    PEER_WAIT_TIMEOUT = 900
+
+    def __init__(self, peers: typing.List[str], keep_waiting: typing.Callable[[], bool] = lambda: False):
+        self._peers = peers
+        self._keep_waiting = keep_waiting
+
+    def install(
+        self,
+        svn_name: str,
+        target: Path,
+        on_file: typing.Callable[[int], None],
+        local_revision: int = None
+    ) -> typing.Union[int, None]:
+        '''
+        Replaces target with a peer's copy of svn_name if a peer has a newer
+        revision than local_revision, returns the revision copied or None
+        '''
+        peer = self._wait_for_peer(svn_name, local_revision)
+
+        if peer is None:
+            return None
+
+        url, revision = peer
+        partial = Path(target.parent, f".{svn_name}.fgo-partial")
+        shutil.rmtree(partial, ignore_errors=True)
+        logging.info(f"Copying '{svn_name}' at revision {revision} from {url}")
+
+        try:
+            with requests.get(f"{url}/tar", stream=True, timeout=(self.CONNECT_TIMEOUT, self.READ_TIMEOUT)) as response:
+                response.raise_for_status()
+                response.raw.decode_content = True
+                self._extract(response.raw, partial, on_file)
+
+            if target.exists():
+                shutil.rmtree(target)
+
+            partial.rename(target)
+        except (requests.exceptions.RequestException, tarfile.TarError, OSError, ValueError) as e:
+            logging.warning(f"Unable to copy '{svn_name}' from {url}: {e}")
+            shutil.rmtree(partial, ignore_errors=True)
+            return None
+
+        return revision
+
+    def _wait_for_peer(self, svn_name: str, local_revision: int) -> typing.Union[typing.Tuple[str, int], None]:
+        deadline = time.monotonic() + self.PEER_WAIT_TIMEOUT
+
+        while True:
+            any_installing = False
+
+            for peer in self._peers:
+                url = f"http://{peer}/aircraft/{svn_name}"
+
+                try:
+                    res = requests.get(url, timeout=(self.CONNECT_TIMEOUT, self.READ_TIMEOUT))
+                    res.raise_for_status()
+                    memo = res.json()
+                except (requests.exceptions.RequestException, ValueError) as e:
+                    logging.debug(f"Peer {peer} can't share '{svn_name}': {e}")
+                    continue
+
+                if memo['installing']:
+                    any_installing = True
+                    continue
+
+                if memo['available'] and (local_revision is None or memo['revision'] > local_revision):
+                    return url, memo['revision']
+
+            if not any_installing or (time.monotonic() >= deadline and not self._keep_waiting()):
+                return None
+
+            time.sleep(self.POLL_INTERVAL)
+
+    @staticmethod
+    def _extract(fileobj, target: Path, on_file: typing.Callable[[int], None]):
+        target.mkdir(parents=True)
+
+        with tarfile.open(fileobj=fileobj, mode='r|') as tar:
+            for member in tar:
+                parts = PurePosixPath(member.name).parts
+
+                if member.name.startswith('/') or '..' in parts:
+                    raise ValueError(f"Refusing to extract {member.name}")
+
+                path = Path(target, *parts)
+
+                if member.isdir():
+                    path.mkdir(parents=True, exist_ok=True)
+                elif member.isfile():
+                    path.parent.mkdir(parents=True, exist_ok=True)
+
+                    with open(path, 'wb') as fh:
+                        shutil.copyfileobj(tar.extractfile(member), fh, CHUNK_SIZE)
+
+                    os.utime(path, (member.mtime, member.mtime))
+                    on_file(member.size)
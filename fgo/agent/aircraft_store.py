@@ -0,0 +1,337 @@
+from dataclasses import dataclass
+from pathlib import Path, PurePosixPath
+import threading
+import datetime
+import hashlib
+import logging
+import shutil
+import typing
+import json
+import os
+
+from fgo.agent.aircraft_index import working_copy_revision
+
+# lives next to the aircraft so that objects can be hard links, the dot
+# keeps it out of the aircraft index
+STORE_DIRECTORY = '.fgo-store'
+CHUNK_SIZE = 1024 * 1024
+
+
+@dataclass
+class SnapshotRecord:
+    svn_name: str
+    revision: int
+    created_at: datetime.datetime
+    files: int
+    bytes: int
+
+
+class AircraftStore:
+    '''
+    Content-addressed store of aircraft working copies, one manifest per
+    aircraft revision listing the sha256 of every file.
+
+    Files are stored once however many revisions use them, as hard links to
+    the working copy where possible. svn replaces working files and
+    pristines rather than writing into them, so a link keeps the content it
+    was stored with; the rest of .svn, wc.db in particular, is written in
+    place and is always copied. Anything else editing a linked file in place
+    changes the object too, so objects are checked against their hash when
+    they are restored.
+    '''
+    def __init__(self, config):
+        self._config = config
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self._config.aircraft_path) and self._config.aircraft_store_revisions > 0
+
+    def snapshots(self, svn_name: str = None) -> typing.List[SnapshotRecord]:
+        ''' Returns the stored revisions, newest first for each aircraft '''
+        res = []
+
+        if not self._config.aircraft_path:
+            return res
+
+        manifests_path = Path(self._root(), 'manifests')
+
+        if svn_name is not None:
+            directories = [Path(manifests_path, svn_name)]
+        elif manifests_path.exists():
+            directories = sorted(path for path in manifests_path.iterdir() if path.is_dir())
+        else:
+            directories = []
+
+        for directory in directories:
+            for manifest_path in self._manifest_paths(directory):
+                manifest = self._read_manifest(manifest_path)
+
+                if manifest is None:
+                    continue
+
+                res.append(SnapshotRecord(
+                    svn_name=manifest['svn_name'],
+                    revision=manifest['revision'],
+                    created_at=datetime.datetime.fromisoformat(manifest['created_at']),
+                    files=len(manifest['files']),
+                    bytes=sum(entry[4] for entry in manifest['files'])
+                ))
+
+        return res
+
+    def snapshot(self, svn_name: str, is_installing: typing.Callable[[], bool]) -> typing.Union[SnapshotRecord, None]:
+        '''
+        Stores the working copy of svn_name at its current revision, unless
+        that revision is already stored. Nothing is stored if the working
+        copy changed while it was being read.
+        '''
+        directory = Path(self._config.aircraft_path, svn_name)
+        revision = working_copy_revision(directory)
+
+        if revision is None:
+            return None
+
+        manifest_path = Path(self._root(), 'manifests', svn_name, f"{revision}.json")
+
+        if manifest_path.exists():
+            return None
+
+        logging.info(f"Storing '{svn_name}' at revision {revision}")
+        files = []
+        directories = []
+
+        with self._lock:
+            for dirpath, dirnames, filenames in os.walk(directory):
+                dirnames.sort()
+                dirpath = Path(dirpath)
+
+                if dirpath != directory:
+                    directories.append(dirpath.relative_to(directory).as_posix())
+
+                for name in sorted(filenames):
+                    path = Path(dirpath, name)
+
+                    if path.is_symlink() or not path.is_file():
+                        continue
+
+                    relpath = path.relative_to(directory).as_posix()
+                    stat = path.stat()
+                    digest = self._store_object(path, self._must_copy(relpath))
+                    files.append([relpath, digest, stat.st_mode & 0o777, stat.st_mtime_ns, stat.st_size])
+
+            if is_installing() or working_copy_revision(directory) != revision:
+                logging.info(f"'{svn_name}' changed while it was being stored, discarding revision {revision}")
+                self._collect_garbage()
+                return None
+
+            created_at = datetime.datetime.now()
+            manifest_path.parent.mkdir(parents=True, exist_ok=True)
+            partial_path = manifest_path.with_suffix('.partial')
+            partial_path.write_text(json.dumps({
+                'svn_name': svn_name,
+                'revision': revision,
+                'created_at': created_at.isoformat(),
+                'directories': directories,
+                'files': files,
+            }))
+            os.replace(partial_path, manifest_path)
+            self._collect_garbage()
+
+        return SnapshotRecord(
+            svn_name=svn_name,
+            revision=revision,
+            created_at=created_at,
+            files=len(files),
+            bytes=sum(entry[4] for entry in files)
+        )
+
+    def restore(
+        self,
+        svn_name: str,
+        target: Path,
+        on_file: typing.Callable[[int], None],
+        revision: int = None
+    ) -> typing.Union[int, None]:
+        '''
+        Replaces target with the stored revision of svn_name, the newest if
+        revision is None. Returns the revision restored, or None if it isn't
+        in the store.
+        '''
+        with self._lock:
+            manifest_paths = self._manifest_paths(Path(self._root(), 'manifests', svn_name))
+
+            if revision is not None:
+                manifest_paths = [path for path in manifest_paths if path.stem == f"{revision}"]
+
+            if not manifest_paths:
+                return None
+
+            manifest = self._read_manifest(manifest_paths[0])
+
+            if manifest is None:
+                return None
+
+            partial = Path(target.parent, f".{svn_name}.fgo-partial")
+            shutil.rmtree(partial, ignore_errors=True)
+            logging.info(f"Restoring '{svn_name}' at revision {manifest['revision']} from the aircraft store")
+
+            try:
+                partial.mkdir(parents=True)
+
+                for relpath in manifest['directories']:
+                    Path(partial, *PurePosixPath(relpath).parts).mkdir(parents=True, exist_ok=True)
+
+                for relpath, digest, mode, mtime_ns, size in manifest['files']:
+                    source = self._object_path(digest)
+
+                    if self._digest(source) != digest:
+                        source.unlink()
+                        raise ValueError(f"{source} has been changed since it was stored")
+
+                    path = Path(partial, *PurePosixPath(relpath).parts)
+                    self._place(source, path, self._must_copy(relpath))
+                    os.chmod(path, mode)
+                    os.utime(path, ns=(mtime_ns, mtime_ns))
+                    on_file(size)
+
+                if target.exists():
+                    shutil.rmtree(target)
+
+                partial.rename(target)
+            except (OSError, ValueError) as e:
+                logging.warning(f"Unable to restore '{svn_name}' from the aircraft store: {e}")
+                shutil.rmtree(partial, ignore_errors=True)
+                return None
+
+        return manifest['revision']
+
+    def forget(self, svn_name: str):
+        ''' Drops every stored revision of svn_name '''
+        if not self._config.aircraft_path:
+            return
+
+        with self._lock:
+            shutil.rmtree(Path(self._root(), 'manifests', svn_name), ignore_errors=True)
+            self._collect_garbage()
+
+    def prune(self, is_installing: typing.Callable[[str], bool]) -> int:
+        '''
+        Drops the stored revisions of each aircraft other than the one it is
+        checked out at, whose objects are mostly links to the working copy
+        and take up next to no space. Returns how many were dropped.
+        '''
+        if not self._config.aircraft_path:
+            return 0
+
+        dropped = 0
+        manifests_path = Path(self._root(), 'manifests')
+
+        with self._lock:
+            for directory in manifests_path.iterdir() if manifests_path.exists() else []:
+                if is_installing(directory.name):
+                    continue
+
+                revision = working_copy_revision(Path(self._config.aircraft_path, directory.name))
+
+                for manifest_path in self._manifest_paths(directory):
+                    if manifest_path.stem != f"{revision}":
+                        logging.info(f"Dropping {manifest_path} from the aircraft store to stay within budget")
+                        manifest_path.unlink()
+                        dropped += 1
+
+            if dropped:
+                self._collect_garbage()
+
+        return dropped
+
+    def _root(self) -> Path:
+        return Path(self._config.aircraft_path, STORE_DIRECTORY)
+
+    def _object_path(self, digest: str) -> Path:
+        return Path(self._root(), 'objects', digest[:2], digest)
+
+    @staticmethod
+    def _must_copy(relpath: str) -> bool:
+        parts = PurePosixPath(relpath).parts
+        return parts[0] == '.svn' and (len(parts) < 2 or parts[1] != 'pristine')
+
+    @staticmethod
+    def _manifest_paths(directory: Path) -> typing.List[Path]:
+        ''' Newest revision first '''
+        if not directory.exists():
+            return []
+
+        return sorted(
+            (path for path in directory.glob('*.json') if path.stem.isdigit()),
+            key=lambda path: int(path.stem),
+            reverse=True
+        )
+
+    @staticmethod
+    def _read_manifest(manifest_path: Path) -> typing.Union[typing.Dict[str, typing.Any], None]:
+        try:
+            return json.loads(manifest_path.read_text())
+        except (OSError, ValueError) as e:
+            logging.warning(f"Unable to read aircraft store manifest {manifest_path}: {e}")
+            return None
+
+    @staticmethod
+    def _digest(path: Path) -> str:
+        digest = hashlib.sha256()
+
+        with open(path, 'rb') as fh:
+            for chunk in iter(lambda: fh.read(CHUNK_SIZE), b''):
+                digest.update(chunk)
+
+        return digest.hexdigest()
+
+    def _store_object(self, path: Path, copy: bool) -> str:
+        digest = self._digest(path)
+        object_path = self._object_path(digest)
+
+        if not object_path.exists():
+            object_path.parent.mkdir(parents=True, exist_ok=True)
+            partial_path = Path(object_path.parent, f".{digest}.partial")
+            self._place(path, partial_path, copy)
+            os.replace(partial_path, object_path)
+
+        return digest
+
+    @staticmethod
+    def _place(source: Path, target: Path, copy: bool):
+        if target.exists():
+            target.unlink()
+
+        if not copy:
+            try:
+                os.link(source, target)
+                return
+            except OSError as e:
+                # e.g. a file system without hard links
+                logging.debug(f"Unable to link {target}, copying instead: {e}")
+
+        shutil.copyfile(source, target)
+
+    def _collect_garbage(self):
+        ''' Drops all but the newest revisions of each aircraft, then the objects nothing uses '''
+        keep = self._config.aircraft_store_revisions
+        manifests_path = Path(self._root(), 'manifests')
+        referenced = set()
+
+        for directory in manifests_path.iterdir() if manifests_path.exists() else []:
+            manifest_paths = self._manifest_paths(directory)
+
+            for manifest_path in manifest_paths[keep:]:
+                logging.info(f"Dropping {manifest_path} from the aircraft store")
+                manifest_path.unlink()
+
+            for manifest_path in manifest_paths[:keep]:
+                manifest = self._read_manifest(manifest_path)
+
+                if manifest is not None:
+                    referenced.update(entry[1] for entry in manifest['files'])
+
+        for object_path in Path(self._root(), 'objects').glob('*/*'):
+            if object_path.name not in referenced:
+                object_path.unlink()
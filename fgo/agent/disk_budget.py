@@ -0,0 +1,381 @@
+from dataclasses import dataclass
+from pathlib import Path
+import subprocess
+import threading
+import datetime
+import hashlib
+import logging
+import sqlite3
+import shutil
+import typing
+import time
+import os
+import re
+
+from fgo.gql import types
+from fgo.util import tile_name
+from fgo.agent.property_client import PropertyClient
+from fgo.agent.aircraft_store import STORE_DIRECTORY
+
+AIRCRAFT = 'aircraft'
+TERRASYNC = 'terrasync'
+
+# e.g. Terrain/e010n50/e013n52, see http://wiki.flightgear.org/Tile_Index_Scheme
+TILE_BUCKET = re.compile(r'^([ew])(\d{3})([ns])(\d{2})$')
+
+
+@dataclass
+class UsageRecord:
+    kind: str
+    path: str
+    bytes: int
+    files: int
+    last_used: float
+    protected: bool = False
+
+    def to_gql(self) -> types.DiskUsageEntry:
+        return types.DiskUsageEntry(
+            path=self.path,
+            bytes=self.bytes,
+            files=self.files,
+            last_used=datetime.datetime.fromtimestamp(self.last_used),
+            protected=self.protected
+        )
+
+
+class DiskBudget(threading.Thread):
+    '''
+    Keeps aircraft_path and terrasync_path within their budgets by removing
+    the least recently used aircraft and 1x1 degree scenery tiles.
+
+    Sizes live in a small sqlite index in base_dir keyed on each directory's
+    mtime (and wc.db's for aircraft), so a check is a stat per aircraft and
+    tile and only directories that changed are walked again.
+
+    Nothing the running FGFS session uses is removed: its aircraft, and the
+    tiles around its position, or every tile if FGFS can't tell us where it
+    is.
+
+    The aircraft store counts towards the aircraft budget as what it holds
+    besides links to the working copies. It is never removed as a whole,
+    revisions that aren't checked out are dropped from it before any
+    aircraft is.
+    '''
+    KINDS = [AIRCRAFT, TERRASYNC]
+    # degrees either side of the session's position whose tiles are in use
+    SESSION_RADIUS = 2
+
+    def __init__(
+        self,
+        config,
+        get_process: typing.Callable[[], typing.Union[subprocess.Popen, None]],
+        is_installing: typing.Callable[[str], bool],
+        on_aircraft_evicted: typing.Callable[[str], None],
+        prune_aircraft_store: typing.Callable[[typing.Callable[[str], bool]], int],
+        interval: float = 300
+    ):
+        super(DiskBudget, self).__init__(name='fgo-disk-budget', daemon=True)
+        self._config = config
+        self._get_process = get_process
+        self._is_installing = is_installing
+        self._on_aircraft_evicted = on_aircraft_evicted
+        self._prune_aircraft_store = prune_aircraft_store
+        self._interval = interval
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._connection = None
+        self._session_aircraft: typing.Union[str, None] = None
+        self._session_probe: typing.Union[PropertyClient, None] = None
+
+    def stop(self):
+        self._stopped.set()
+
+    def run(self):
+        while not self._stopped.wait(self._interval):
+            try:
+                if any(self.budget(kind) is not None for kind in self.KINDS):
+                    self.enforce()
+                else:
+                    self.usage()
+            except Exception:
+                logging.exception("Unable to check the disk budget")
+
+    def session_started(self, args: typing.List[str], probe: PropertyClient):
+        aircraft = None
+
+        for arg in args:
+            if arg.startswith('--aircraft='):
+                aircraft = arg[len('--aircraft='):]
+
+        with self._lock:
+            self._session_aircraft = aircraft
+            self._session_probe = probe
+
+    def session_aircraft(self) -> typing.Set[str]:
+        '''
+        Returns the aircraft directories the running FGFS session uses,
+        without waiting for a check of the budget that is under way
+        '''
+        fg_process = self._get_process()
+
+        if fg_process is None or fg_process.poll() is not None:
+            return set()
+
+        return self._aircraft_directories(self._session_aircraft)
+
+    def usage(self) -> typing.List[UsageRecord]:
+        ''' Returns every aircraft and tile, least recently used first '''
+        with self._lock:
+            return self._refresh()
+
+    def enforce(self) -> typing.List[UsageRecord]:
+        ''' Removes least recently used content until each kind is within budget, returns what was removed '''
+        evicted = []
+
+        with self._lock:
+            records = self._refresh()
+            aircraft_budget = self.budget(AIRCRAFT)
+
+            if aircraft_budget is not None and \
+                    sum(record.bytes for record in records if record.kind == AIRCRAFT) > aircraft_budget and \
+                    self._prune_aircraft_store(self._is_installing):
+                records = self._refresh()
+
+            for kind in self.KINDS:
+                budget = self.budget(kind)
+
+                if budget is None:
+                    continue
+
+                total = sum(record.bytes for record in records if record.kind == kind)
+
+                for record in records:
+                    if total <= budget:
+                        break
+
+                    if record.kind != kind or record.protected:
+                        continue
+
+                    if self._evict(record):
+                        total -= record.bytes
+                        evicted.append(record)
+
+                if total > budget:
+                    logging.warning(f"Unable to bring {kind} within its budget of {budget} bytes, {total} bytes are in use")
+
+        return evicted
+
+    def budget(self, kind: str) -> typing.Union[int, None]:
+        gigabytes = getattr(self._config, f"{kind}_budget_gb")
+
+        if gigabytes is None:
+            return None
+
+        return gigabytes * 1024 ** 3
+
+    def _db(self) -> sqlite3.Connection:
+        if self._connection is None:
+            db_path = Path(self._config.base_dir, 'disk_usage.sqlite') if self._config.base_dir else ':memory:'
+            self._connection = sqlite3.connect(f"{db_path}", check_same_thread=False)
+            self._connection.execute('''
+                CREATE TABLE IF NOT EXISTS usage (
+                    kind TEXT NOT NULL,
+                    path TEXT NOT NULL,
+                    key TEXT NOT NULL,
+                    bytes INTEGER NOT NULL,
+                    files INTEGER NOT NULL,
+                    last_used REAL NOT NULL,
+                    PRIMARY KEY (kind, path)
+                )
+            ''')
+
+        return self._connection
+
+    def _refresh(self) -> typing.List[UsageRecord]:
+        db = self._db()
+        now = time.time()
+        session_aircraft, session_tiles = self._session()
+        res = []
+
+        with db:
+            for kind, root in [(AIRCRAFT, self._config.aircraft_path), (TERRASYNC, self._config.terrasync_path)]:
+                known = {
+                    row[0]: row[1:]
+                    for row in db.execute('SELECT path, key, bytes, files, last_used FROM usage WHERE kind = ?', (kind,))
+                }
+                seen = set()
+
+                for path, key in self._units(kind, root):
+                    seen.add(path)
+                    memo = known.get(path)
+                    is_store = kind == AIRCRAFT and path == STORE_DIRECTORY
+                    protected = (kind == AIRCRAFT and path in session_aircraft) or \
+                        (kind == TERRASYNC and (session_tiles is True or path.split('/')[-1] in session_tiles))
+
+                    if memo is None or memo[0] != key:
+                        # objects linked into a working copy are counted with that aircraft
+                        size, files = self._walk(Path(root, path), unlinked_only=is_store)
+                        # a change on disk is as good as a use, TerraSync or svn put it there
+                        last_used = max(memo[3] if memo else 0, self._mtime(Path(root, path)))
+                        db.execute(
+                            'INSERT OR REPLACE INTO usage (kind, path, key, bytes, files, last_used) VALUES (?, ?, ?, ?, ?, ?)',
+                            (kind, path, key, size, files, last_used)
+                        )
+                        memo = (key, size, files, last_used)
+
+                    # every tile is protected when we don't know where FGFS is,
+                    # that says nothing about which of them it is using
+                    if protected and not (kind == TERRASYNC and session_tiles is True):
+                        db.execute('UPDATE usage SET last_used = ? WHERE kind = ? AND path = ?', (now, kind, path))
+                        memo = (memo[0], memo[1], memo[2], now)
+
+                    res.append(UsageRecord(
+                        kind=kind,
+                        path=path,
+                        bytes=memo[1],
+                        files=memo[2],
+                        last_used=memo[3],
+                        protected=protected or is_store or (kind == AIRCRAFT and self._is_installing(path))
+                    ))
+
+                for path in set(known) - seen:
+                    db.execute('DELETE FROM usage WHERE kind = ? AND path = ?', (kind, path))
+
+        res.sort(key=lambda record: record.last_used)
+        return res
+
+    def _session(self) -> typing.Tuple[typing.Set[str], typing.Union[typing.Set[str], bool]]:
+        '''
+        Returns the aircraft directories and the tile names the running
+        session uses, True for tiles if that isn't known
+        '''
+        fg_process = self._get_process()
+
+        if fg_process is None or fg_process.poll() is not None:
+            return set(), set()
+
+        aircraft = self._aircraft_directories(self._session_aircraft)
+
+        if self._session_probe is None:
+            return aircraft, True
+
+        try:
+            lat = float(self._session_probe.get('/position/latitude-deg'))
+            lon = float(self._session_probe.get('/position/longitude-deg'))
+        except (TypeError, ValueError):
+            return aircraft, True
+
+        tiles = set()
+
+        for lat_offset in range(-self.SESSION_RADIUS, self.SESSION_RADIUS + 1):
+            for lon_offset in range(-self.SESSION_RADIUS, self.SESSION_RADIUS + 1):
+                tiles.add(tile_name(lat + lat_offset, lon + lon_offset))
+
+        return aircraft, tiles
+
+    def _aircraft_directories(self, variant: typing.Union[str, None]) -> typing.Set[str]:
+        aircraft = set()
+
+        if variant and self._config.aircraft_path:
+            # --aircraft names a variant, i.e. a -set.xml in some directory
+            for set_path in Path(self._config.aircraft_path).glob(f"*/{variant}-set.xml"):
+                aircraft.add(set_path.parent.name)
+
+        return aircraft
+
+    @staticmethod
+    def _units(kind: str, root: typing.Union[Path, None]) -> typing.Iterator[typing.Tuple[str, str]]:
+        ''' Yields (path relative to root, key that changes when its contents do) '''
+        if not root or not Path(root).exists():
+            return
+
+        if kind == AIRCRAFT:
+            keys = []
+
+            for entry in os.scandir(root):
+                # dot directories belong to fgo, see aircraft_store
+                if entry.is_dir() and not entry.name.startswith('.'):
+                    wc_db = Path(entry.path, '.svn', 'wc.db')
+                    wc_mtime = wc_db.stat().st_mtime_ns if wc_db.exists() else None
+                    keys.append(f"{entry.name}:{entry.stat().st_mtime_ns}:{wc_mtime}")
+                    yield entry.name, keys[-1]
+
+            store = Path(root, STORE_DIRECTORY)
+
+            if store.is_dir():
+                # an update that replaces a linked file leaves the store the
+                # only copy of the object, so the store changes with any aircraft
+                for directory in [Path(store, 'manifests'), Path(store, 'objects')]:
+                    for entry in os.scandir(directory) if directory.is_dir() else []:
+                        keys.append(f"{directory.name}/{entry.name}:{entry.stat().st_mtime_ns}")
+
+                yield STORE_DIRECTORY, hashlib.md5(' '.join(keys).encode()).hexdigest()
+
+            return
+
+        # Terrain, Objects, Buildings etc. each hold 10x10 then 1x1 degree buckets
+        for category in os.scandir(root):
+            if not category.is_dir():
+                continue
+
+            for bucket in os.scandir(category.path):
+                if not bucket.is_dir() or TILE_BUCKET.search(bucket.name) is None:
+                    continue
+
+                for tile in os.scandir(bucket.path):
+                    if tile.is_dir() and TILE_BUCKET.search(tile.name) is not None:
+                        yield f"{category.name}/{bucket.name}/{tile.name}", f"{tile.stat().st_mtime_ns}"
+
+    @staticmethod
+    def _walk(directory: Path, unlinked_only: bool = False) -> typing.Tuple[int, int]:
+        ''' Returns the bytes and number of files under directory, only of files with no other links if unlinked_only '''
+        size = 0
+        files = 0
+
+        for dirpath, _, filenames in os.walk(directory):
+            for name in filenames:
+                try:
+                    stat = os.lstat(os.path.join(dirpath, name))
+
+                    if unlinked_only and stat.st_nlink > 1:
+                        continue
+
+                    size += stat.st_size
+                    files += 1
+                except OSError:
+                    pass
+
+        return size, files
+
+    @staticmethod
+    def _mtime(path: Path) -> float:
+        try:
+            return path.stat().st_mtime
+        except OSError:
+            return 0
+
+    def _evict(self, record: UsageRecord) -> bool:
+        root = self._config.aircraft_path if record.kind == AIRCRAFT else self._config.terrasync_path
+        path = Path(root, record.path)
+        logging.info(f"Removing {path}, {record.bytes} bytes last used at {time.ctime(record.last_used)}, to stay within budget")
+
+        try:
+            shutil.rmtree(path)
+        except OSError as e:
+            logging.warning(f"Unable to remove {path}: {e}")
+            return False
+
+        self._db().execute('DELETE FROM usage WHERE kind = ? AND path = ?', (record.kind, record.path))
+        self._db().commit()
+
+        if record.kind == AIRCRAFT:
+            self._on_aircraft_evicted(record.path)
+        else:
+            try:
+                # the 10x10 degree bucket, if that was its last tile
+                path.parent.rmdir()
+            except OSError:
+                pass
+
+        return True
+
@@ -0,0 +1,103 @@
+from logging.handlers import RotatingFileHandler
+from collections import deque
+from pathlib import Path
+import itertools
+import threading
+import logging
+import typing
+
+
+class FgfsLog:
+    '''
+    Keeps the tail of FlightGear's combined stdout/stderr in memory.
+
+    Every line gets the next offset in a sequence that carries on across FGFS
+    runs, so a client can ask for what came after the last line it saw. The
+    oldest lines are dropped once the buffer holds more than max_bytes.
+    With log_path lines are written there as well, rotated once the file
+    holds more than file_max_bytes.
+    '''
+    # FGFS occasionally dumps huge single lines, e.g. whole property trees
+    MAX_LINE_LENGTH = 4096
+    # rotated files kept next to log_path
+    FILE_BACKUP_COUNT = 5
+
+    def __init__(self, max_bytes: int = 1024 * 1024, log_path: Path = None, file_max_bytes: int = 50 * 1024 * 1024):
+        self._max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._lines: typing.Deque[str] = deque()
+        self._bytes = 0
+        self._first_offset = 0
+        self._file_logger = None
+
+        if log_path is not None:
+            handler = RotatingFileHandler(
+                f"{log_path}",
+                maxBytes=file_max_bytes,
+                backupCount=self.FILE_BACKUP_COUNT,
+                encoding='utf-8'
+            )
+            handler.setFormatter(logging.Formatter('%(asctime)s %(message)s'))
+            self._file_logger = logging.getLogger('fgo.fgfs')
+            self._file_logger.propagate = False
+            self._file_logger.setLevel(logging.INFO)
+            self._file_logger.handlers = [handler]
+
+    @property
+    def next_offset(self) -> int:
+        with self._lock:
+            return self._first_offset + len(self._lines)
+
+    def follow(self, stream: typing.TextIO):
+        '''
+        Drains stream on a background thread until FGFS closes it, so that
+        FlightGear never blocks writing to a full pipe
+        '''
+        threading.Thread(
+            target=self._drain,
+            args=(stream,),
+            name='fgo-fgfs-log',
+            daemon=True
+        ).start()
+
+    def append(self, line: str):
+        line = line.rstrip('\r\n')[:self.MAX_LINE_LENGTH]
+
+        with self._lock:
+            self._lines.append(line)
+            self._bytes += len(line)
+
+            while self._bytes > self._max_bytes and len(self._lines) > 1:
+                self._bytes -= len(self._lines.popleft())
+                self._first_offset += 1
+
+        if self._file_logger is not None:
+            self._file_logger.info(line)
+
+    def read(self, since_offset: int, limit: int) -> typing.Tuple[int, typing.List[str], int]:
+        '''
+        Returns up to limit lines from since_offset on as (offset of the
+        first line returned, lines, offset to ask for next). The first offset
+        is past since_offset when the lines in between have been dropped.
+        '''
+        with self._lock:
+            next_offset = self._first_offset + len(self._lines)
+
+            # offsets from before an agent restart start over from the top
+            if since_offset > next_offset:
+                since_offset = 0
+
+            offset = max(since_offset, self._first_offset)
+            start = offset - self._first_offset
+            lines = list(itertools.islice(self._lines, start, start + max(0, limit)))
+
+        return offset, lines, offset + len(lines)
+
+    def _drain(self, stream: typing.TextIO):
+        try:
+            for line in stream:
+                self.append(line)
+        except (OSError, ValueError) as e:
+            logging.debug(f"Stopped reading FGFS output: {e}")
+        finally:
+            stream.close()
@@ -0,0 +1,58 @@
+import threading
+import typing
+
+from fgo.gql import types
+from fgo.gql.schema import get_etag
+
+
+DEFAULT_QUERY = '''
+{
+    info {
+        status
+        uuid
+        os
+        errors {
+            id
+            code
+            description
+        }
+    }
+}
+'''
+
+
+class InfoStream:
+    '''
+    Lets HTTP handlers block until the agent publishes a new Info, which is
+    what the /events Server-Sent Events endpoint is built on. An Info that
+    differs from the last one only by its timestamp isn't news.
+    '''
+    def __init__(self):
+        self._condition = threading.Condition()
+        self._info = None
+        self._etag = None
+        self._version = 0
+
+    def publish(self, info: types.Info):
+        with self._condition:
+            if info is self._info:
+                return
+
+            etag = get_etag(info)
+
+            if etag == self._etag:
+                return
+
+            self._info = info
+            self._etag = etag
+            self._version += 1
+            self._condition.notify_all()
+
+    def wait(self, version: int, timeout: float) -> typing.Tuple[int, types.Info]:
+        '''
+        Waits up to timeout seconds for an Info newer than version and
+        returns the latest version number and Info
+        '''
+        with self._condition:
+            self._condition.wait_for(lambda: self._version != version, timeout)
+            return self._version, self._info
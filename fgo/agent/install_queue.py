@@ -0,0 +1,398 @@
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from pathlib import Path
+import subprocess
+import itertools
+import threading
+import datetime
+import logging
+import typing
+import re
+import os
+
+import svn.local
+from svn.exception import SvnException
+
+from fgo.gql import types
+from fgo.agent.remote_revision_cache import RemoteRevisionCache
+from fgo.agent.aircraft_index import working_copy_revision
+from fgo.agent.aircraft_share import PeerInstaller
+from fgo.agent.aircraft_store import AircraftStore
+
+
+@dataclass
+class InstallJob:
+    id: str
+    svn_name: str
+    upstream_repo_url: str
+    force: bool = False
+    peers: typing.List[str] = field(default_factory=list)
+    restore: bool = False
+    restore_revision: int = None
+    background: bool = False
+    # called with the job and the bytes just moved, holds background jobs back
+    throttle: typing.Callable[['InstallJob', int], None] = None
+    copied_from_peer: bool = False
+    restored_from_store: bool = False
+    up_to_date: bool = False
+    state: types.JobState = field(default_factory=lambda: types.JobState.QUEUED)
+    files: int = 0
+    bytes: int = 0
+    revision: int = None
+    error: types.Error = None
+    queued_at: datetime.datetime = field(default_factory=datetime.datetime.now)
+    started_at: datetime.datetime = None
+    finished_at: datetime.datetime = None
+    reported: bool = False
+
+    @property
+    def active(self) -> bool:
+        return self.state in [types.JobState.QUEUED, types.JobState.RUNNING]
+
+    def to_gql(self) -> types.InstallJob:
+        return types.InstallJob(
+            id=self.id,
+            svn_name=self.svn_name,
+            state=self.state,
+            files=self.files,
+            bytes=self.bytes,
+            revision=self.revision,
+            up_to_date=self.up_to_date,
+            copied_from_peer=self.copied_from_peer,
+            restored_from_store=self.restored_from_store,
+            background=self.background,
+            error=self.error,
+            queued_at=self.queued_at,
+            started_at=self.started_at,
+            finished_at=self.finished_at
+        )
+
+
+class InstallQueue:
+    '''
+    Installs or updates aircraft on a pool of worker threads so that several
+    checkouts can run at once without tying up the agent state machine.
+    '''
+    # finished jobs kept around for the installJobs query
+    HISTORY_LIMIT = 50
+
+    # svn prints one line per item, e.g. "A    /path/to/file"
+    ITEM_LINE = re.compile(r'^[ADUCGER ]{1,4}\s+(.+)$')
+    REVISION_LINE = re.compile(r'^(?:Checked out|Updated to|At) revision (\d+)\.$')
+
+    def __init__(self, config, aircraft_store: AircraftStore, on_change: typing.Callable[[], None]):
+        self._config = config
+        self._aircraft_store = aircraft_store
+        self._on_change = on_change
+        self._lock = threading.Lock()
+        self._jobs: typing.List[InstallJob] = []
+        self._ids = itertools.count(1)
+        self._remote_revisions = RemoteRevisionCache(config.remote_revision_ttl)
+        self._executor = ThreadPoolExecutor(
+            max_workers=config.max_concurrent_installs,
+            thread_name_prefix='fgo-install'
+        )
+        # background jobs get their own workers so that a held one never
+        # stands in the way of installing for a launch
+        self._background_executor = ThreadPoolExecutor(
+            max_workers=config.max_concurrent_prefetches,
+            thread_name_prefix='fgo-prefetch'
+        )
+        # storing a revision reads the whole aircraft, one at a time is plenty
+        self._store_executor = ThreadPoolExecutor(
+            max_workers=1,
+            thread_name_prefix='fgo-aircraft-store'
+        )
+
+    @property
+    def active(self) -> bool:
+        ''' True while jobs the agent should wait for are queued or running '''
+        with self._lock:
+            return any(job.active and not job.background for job in self._jobs)
+
+    def jobs(self) -> typing.List[InstallJob]:
+        with self._lock:
+            return list(self._jobs)
+
+    def is_installing(self, svn_name: str) -> bool:
+        with self._lock:
+            return any(job.svn_name == svn_name and job.active for job in self._jobs)
+
+    def submit(
+        self,
+        svn_name: str,
+        svn_base_url: str,
+        force: bool = False,
+        peers: typing.List[str] = None,
+        restore: bool = False,
+        restore_revision: int = None,
+        background: bool = False,
+        throttle: typing.Callable[[InstallJob, int], None] = None
+    ) -> InstallJob:
+        '''
+        Queues an install or update of svn_name, or returns the job that is
+        already queued or running for it
+
+        Unless force is set, an existing working copy is only updated if the
+        aircraft has changed upstream since its revision. Peers are agents,
+        as host:port, to copy the aircraft from before asking svn.
+
+        With restore the job only puts back restore_revision, or the newest
+        revision, from the aircraft store and svn is left alone.
+
+        Background jobs don't keep the agent busy and are slowed or held by
+        throttle. Asking for a background job again in the foreground lets
+        it run flat out.
+
+        Asking for an aircraft again while its job is queued adds force and
+        peers to that job. Raises ValueError if the job can't do what is
+        asked: force once it is running, or when one of the two is a restore.
+        '''
+        with self._lock:
+            for job in self._jobs:
+                if job.svn_name == svn_name and job.active:
+                    new_peers = [peer for peer in peers or [] if peer not in job.peers]
+
+                    if restore != job.restore or restore_revision != job.restore_revision:
+                        raise ValueError(
+                            f"Unable to {'restore' if restore else 'install/update'} '{svn_name}', "
+                            f"install job {job.id} for it is {job.state.name.lower()}")
+
+                    if force and not job.force and job.state != types.JobState.QUEUED:
+                        raise ValueError(f"Unable to force install job {job.id} for '{svn_name}', it is running")
+
+                    if job.state == types.JobState.QUEUED:
+                        job.force = job.force or force
+                        job.peers = job.peers + new_peers
+                    elif new_peers:
+                        # a running job gets the aircraft one way or another
+                        logging.info(f"Install job {job.id} for '{svn_name}' is running, not copying from {new_peers}")
+
+                    if not background and job.background:
+                        logging.info(f"Install job {job.id} for '{svn_name}' is no longer in the background")
+                        job.background = False
+
+                    return job
+
+            job = InstallJob(
+                id=f"{next(self._ids)}",
+                svn_name=svn_name,
+                upstream_repo_url=f"{svn_base_url}/{svn_name}",
+                force=force,
+                peers=peers or [],
+                restore=restore,
+                restore_revision=restore_revision,
+                background=background,
+                throttle=throttle
+            )
+            self._jobs.append(job)
+            self._trim_history()
+
+        logging.info(f"Queued install job {job.id} for '{svn_name}'")
+
+        if background:
+            self._background_executor.submit(self._run, job)
+        else:
+            self._executor.submit(self._run, job)
+
+        return job
+
+    def take_failures(self) -> typing.List[InstallJob]:
+        ''' Returns failed jobs that have not been reported yet '''
+        with self._lock:
+            res = [
+                job for job in self._jobs
+                if job.state == types.JobState.FAILED and not job.reported and not job.background
+            ]
+
+            for job in res:
+                job.reported = True
+
+        return res
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False)
+        self._background_executor.shutdown(wait=False)
+        self._store_executor.shutdown(wait=False)
+
+    def _trim_history(self):
+        finished = [job for job in self._jobs if not job.active]
+
+        for job in finished[:max(0, len(finished) - self.HISTORY_LIMIT)]:
+            self._jobs.remove(job)
+
+    def _run(self, job: InstallJob):
+        job.state = types.JobState.RUNNING
+        job.started_at = datetime.datetime.now()
+        self._on_change()
+
+        try:
+            job.error = self._install(job)
+        except Exception as e:
+            logging.exception(f"Install job {job.id} for '{job.svn_name}' crashed")
+            job.error = types.Error(
+                code=types.ErrorCode.AIRCRAFT_INSTALL_FAILED,
+                description=f"{e}"
+            )
+
+        job.finished_at = datetime.datetime.now()
+        job.state = types.JobState.FAILED if job.error else types.JobState.DONE
+        logging.info(f"Install job {job.id} for '{job.svn_name}' finished: {job.state}")
+        self._on_change()
+
+        if job.state == types.JobState.DONE and self._aircraft_store.enabled:
+            self._store_executor.submit(self._store, job.svn_name)
+
+    def _store(self, svn_name: str):
+        try:
+            self._aircraft_store.snapshot(svn_name, lambda: self.is_installing(svn_name))
+        except Exception:
+            logging.exception(f"Unable to store '{svn_name}' in the aircraft store")
+
+    def _install(self, job: InstallJob) -> typing.Union[types.Error, None]:
+        '''
+        Checks out or updates the aircraft, returns an Error if that failed
+        '''
+        svn_name = job.svn_name
+        expected_aircraft_path = Path(self._config.aircraft_path, svn_name)
+        logging.info(f"Checking if {expected_aircraft_path} exists")
+
+        svn_not_installed_error = types.Error(
+            code=types.ErrorCode.SVN_NOT_INSTALLED,
+            description=f"Aircraft {svn_name} could not be installed. Check that you have svn installed."
+        )
+
+        if job.restore:
+            return self._restore(job, expected_aircraft_path, job.restore_revision)
+
+        if not expected_aircraft_path.exists() and self._aircraft_store.enabled:
+            # a stored revision only needs an update rather than a checkout
+            self._restore(job, expected_aircraft_path)
+
+        if job.peers:
+            local_revision = None
+
+            if expected_aircraft_path.exists():
+                local_revision = working_copy_revision(expected_aircraft_path)
+
+            if local_revision is not None or not expected_aircraft_path.exists():
+                # whatever the peer has, svn only needs to bring it up to date.
+                # In the background a peer is waited on for as long as it
+                # takes, the fleet's limits on svn are kept by the peers
+                copied_revision = PeerInstaller(job.peers, lambda: job.background).install(
+                    svn_name,
+                    expected_aircraft_path,
+                    lambda size: self._record_file(job, size, throttled=True),
+                    local_revision
+                )
+
+                if copied_revision is not None:
+                    job.revision = copied_revision
+                    job.copied_from_peer = True
+                elif job.background and local_revision is None:
+                    return types.Error(
+                        code=types.ErrorCode.AIRCRAFT_INSTALL_FAILED,
+                        description=f"Aircraft {svn_name} could not be copied from {', '.join(job.peers)}, it is left for an install in the foreground rather than fetched from svn in the background."
+                    )
+                elif job.background:
+                    logging.info(f"No peer has a newer '{svn_name}' than revision {local_revision}, leaving svn for an install in the foreground")
+                    job.revision = local_revision
+                    return None
+
+        if expected_aircraft_path.exists():
+            logging.info(f"Updating existing aircraft '{svn_name}'")
+
+            try:
+                local_info = svn.local.LocalClient(f"{expected_aircraft_path}").info()
+            except SvnException:
+                return types.Error(
+                    code=types.ErrorCode.AIRCRAFT_NOT_IN_VERSION_CONTROL,
+                    description=f"Aircraft {svn_name} is not under version control. Delete the folder {expected_aircraft_path} and try reinstalling, or restore it from the aircraft store."
+                )
+            except FileNotFoundError:
+                return svn_not_installed_error
+
+            if not job.force:
+                # asking for the last changed revision is one request, an
+                # update walks the whole working copy
+                local_revision = local_info['entry_revision']
+                remote_revision = self._remote_revisions.last_changed_revision(local_info['url'])
+
+                if remote_revision is not None and local_revision >= remote_revision:
+                    logging.info(f"Aircraft '{svn_name}' is up to date at revision {local_revision}")
+                    job.revision = local_revision
+                    job.up_to_date = True
+                    return None
+
+            args = ['svn', 'update', '--non-interactive', f"{expected_aircraft_path}"]
+        else:
+            logging.info(f"Cloning from {job.upstream_repo_url}")
+            args = ['svn', 'checkout', '--non-interactive', job.upstream_repo_url, f"{expected_aircraft_path}"]
+
+        try:
+            process = subprocess.Popen(
+                args,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.STDOUT,
+                text=True
+            )
+        except FileNotFoundError:
+            return svn_not_installed_error
+
+        svn_errors = []
+
+        for line in process.stdout:
+            line = line.rstrip('\n')
+
+            if line.startswith('svn: '):
+                svn_errors.append(line)
+            else:
+                self._record_progress(job, line)
+
+        if process.wait() != 0:
+            msg = '\n'.join(svn_errors) or f"svn exited with returncode {process.returncode}"
+            logging.error(f"Unable to install aircraft '{svn_name}': {msg}")
+            return types.Error(
+                code=types.ErrorCode.AIRCRAFT_INSTALL_FAILED,
+                description=msg
+            )
+
+        return None
+
+    def _restore(self, job: InstallJob, target: Path, revision: int = None) -> typing.Union[types.Error, None]:
+        restored_revision = self._aircraft_store.restore(
+            job.svn_name,
+            target,
+            lambda size: self._record_file(job, size),
+            revision
+        )
+
+        if restored_revision is None:
+            wanted = 'Aircraft' if revision is None else f"Revision {revision} of aircraft"
+            return types.Error(
+                code=types.ErrorCode.AIRCRAFT_NOT_IN_STORE,
+                description=f"{wanted} {job.svn_name} could not be restored from the aircraft store."
+            )
+
+        job.revision = restored_revision
+        job.restored_from_store = True
+        return None
+
+    def _record_progress(self, job: InstallJob, line: str):
+        match = self.REVISION_LINE.search(line)
+
+        if match:
+            job.revision = int(match[1])
+            return
+
+        match = self.ITEM_LINE.search(line)
+
+        if match and os.path.isfile(match[1]):
+            self._record_file(job, os.path.getsize(match[1]), throttled=True)
+
+    def _record_file(self, job: InstallJob, size: int, throttled: bool = False):
+        job.files += 1
+        job.bytes += size
+
+        if throttled and job.background and job.throttle is not None:
+            job.throttle(job, size)
@@ -0,0 +1,153 @@
+from array import array
+import subprocess
+import threading
+import logging
+import typing
+import math
+import time
+
+import psutil
+
+
+class MetricsSampler(threading.Thread):
+    '''
+    Samples the FGFS process and the host once per interval into fixed-size
+    ring buffers, one array of doubles per series, so memory use never grows
+    however long the agent runs. Series read NaN while FGFS isn't running.
+    '''
+    SERIES = [
+        'fgfs_cpu_percent',
+        'fgfs_rss_bytes',
+        'fgfs_threads',
+        'fgfs_read_bytes_per_second',
+        'fgfs_write_bytes_per_second',
+        'host_cpu_percent',
+        'host_load_average',
+        'host_memory_percent',
+    ]
+
+    def __init__(
+        self,
+        get_process: typing.Callable[[], typing.Union[subprocess.Popen, None]],
+        interval: float = 1,
+        capacity: int = 3600
+    ):
+        super(MetricsSampler, self).__init__(name='fgo-metrics', daemon=True)
+        self._get_process = get_process
+        self._interval = interval
+        self._capacity = capacity
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._timestamps = array('d', [math.nan] * capacity)
+        self._values = {name: array('d', [math.nan] * capacity) for name in self.SERIES}
+        self._next = 0
+        self._process: typing.Union[psutil.Process, None] = None
+        self._previous_io = None
+
+    def stop(self):
+        self._stopped.set()
+
+    def run(self):
+        # the first cpu_percent call only sets the baseline for the next one
+        psutil.cpu_percent(None)
+
+        while not self._stopped.wait(self._interval):
+            try:
+                self._record(self._sample())
+            except Exception:
+                logging.exception("Unable to sample metrics")
+
+    def aggregate(self, window: float) -> typing.Dict[str, typing.Tuple[float, float, float, float, int]]:
+        '''
+        Returns (min, avg, max, last, number of samples) for each series over
+        the last window seconds, NaN samples are left out
+        '''
+        since = time.time() - window
+
+        with self._lock:
+            # walk back from the newest sample until we leave the window
+            indexes = []
+            index = self._next
+
+            for _ in range(self._capacity):
+                index = (index - 1) % self._capacity
+
+                if not self._timestamps[index] >= since:
+                    break
+
+                indexes.append(index)
+
+            samples = {
+                name: [values[i] for i in indexes if not math.isnan(values[i])]
+                for name, values in self._values.items()
+            }
+
+        res = {}
+
+        for name, values in samples.items():
+            if values:
+                res[name] = (min(values), sum(values) / len(values), max(values), values[0], len(values))
+            else:
+                res[name] = (None, None, None, None, 0)
+
+        return res
+
+    def _record(self, sample: typing.Dict[str, float]):
+        with self._lock:
+            self._timestamps[self._next] = time.time()
+
+            for name, values in self._values.items():
+                values[self._next] = sample.get(name, math.nan)
+
+            self._next = (self._next + 1) % self._capacity
+
+    def _sample(self) -> typing.Dict[str, float]:
+        sample = {
+            'host_cpu_percent': psutil.cpu_percent(None),
+            'host_load_average': psutil.getloadavg()[0],
+            'host_memory_percent': psutil.virtual_memory().percent,
+        }
+
+        try:
+            process = self._fgfs_process()
+
+            if process is None:
+                return sample
+
+            with process.oneshot():
+                sample['fgfs_cpu_percent'] = process.cpu_percent(None)
+                sample['fgfs_rss_bytes'] = process.memory_info().rss
+                sample['fgfs_threads'] = process.num_threads()
+
+                # not available on macOS
+                if hasattr(process, 'io_counters'):
+                    now = time.monotonic()
+                    io = process.io_counters()
+
+                    if self._previous_io is not None:
+                        previous_time, previous_io = self._previous_io
+                        elapsed = max(now - previous_time, 1e-6)
+                        sample['fgfs_read_bytes_per_second'] = (io.read_bytes - previous_io.read_bytes) / elapsed
+                        sample['fgfs_write_bytes_per_second'] = (io.write_bytes - previous_io.write_bytes) / elapsed
+
+                    self._previous_io = (now, io)
+        except (psutil.NoSuchProcess, psutil.AccessDenied) as e:
+            logging.debug(f"Unable to sample FGFS: {e}")
+            self._process = None
+
+        return sample
+
+    def _fgfs_process(self) -> typing.Union[psutil.Process, None]:
+        fg_process = self._get_process()
+
+        if fg_process is None or fg_process.poll() is not None:
+            self._process = None
+            return None
+
+        if self._process is None or self._process.pid != fg_process.pid:
+            self._process = psutil.Process(fg_process.pid)
+            self._previous_io = None
+            # baseline, like psutil.cpu_percent above
+            self._process.cpu_percent(None)
+
+        return self._process
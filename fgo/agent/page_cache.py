@@ -0,0 +1,181 @@
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from pathlib import Path
+import itertools
+import threading
+import datetime
+import logging
+import typing
+import os
+
+from fgo.gql import types
+from fgo.agent.aircraft_share import is_valid_svn_name
+from fgo.agent.scenery_prefetch import TILE_PATH
+
+CHUNK_SIZE = 1024 * 1024
+
+
+@dataclass
+class WarmupJob:
+    id: str
+    aircraft: str = None
+    tiles: typing.List[str] = field(default_factory=list)
+    state: types.JobState = field(default_factory=lambda: types.JobState.QUEUED)
+    files: int = 0
+    bytes: int = 0
+    error: str = None
+    queued_at: datetime.datetime = field(default_factory=datetime.datetime.now)
+    started_at: datetime.datetime = None
+    finished_at: datetime.datetime = None
+
+    @property
+    def active(self) -> bool:
+        return self.state in [types.JobState.QUEUED, types.JobState.RUNNING]
+
+    def to_gql(self) -> types.PageCacheWarmup:
+        return types.PageCacheWarmup(
+            id=self.id,
+            aircraft=self.aircraft,
+            tiles=self.tiles,
+            state=self.state,
+            files=self.files,
+            bytes=self.bytes,
+            error=self.error,
+            queued_at=self.queued_at,
+            started_at=self.started_at,
+            finished_at=self.finished_at
+        )
+
+
+class PageCacheWarmer:
+    '''
+    Reads an aircraft and the scenery tiles around the departure airport into
+    the OS page cache before FGFS asks for them, much like `vmtouch -t`, for
+    seats whose aircraft_path or terrasync_path is on a slow disk or a
+    network share.
+
+    Where the OS has posix_fadvise the kernel is asked to read each file
+    ahead with POSIX_FADV_WILLNEED, which returns straight away, elsewhere
+    files are read through. Either way config.page_cache_warmup_threads
+    files are in flight at once.
+    '''
+    HISTORY_LIMIT = 20
+
+    def __init__(self, config):
+        self._config = config
+        self._lock = threading.Lock()
+        self._jobs: typing.List[WarmupJob] = []
+        self._ids = itertools.count(1)
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='fgo-page-cache')
+
+    @property
+    def enabled(self) -> bool:
+        return self._config.warm_page_cache
+
+    def jobs(self) -> typing.List[WarmupJob]:
+        with self._lock:
+            return list(self._jobs)
+
+    def submit(self, aircraft: str = None, tiles: typing.List[str] = None) -> WarmupJob:
+        ''' Queues warming the aircraft directory and the tiles, given as e.g. e010n50/e013n52 '''
+        if aircraft is not None and not is_valid_svn_name(aircraft):
+            raise ValueError(f"{aircraft} is not an aircraft directory")
+
+        invalid = [tile for tile in tiles or [] if TILE_PATH.search(tile) is None]
+
+        if invalid:
+            raise ValueError(f"{', '.join(invalid)} are not tiles")
+
+        with self._lock:
+            job = WarmupJob(id=f"warmup-{next(self._ids)}", aircraft=aircraft, tiles=sorted(set(tiles or [])))
+            self._jobs.append(job)
+            finished = [job for job in self._jobs if not job.active]
+
+            for old_job in finished[:max(0, len(finished) - self.HISTORY_LIMIT)]:
+                self._jobs.remove(old_job)
+
+        self._executor.submit(self._run, job)
+        return job
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False)
+
+    def _run(self, job: WarmupJob):
+        job.state = types.JobState.RUNNING
+        job.started_at = datetime.datetime.now()
+
+        try:
+            with ThreadPoolExecutor(
+                max_workers=self._config.page_cache_warmup_threads,
+                thread_name_prefix='fgo-page-cache-read'
+            ) as reader:
+                for directory in self._directories(job):
+                    # list() so that the first failure is raised here
+                    list(reader.map(lambda path: self._warm(job, path), self._files(directory)))
+
+            job.state = types.JobState.DONE
+        except OSError as e:
+            logging.warning(f"Unable to warm the page cache: {e}")
+            job.error = f"{e}"
+            job.state = types.JobState.FAILED
+        finally:
+            job.finished_at = datetime.datetime.now()
+
+        logging.info(f"Warmed {job.files} files, {job.bytes} bytes, into the page cache")
+
+    def _directories(self, job: WarmupJob) -> typing.List[Path]:
+        res = []
+
+        if job.aircraft:
+            roots = [self._config.aircraft_path]
+
+            if self._config.fgroot_path:
+                # aircraft bundled with FlightGear, e.g. the c172p, live in FG_ROOT
+                roots.append(Path(self._config.fgroot_path, 'Aircraft'))
+
+            for root in roots:
+                if root and Path(root, job.aircraft).is_dir():
+                    res.append(Path(root, job.aircraft))
+                    break
+
+        if self._config.terrasync_path and Path(self._config.terrasync_path).is_dir():
+            for category in os.scandir(self._config.terrasync_path):
+                if not category.is_dir():
+                    continue
+
+                for tile in job.tiles:
+                    directory = Path(category.path, *tile.split('/'))
+
+                    if directory.is_dir():
+                        res.append(directory)
+
+        return res
+
+    @staticmethod
+    def _files(directory: Path) -> typing.Iterator[Path]:
+        for dirpath, dirnames, filenames in os.walk(directory):
+            # svn's own copies of everything aren't read by FGFS
+            if '.svn' in dirnames:
+                dirnames.remove('.svn')
+
+            for name in filenames:
+                yield Path(dirpath, name)
+
+    def _warm(self, job: WarmupJob, path: Path):
+        try:
+            with open(path, 'rb') as fh:
+                size = os.fstat(fh.fileno()).st_size
+
+                if hasattr(os, 'posix_fadvise'):
+                    os.posix_fadvise(fh.fileno(), 0, 0, os.POSIX_FADV_WILLNEED)
+                else:
+                    while fh.read(CHUNK_SIZE):
+                        pass
+        except OSError as e:
+            # e.g. removed since it was listed, not worth failing over
+            logging.debug(f"Unable to warm {path}: {e}")
+            return
+
+        with self._lock:
+            job.files += 1
+            job.bytes += size
@@ -0,0 +1,249 @@
+from dataclasses import dataclass, field
+import subprocess
+import threading
+import datetime
+import logging
+import typing
+import time
+import re
+
+from fgo.gql import types
+
+# e.g. 22:00-06:00, may wrap past midnight
+WINDOW = re.compile(r'^(\d{1,2}):(\d{2})-(\d{1,2}):(\d{2})$')
+
+
+def in_window(window: typing.Union[str, None], now: datetime.datetime) -> bool:
+    ''' True if now falls inside window, a window of None is always open '''
+    if not window:
+        return True
+
+    match = WINDOW.search(window)
+    start = datetime.time(int(match[1]), int(match[2]))
+    end = datetime.time(int(match[3]), int(match[4]))
+    now = now.time()
+
+    if start <= end:
+        return start <= now < end
+
+    return now >= start or now < end
+
+
+class BandwidthLimiter:
+    '''
+    Token bucket shared by every background install on this agent. Callers
+    say how many bytes they just moved and are held until the rate allows
+    it; holding the thread that reads svn's output stalls svn itself once
+    the pipe fills up.
+    '''
+    # how long a sleep is before the caller is asked whether it still wants to wait
+    SLICE = 1
+
+    def __init__(self, bytes_per_second: float = None):
+        self._lock = threading.Lock()
+        self._rate = bytes_per_second
+        self._tokens = 0
+        self._last = time.monotonic()
+
+    @property
+    def bytes_per_second(self) -> typing.Union[float, None]:
+        return self._rate
+
+    @bytes_per_second.setter
+    def bytes_per_second(self, rate: typing.Union[float, None]):
+        with self._lock:
+            self._rate = rate
+            self._tokens = 0
+            self._last = time.monotonic()
+
+    def consume(self, size: int, keep_waiting: typing.Callable[[], bool]):
+        with self._lock:
+            if not self._rate:
+                return
+
+            now = time.monotonic()
+            # allow a second's worth of burst
+            self._tokens = min(self._rate, self._tokens + (now - self._last) * self._rate) - size
+            self._last = now
+            deadline = now + max(0, -self._tokens / self._rate)
+
+        while keep_waiting():
+            remaining = deadline - time.monotonic()
+
+            if remaining <= 0:
+                return
+
+            time.sleep(min(self.SLICE, remaining))
+
+
+@dataclass
+class PrefetchRequest:
+    svn_name: str
+    peers: typing.List[str] = field(default_factory=list)
+    requested_at: datetime.datetime = field(default_factory=datetime.datetime.now)
+    job_id: str = None
+
+    def to_gql(self) -> types.PrefetchRequest:
+        return types.PrefetchRequest(
+            svn_name=self.svn_name,
+            peers=self.peers,
+            requested_at=self.requested_at,
+            job_id=self.job_id
+        )
+
+
+class Prefetcher(threading.Thread):
+    '''
+    Installs aircraft asked for ahead of time during config.prefetch_window.
+
+    The jobs run on the install queue as background jobs, which leave the
+    agent READY, are limited to config.max_concurrent_prefetches at once and
+    share a BandwidthLimiter. They are held in place while FGFS is running
+    or the window is closed and carry on from where they were afterwards.
+    '''
+    CHECK_INTERVAL = 30
+
+    def __init__(
+        self,
+        config,
+        install_queue,
+        get_process: typing.Callable[[], typing.Union[subprocess.Popen, None]],
+        get_svn_base_url: typing.Callable[[], typing.Union[str, None]]
+    ):
+        super(Prefetcher, self).__init__(name='fgo-prefetcher', daemon=True)
+        self._config = config
+        self._install_queue = install_queue
+        self._get_process = get_process
+        self._get_svn_base_url = get_svn_base_url
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stopped = False
+        self._requests: typing.List[PrefetchRequest] = []
+        self.limiter = BandwidthLimiter(self._bytes_per_second(config.prefetch_bandwidth_kbps))
+
+    def stop(self):
+        self._stopped = True
+        self._wake.set()
+
+    def wake(self):
+        self._wake.set()
+
+    def requests(self) -> typing.List[PrefetchRequest]:
+        with self._lock:
+            return list(self._requests)
+
+    def request(
+        self,
+        svn_names: typing.List[str],
+        peers: typing.List[str] = None,
+        bandwidth_kbps: int = None
+    ) -> typing.List[PrefetchRequest]:
+        '''
+        Queues svn_names for the next window, bandwidth_kbps replaces the
+        agent's configured limit for every background install
+        '''
+        res = []
+
+        with self._lock:
+            for svn_name in svn_names:
+                existing = [request for request in self._requests if request.svn_name == svn_name and request.job_id is None]
+
+                if existing:
+                    existing[0].peers = peers or []
+                    res.append(existing[0])
+                    continue
+
+                request = PrefetchRequest(svn_name=svn_name, peers=peers or [])
+                self._requests.append(request)
+                res.append(request)
+
+        if bandwidth_kbps is not None:
+            self.limiter.bytes_per_second = self._bytes_per_second(bandwidth_kbps)
+
+        self.wake()
+        return res
+
+    def is_pending(self, svn_name: str) -> bool:
+        ''' True from when svn_name is asked for until its job has finished '''
+        jobs = {job.id: job for job in self._install_queue.jobs()}
+
+        with self._lock:
+            for request in self._requests:
+                if request.svn_name != svn_name:
+                    continue
+
+                if request.job_id is None or (request.job_id in jobs and jobs[request.job_id].active):
+                    return True
+
+        return False
+
+    def paused(self) -> bool:
+        ''' Background installs hold still while this is true '''
+        fg_process = self._get_process()
+
+        if fg_process is not None and fg_process.poll() is None:
+            return True
+
+        return not in_window(self._config.prefetch_window, datetime.datetime.now())
+
+    def run(self):
+        while not self._stopped:
+            try:
+                self._submit_due()
+            except Exception:
+                logging.exception("Unable to start prefetching aircraft")
+
+            self._wake.wait(self.CHECK_INTERVAL)
+            self._wake.clear()
+
+    def _submit_due(self):
+        svn_base_url = self._get_svn_base_url()
+
+        if self.paused() or svn_base_url is None:
+            return
+
+        jobs = {job.id: job for job in self._install_queue.jobs()}
+
+        with self._lock:
+            # forget requests whose jobs have finished, the job history has the outcome
+            self._requests = [
+                request for request in self._requests
+                if request.job_id is None or (request.job_id in jobs and jobs[request.job_id].active)
+            ]
+            running = len([request for request in self._requests if request.job_id is not None])
+
+            for request in self._requests:
+                if running >= self._config.max_concurrent_prefetches:
+                    break
+
+                if request.job_id is not None:
+                    continue
+
+                try:
+                    request.job_id = self._install_queue.submit(
+                        request.svn_name,
+                        svn_base_url,
+                        peers=request.peers,
+                        background=True,
+                        throttle=self._throttle
+                    ).id
+                except ValueError as e:
+                    # e.g. a restore is under way, try again once it is done
+                    logging.debug(f"Not prefetching '{request.svn_name}' yet: {e}")
+                    continue
+
+                logging.info(f"Prefetching '{request.svn_name}'")
+                running += 1
+
+    def _throttle(self, job, size: int):
+        while job.background and not self._stopped and self.paused():
+            time.sleep(BandwidthLimiter.SLICE)
+
+        self.limiter.consume(size, lambda: job.background and not self._stopped)
+
+    @staticmethod
+    def _bytes_per_second(kbps: typing.Union[int, None]) -> typing.Union[float, None]:
+        if not kbps:
+            return None
+
+        return kbps * 1000 / 8
@@ -0,0 +1,160 @@
+import urllib.request
+import urllib.parse
+import logging
+import socket
+import typing
+import json
+import re
+
+
+class PropertyClient:
+    '''
+    Reads and writes FlightGear properties, and runs commands, through the
+    httpd or telnet servers that FlightGearStartInput.assemble_args enables.
+
+    See http://wiki.flightgear.org/Property_Tree/Web_Server and
+    http://wiki.flightgear.org/Telnet_usage
+    '''
+    def __init__(self, host: str = '127.0.0.1', httpd_port: int = None, telnet_port: int = None, timeout: float = 1):
+        self.host = host
+        self.httpd_port = httpd_port
+        self.telnet_port = telnet_port
+        self.timeout = timeout
+
+    @classmethod
+    def from_args(cls, args: typing.List[str]):
+        ''' Returns a client for whichever property servers the FGFS args enable '''
+        httpd_port = None
+        telnet_port = None
+
+        for arg in args:
+            # either --telnet=8081 or --telnet=socket,bi,10,localhost,8081,tcp
+            match = re.search(r'^--(httpd|telnet)=(?:[^,]*,[^,]*,[^,]*,[^,]*,)?(\d+)(?:,.*)?$', arg)
+
+            if match is None:
+                continue
+
+            if match[1] == 'httpd':
+                httpd_port = int(match[2])
+            else:
+                telnet_port = int(match[2])
+
+        return cls(httpd_port=httpd_port, telnet_port=telnet_port)
+
+    @property
+    def available(self) -> bool:
+        return self.httpd_port is not None or self.telnet_port is not None
+
+    def get(self, path: str) -> typing.Union[str, None]:
+        '''
+        Returns the value of a property as a string, or None if FlightGear
+        is not answering yet
+        '''
+        try:
+            if self.httpd_port is not None:
+                return self._httpd_get(path)
+
+            if self.telnet_port is not None:
+                return self._telnet_get(path)
+        except (OSError, ValueError) as e:
+            logging.debug(f"Property {path} not available yet: {e}")
+
+        return None
+
+    def set(self, path: str, value: typing.Union[str, int, float, bool]) -> bool:
+        '''
+        Sets a property, returns False if FlightGear didn't take it. The
+        telnet server doesn't say, there False only means it wasn't reached.
+        '''
+        try:
+            if self.httpd_port is not None:
+                self._httpd_request(f"/json{path}", {'value': value})
+                return True
+
+            if self.telnet_port is not None:
+                self._telnet_command(f"set {path} {self._telnet_value(value)}")
+                return True
+        except (OSError, ValueError) as e:
+            logging.warning(f"Unable to set {path}: {e}")
+
+        return False
+
+    def run(self, command: str, args: typing.Dict[str, typing.Union[str, int, float, bool]] = None) -> bool:
+        '''
+        Runs a FlightGear command, see
+        http://wiki.flightgear.org/Fgcommands, returns False if it failed
+        '''
+        args = args or {}
+
+        try:
+            if self.httpd_port is not None:
+                # the body becomes the command's argument node
+                self._httpd_request(
+                    f"/run.cgi?value={urllib.parse.quote(command)}",
+                    {'name': '', 'children': [{'name': name, 'value': value} for name, value in args.items()]}
+                )
+                return True
+
+            if self.telnet_port is not None:
+                # the telnet server hands the words after the command to the
+                # few commands that take arguments, e.g. run timeofday dusk
+                words = [command] + [self._telnet_value(value) for value in args.values()]
+                self._telnet_command(f"run {' '.join(words)}")
+                return True
+        except (OSError, ValueError) as e:
+            logging.warning(f"Unable to run {command}: {e}")
+
+        return False
+
+    def is_ready(self) -> bool:
+        ''' FlightGear sets /sim/sceneryloaded once the initial scenery is in place '''
+        return self.get('/sim/sceneryloaded') in ['true', '1']
+
+    def _httpd_get(self, path: str) -> str:
+        url = f"http://{self.host}:{self.httpd_port}/json{path}"
+
+        with urllib.request.urlopen(url, timeout=self.timeout) as response:
+            memo = json.loads(response.read().decode())
+
+        value = memo.get('value')
+
+        if isinstance(value, bool):
+            return 'true' if value else 'false'
+
+        return f"{value}"
+
+    def _httpd_request(self, path: str, body: typing.Dict[str, typing.Any]):
+        request = urllib.request.Request(
+            f"http://{self.host}:{self.httpd_port}{path}",
+            data=json.dumps(body).encode(),
+            headers={'Content-Type': 'application/json'},
+            method='POST'
+        )
+
+        # raises HTTPError, an OSError, unless FlightGear answers 200
+        with urllib.request.urlopen(request, timeout=self.timeout) as response:
+            response.read()
+
+    def _telnet_command(self, command: str):
+        with socket.create_connection((self.host, self.telnet_port), timeout=self.timeout) as sock:
+            fh = sock.makefile('rw', newline='\r\n')
+            # data mode has set and run answer with nothing at all
+            fh.write(f"data\r\n{command}\r\nquit\r\n")
+            fh.flush()
+            # FlightGear hangs up once it has got as far as quit
+            fh.read()
+
+    @staticmethod
+    def _telnet_value(value: typing.Union[str, int, float, bool]) -> str:
+        if isinstance(value, bool):
+            return 'true' if value else 'false'
+
+        return f"{value}"
+
+    def _telnet_get(self, path: str) -> str:
+        with socket.create_connection((self.host, self.telnet_port), timeout=self.timeout) as sock:
+            fh = sock.makefile('rw', newline='\r\n')
+            # data mode drops the prompts so the reply is the bare value
+            fh.write(f"data\r\nget {path}\r\nquit\r\n")
+            fh.flush()
+            return fh.readline().strip()
@@ -0,0 +1,48 @@
+import threading
+import logging
+import typing
+import time
+
+import svn.remote
+from svn.exception import SvnException
+
+
+class RemoteRevisionCache:
+    '''
+    Remembers the revision each aircraft was last changed at upstream, so
+    that launching with the same aircraft again doesn't mean another round
+    trip to SourceForge for every seat.
+    '''
+    def __init__(self, ttl: float = 300):
+        self._ttl = ttl
+        self._lock = threading.Lock()
+        # url -> (time fetched, last changed revision)
+        self._revisions: typing.Dict[str, typing.Tuple[float, int]] = {}
+
+    def last_changed_revision(self, url: str) -> typing.Union[int, None]:
+        '''
+        Returns the revision url was last changed at, or None if the
+        repository could not be asked
+        '''
+        now = time.monotonic()
+
+        with self._lock:
+            memo = self._revisions.get(url)
+
+        if memo is not None and now - memo[0] < self._ttl:
+            return memo[1]
+
+        try:
+            revision = svn.remote.RemoteClient(url).info()['commit_revision']
+        except (SvnException, FileNotFoundError, KeyError, ValueError) as e:
+            logging.info(f"Unable to find the latest revision of {url}: {e}")
+            return None
+
+        with self._lock:
+            self._revisions[url] = (now, revision)
+
+        return revision
+
+    def forget(self, url: str):
+        with self._lock:
+            self._revisions.pop(url, None)
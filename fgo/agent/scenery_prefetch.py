@@ -0,0 +1,253 @@
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from pathlib import Path
+import itertools
+import threading
+import datetime
+import hashlib
+import logging
+import typing
+import os
+import re
+
+import requests
+
+from fgo.gql import types
+
+CHUNK_SIZE = 1024 * 1024
+DIRINDEX = '.dirindex'
+
+# e.g. e010n50/e013n52, the 10x10 degree bucket then the 1x1 degree tile
+TILE_PATH = re.compile(r'^[ew]\d{3}[ns]\d{2}/[ew]\d{3}[ns]\d{2}$')
+
+
+@dataclass
+class SceneryJob:
+    id: str
+    tiles: typing.List[str]
+    terrasync_endpoint: str
+    state: types.JobState = field(default_factory=lambda: types.JobState.QUEUED)
+    directories: int = 0
+    files: int = 0
+    bytes: int = 0
+    error: str = None
+    queued_at: datetime.datetime = field(default_factory=datetime.datetime.now)
+    started_at: datetime.datetime = None
+    finished_at: datetime.datetime = None
+
+    @property
+    def active(self) -> bool:
+        return self.state in [types.JobState.QUEUED, types.JobState.RUNNING]
+
+    def to_gql(self) -> types.SceneryJob:
+        return types.SceneryJob(
+            id=self.id,
+            tiles=self.tiles,
+            terrasync_endpoint=self.terrasync_endpoint,
+            state=self.state,
+            directories=self.directories,
+            files=self.files,
+            bytes=self.bytes,
+            error=self.error,
+            queued_at=self.queued_at,
+            started_at=self.started_at,
+            finished_at=self.finished_at
+        )
+
+
+class SceneryPrefetcher:
+    '''
+    Fetches scenery tiles into terrasync_path ahead of a session, the way
+    TerraSync would once FGFS got there.
+
+    Each tile directory's .dirindex is compared with the one we have, files
+    whose sha1 doesn't match are downloaded and the .dirindex is written
+    last, so a directory that was interrupted is looked at again next time
+    and one that was finished is left alone by TerraSync as well.
+
+    Jobs run one at a time in the background, the agent stays READY.
+    '''
+    # tile directories exist under each of these, where there's anything to show
+    CATEGORIES = ['Terrain', 'Objects', 'Buildings', 'Roads', 'Pylons', 'Details']
+    # files fetched at once within a directory
+    FETCHES = 4
+    HISTORY_LIMIT = 20
+    CONNECT_TIMEOUT = 5
+    READ_TIMEOUT = 60
+
+    def __init__(self, config):
+        self._config = config
+        self._lock = threading.Lock()
+        self._jobs: typing.List[SceneryJob] = []
+        self._ids = itertools.count(1)
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='fgo-scenery')
+        self._session = requests.Session()
+
+    def jobs(self) -> typing.List[SceneryJob]:
+        with self._lock:
+            return list(self._jobs)
+
+    def submit(self, tiles: typing.List[str], terrasync_endpoint: str = None) -> SceneryJob:
+        '''
+        Queues fetching tiles, given as bucket/tile e.g. e010n50/e013n52,
+        from terrasync_endpoint, or the agent's TerraSync upstream if None
+        '''
+        invalid = [tile for tile in tiles if TILE_PATH.search(tile) is None]
+
+        if invalid:
+            raise ValueError(f"{', '.join(invalid)} are not tiles")
+
+        with self._lock:
+            job = SceneryJob(
+                id=f"scenery-{next(self._ids)}",
+                tiles=sorted(set(tiles)),
+                terrasync_endpoint=(terrasync_endpoint or self._config.terrasync_upstream).rstrip('/')
+            )
+            self._jobs.append(job)
+            finished = [job for job in self._jobs if not job.active]
+
+            for old_job in finished[:max(0, len(finished) - self.HISTORY_LIMIT)]:
+                self._jobs.remove(old_job)
+
+        self._executor.submit(self._run, job)
+        return job
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False)
+
+    def _run(self, job: SceneryJob):
+        job.state = types.JobState.RUNNING
+        job.started_at = datetime.datetime.now()
+        logging.info(f"Prefetching scenery tiles {job.tiles} from {job.terrasync_endpoint}")
+
+        try:
+            if not self._config.terrasync_path:
+                raise ValueError("terrasync_path is not set")
+
+            with ThreadPoolExecutor(max_workers=self.FETCHES, thread_name_prefix='fgo-scenery-fetch') as fetcher:
+                for tile in job.tiles:
+                    for category in self.CATEGORIES:
+                        self._sync_directory(job, fetcher, f"{category}/{tile}")
+
+            job.state = types.JobState.DONE
+        except (requests.exceptions.RequestException, OSError, ValueError) as e:
+            logging.warning(f"Unable to prefetch scenery tiles {job.tiles}: {e}")
+            job.error = f"{e}"
+            job.state = types.JobState.FAILED
+        finally:
+            job.finished_at = datetime.datetime.now()
+
+        logging.info(f"Prefetched {job.files} files, {job.bytes} bytes, in {job.directories} scenery directories")
+
+    def _sync_directory(self, job: SceneryJob, fetcher: ThreadPoolExecutor, path: str):
+        local_directory = Path(self._config.terrasync_path, *path.split('/'))
+        response = self._get(job, f"{path}/{DIRINDEX}")
+
+        if response is None:
+            # e.g. open sea, nothing in this category here
+            return
+
+        dirindex = response.content
+        local_dirindex = Path(local_directory, DIRINDEX)
+
+        if local_dirindex.exists() and local_dirindex.read_bytes() == dirindex:
+            return
+
+        job.directories += 1
+        subdirectories = []
+        files = []
+
+        for line in dirindex.decode(errors='replace').splitlines():
+            # d:name:sha1 for directories, f:name:sha1:size for files
+            fields = line.split(':')
+
+            if len(fields) < 3 or '/' in fields[1] or fields[1] in ['', '.', '..']:
+                continue
+
+            if fields[0] == 'd':
+                subdirectories.append(fields[1])
+            elif fields[0] == 'f':
+                files.append((fields[1], fields[2]))
+
+        local_directory.mkdir(parents=True, exist_ok=True)
+
+        # list() so that the first failure is raised here
+        list(fetcher.map(lambda entry: self._sync_file(job, path, local_directory, *entry), files))
+
+        for name in subdirectories:
+            self._sync_directory(job, fetcher, f"{path}/{name}")
+
+        self._write(Path(local_directory, DIRINDEX), [dirindex])
+
+    def _sync_file(self, job: SceneryJob, path: str, local_directory: Path, name: str, sha1: str):
+        local_path = Path(local_directory, name)
+
+        if local_path.exists() and self._sha1(local_path) == sha1:
+            return
+
+        response = self._get(job, f"{path}/{name}", stream=True)
+
+        if response is None:
+            raise ValueError(f"{path}/{name} is listed but missing upstream")
+
+        with response:
+            digest = self._write(local_path, response.iter_content(CHUNK_SIZE), lambda size: self._count(job, 0, size))
+
+        if digest != sha1:
+            local_path.unlink()
+            raise ValueError(f"{path}/{name} doesn't match its sha1")
+
+        self._count(job, 1, 0)
+
+    def _count(self, job: SceneryJob, files: int, size: int):
+        # files are fetched on several threads at once
+        with self._lock:
+            job.files += files
+            job.bytes += size
+
+    def _get(self, job: SceneryJob, path: str, stream: bool = False) -> typing.Union[requests.Response, None]:
+        ''' Returns None if path doesn't exist upstream '''
+        response = self._session.get(
+            f"{job.terrasync_endpoint}/{path}",
+            stream=stream,
+            timeout=(self.CONNECT_TIMEOUT, self.READ_TIMEOUT)
+        )
+
+        if response.status_code == 404:
+            response.close()
+            return None
+
+        response.raise_for_status()
+        return response
+
+    @staticmethod
+    def _write(path: Path, chunks: typing.Iterable[bytes], on_chunk: typing.Callable[[int], None] = None) -> str:
+        ''' Replaces path with chunks, returns their sha1 '''
+        partial_path = Path(path.parent, f".{path.name}.fgo-partial")
+        digest = hashlib.sha1()
+
+        try:
+            with open(partial_path, 'wb') as fh:
+                for chunk in chunks:
+                    fh.write(chunk)
+                    digest.update(chunk)
+
+                    if on_chunk is not None:
+                        on_chunk(len(chunk))
+
+            os.replace(partial_path, path)
+        finally:
+            if partial_path.exists():
+                partial_path.unlink()
+
+        return digest.hexdigest()
+
+    @staticmethod
+    def _sha1(path: Path) -> str:
+        digest = hashlib.sha1()
+
+        with open(path, 'rb') as fh:
+            for chunk in iter(lambda: fh.read(CHUNK_SIZE), b''):
+                digest.update(chunk)
+
+        return digest.hexdigest()
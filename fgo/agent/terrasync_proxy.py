@@ -0,0 +1,191 @@
+from contextlib import contextmanager
+from pathlib import Path, PurePosixPath
+import threading
+import hashlib
+import logging
+import typing
+import time
+import os
+
+import requests
+
+CHUNK_SIZE = 1024 * 1024
+DIRINDEX = '.dirindex'
+
+
+class ProxyError(Exception):
+    def __init__(self, status: int, message: str):
+        super(ProxyError, self).__init__(message)
+        self.status = status
+
+
+class TerraSyncProxy:
+    '''
+    Caching proxy for TerraSync's HTTP protocol, so that every seat flying
+    the same area downloads each file from upstream once between them.
+
+    TerraSync asks for each directory's .dirindex, which lists the sha1 of
+    every file in it, then for the files that it doesn't have. Directory
+    indexes are kept for config.terrasync_dirindex_ttl seconds, files for as
+    long as their hash matches the cached index of their directory.
+    Concurrent misses on the same path share one upstream request.
+    '''
+    CONNECT_TIMEOUT = 5
+    READ_TIMEOUT = 60
+
+    def __init__(self, config):
+        self._config = config
+        self._locks_lock = threading.Lock()
+        # path -> (lock, number of requests using it)
+        self._locks: typing.Dict[str, typing.Tuple[threading.Lock, int]] = {}
+        # path -> (mtime_ns, size, sha1) of files whose hash we have worked out
+        self._hashes: typing.Dict[str, typing.Tuple[int, int, str]] = {}
+        self.hits = 0
+        self.misses = 0
+        self.upstream_bytes = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self._config.terrasync_proxy_path is not None
+
+    @property
+    def upstream(self) -> str:
+        return self._config.terrasync_upstream.rstrip('/')
+
+    def fetch(self, path: str) -> Path:
+        '''
+        Returns the cached copy of path, fetching it from upstream first if
+        need be. Raises ProxyError if it can't be had.
+        '''
+        parts = PurePosixPath(path).parts
+
+        if not parts or path.startswith('/') or '..' in parts:
+            raise ProxyError(404, f"{path} is not a TerraSync path")
+
+        local_path = Path(self._config.terrasync_proxy_path, *parts)
+
+        if self._is_current(path, local_path):
+            self.hits += 1
+            return local_path
+
+        with self._path_lock(path):
+            # somebody else may have fetched it while we waited
+            if self._is_current(path, local_path):
+                self.hits += 1
+                return local_path
+
+            self.misses += 1
+
+            try:
+                self._download(path, local_path)
+            except ProxyError:
+                if local_path.name == DIRINDEX and local_path.exists():
+                    # a stale index beats no scenery
+                    logging.warning(f"Serving stale {path}, upstream is unavailable")
+                    return local_path
+
+                raise
+
+        return local_path
+
+    def _is_current(self, path: str, local_path: Path) -> bool:
+        try:
+            stat = local_path.stat()
+        except OSError:
+            return False
+
+        if local_path.name == DIRINDEX:
+            return time.time() - stat.st_mtime < self._config.terrasync_dirindex_ttl
+
+        expected = self._expected_hash(local_path)
+
+        if expected is None:
+            # nothing to check against, TerraSync always reads the index first
+            return True
+
+        memo = self._hashes.get(path)
+
+        if memo is None or memo[:2] != (stat.st_mtime_ns, stat.st_size):
+            memo = (stat.st_mtime_ns, stat.st_size, self._sha1(local_path))
+            self._hashes[path] = memo
+
+        return memo[2] == expected
+
+    @staticmethod
+    def _expected_hash(local_path: Path) -> typing.Union[str, None]:
+        ''' Looks local_path up in the cached .dirindex of its directory '''
+        dirindex_path = Path(local_path.parent, DIRINDEX)
+
+        try:
+            lines = dirindex_path.read_text(errors='replace').splitlines()
+        except OSError:
+            return None
+
+        for line in lines:
+            # f:name:sha1:size for files, t:name:sha1:size for archives
+            fields = line.split(':')
+
+            if len(fields) >= 3 and fields[0] in ['f', 't'] and fields[1] == local_path.name:
+                return fields[2]
+
+        return None
+
+    def _download(self, path: str, local_path: Path):
+        url = f"{self.upstream}/{path}"
+        partial_path = Path(local_path.parent, f".{local_path.name}.fgo-partial")
+        digest = hashlib.sha1()
+        logging.info(f"Fetching {url}")
+
+        try:
+            local_path.parent.mkdir(parents=True, exist_ok=True)
+
+            with requests.get(url, stream=True, timeout=(self.CONNECT_TIMEOUT, self.READ_TIMEOUT)) as response:
+                if response.status_code == 404:
+                    raise ProxyError(404, f"{url} does not exist")
+
+                response.raise_for_status()
+
+                with open(partial_path, 'wb') as fh:
+                    for chunk in response.iter_content(CHUNK_SIZE):
+                        fh.write(chunk)
+                        digest.update(chunk)
+                        self.upstream_bytes += len(chunk)
+
+            os.replace(partial_path, local_path)
+        except (requests.exceptions.RequestException, OSError) as e:
+            logging.warning(f"Unable to fetch {url}: {e}")
+            raise ProxyError(502, f"Unable to fetch {url}: {e}")
+        finally:
+            if partial_path.exists():
+                partial_path.unlink()
+
+        stat = local_path.stat()
+        self._hashes[path] = (stat.st_mtime_ns, stat.st_size, digest.hexdigest())
+
+    @contextmanager
+    def _path_lock(self, path: str):
+        with self._locks_lock:
+            lock, users = self._locks.get(path, (threading.Lock(), 0))
+            self._locks[path] = (lock, users + 1)
+
+        try:
+            with lock:
+                yield
+        finally:
+            with self._locks_lock:
+                lock, users = self._locks[path]
+
+                if users == 1:
+                    del self._locks[path]
+                else:
+                    self._locks[path] = (lock, users - 1)
+
+    @staticmethod
+    def _sha1(path: Path) -> str:
+        digest = hashlib.sha1()
+
+        with open(path, 'rb') as fh:
+            for chunk in iter(lambda: fh.read(CHUNK_SIZE), b''):
+                digest.update(chunk)
+
+        return digest.hexdigest()
@@ -10,7 +10,7 @@ import os
 from fgo.agent.agent import Agent
 from fgo.agent.setup import Setup
 from fgo import util
-from fgo.config import Config
+from fgo.config import Config, HTTP_SERVERS
 
 log_levels = ['INFO', 'DEBUG', 'WARNING', 'ERROR', 'CRITICAL']
 
@@ -29,7 +29,35 @@ def create_parser():
     parser_.add_argument('--hostname')
     parser_.add_argument('--ip')
     parser_.add_argument('--fgfs-startup-time', type=int,
-                         help="Amount of time in seconds to wait for FGFS to start up")
+                         help="Amount of time in seconds to wait for FGFS to start up when neither its httpd nor telnet server is enabled")
+    parser_.add_argument('--max-concurrent-installs', type=int,
+                         help="Number of aircraft this agent will install or update at the same time")
+    parser_.add_argument('--aircraft-store-revisions', type=int,
+                         help="Number of revisions of each aircraft to keep for restoring locally, 0 to disable")
+    parser_.add_argument('--aircraft-budget-gb', type=int,
+                         help="Remove the least recently used aircraft when they take up more than this")
+    parser_.add_argument('--terrasync-budget-gb', type=int,
+                         help="Remove the least recently used scenery tiles when they take up more than this")
+    parser_.add_argument('--prefetch-window',
+                         help="Local time to install aircraft asked for ahead of time, e.g. 22:00-06:00")
+    parser_.add_argument('--prefetch-bandwidth-kbps', type=int,
+                         help="Bandwidth limit for aircraft installed ahead of time")
+    parser_.add_argument('--max-concurrent-prefetches', type=int,
+                         help="Number of aircraft this agent will install ahead of time at the same time")
+    parser_.add_argument('--terrasync-proxy-path',
+                         help="Serve TerraSync to the LAN at /terrasync, caching scenery in this directory")
+    parser_.add_argument('--terrasync-upstream',
+                         help="TerraSync server the proxy fetches from")
+    parser_.add_argument('--warm-page-cache', action='store_true', default=None,
+                         help="Read the aircraft and nearby scenery into the OS page cache before a session")
+    parser_.add_argument('--page-cache-warmup-threads', type=int,
+                         help="Number of files read into the page cache at the same time")
+    parser_.add_argument('--fgfs-log-to-file', action='store_true', default=None,
+                         help="Also write FlightGear's output to a rotating fgfs.log in the logs directory")
+    parser_.add_argument('--http-server', choices=HTTP_SERVERS,
+                         help="Serve the agent with Werkzeug's development server or with waitress")
+    parser_.add_argument('--http-threads', type=int,
+                         help="Size of the waitress thread pool")
 
     return parser_
 
@@ -100,6 +128,48 @@ def main():
         if args.fgfs_startup_time is not None:
             config.fgfs_startup_time = args.fgfs_startup_time
 
+        if args.max_concurrent_installs is not None:
+            config.max_concurrent_installs = args.max_concurrent_installs
+
+        if args.aircraft_store_revisions is not None:
+            config.aircraft_store_revisions = args.aircraft_store_revisions
+
+        if args.aircraft_budget_gb is not None:
+            config.aircraft_budget_gb = args.aircraft_budget_gb
+
+        if args.terrasync_budget_gb is not None:
+            config.terrasync_budget_gb = args.terrasync_budget_gb
+
+        if args.prefetch_window is not None:
+            config.prefetch_window = args.prefetch_window
+
+        if args.prefetch_bandwidth_kbps is not None:
+            config.prefetch_bandwidth_kbps = args.prefetch_bandwidth_kbps
+
+        if args.max_concurrent_prefetches is not None:
+            config.max_concurrent_prefetches = args.max_concurrent_prefetches
+
+        if args.terrasync_proxy_path is not None:
+            config.terrasync_proxy_path = args.terrasync_proxy_path
+
+        if args.terrasync_upstream is not None:
+            config.terrasync_upstream = args.terrasync_upstream
+
+        if args.warm_page_cache is not None:
+            config.warm_page_cache = args.warm_page_cache
+
+        if args.page_cache_warmup_threads is not None:
+            config.page_cache_warmup_threads = args.page_cache_warmup_threads
+
+        if args.fgfs_log_to_file is not None:
+            config.fgfs_log_to_file = args.fgfs_log_to_file
+
+        if args.http_server is not None:
+            config.http_server = args.http_server
+
+        if args.http_threads is not None:
+            config.http_threads = args.http_threads
+
         m_agent = Agent(config)
 
         # work-around this [unfixed bug](https://github.com/pallets/flask/issues/1246#issuecomment-115690934)
@@ -1,4 +1,5 @@
 import os
+import re
 import yaml
 import typing
 import logging
@@ -63,6 +64,19 @@ def must_be_log_level(name, value):
         raise ValueError(f"values for {name!r}  have to be a valid log level")
 
 
+HTTP_SERVERS = ['development', 'waitress']
+
+
+def must_be_time_window(name, value):
+    if re.search(r'^([01]?\d|2[0-3]):[0-5]\d-([01]?\d|2[0-3]):[0-5]\d$', value) is None:
+        raise ValueError(f"values for {name!r} have to look like 22:00-06:00")
+
+
+def must_be_http_server(name, value):
+    if value not in HTTP_SERVERS:
+        raise ValueError(f"values for {name!r} have to be one of {HTTP_SERVERS}")
+
+
 class PathAttr(GenericAttr):
     def __init__(self, validators=(), allow_none=False, default_value=NOTHING):
         super().__init__(None, validators, allow_none, default_value)
@@ -205,6 +219,83 @@ class Config:
         int,
         default_value=30
     )
+    max_concurrent_installs: int = GenericAttr(
+        int,
+        default_value=2
+    )
+    # seconds to trust the last changed revision of an aircraft upstream for
+    remote_revision_ttl: int = GenericAttr(
+        int,
+        default_value=300
+    )
+    # revisions of each aircraft kept in the aircraft store, 0 turns it off
+    aircraft_store_revisions: int = GenericAttr(
+        int,
+        default_value=3
+    )
+    # least recently used aircraft and scenery tiles are removed to stay
+    # within these, None for no limit
+    aircraft_budget_gb: int = GenericAttr(int, allow_none=True)
+    terrasync_budget_gb: int = GenericAttr(int, allow_none=True)
+    # local time during which aircraft asked for ahead of time are
+    # installed, e.g. 22:00-06:00, None for any time FGFS isn't running
+    prefetch_window: str = GenericAttr(
+        str,
+        validators=[must_be_time_window, ],
+        allow_none=True
+    )
+    prefetch_bandwidth_kbps: int = GenericAttr(int, allow_none=True)
+    max_concurrent_prefetches: int = GenericAttr(
+        int,
+        default_value=1
+    )
+    # used by the director, shared between the agents fetching from svn
+    fleet_prefetch_bandwidth_kbps: int = GenericAttr(int, allow_none=True)
+    # used by the director, most agents fetching from svn at once
+    fleet_prefetch_concurrency: int = GenericAttr(
+        int,
+        default_value=2
+    )
+    # serve TerraSync to the LAN from a cache in this directory, None to not
+    terrasync_proxy_path: Path = PathAttr(
+        validators=[must_exist, must_be_directory, must_be_writable, ],
+        allow_none=True
+    )
+    terrasync_upstream: str = GenericAttr(
+        str,
+        default_value='http://flightgear.sourceforge.net/scenery'
+    )
+    # seconds a cached .dirindex is served for before asking upstream again
+    terrasync_dirindex_ttl: int = GenericAttr(
+        int,
+        default_value=3600
+    )
+    # read the aircraft and nearby scenery into the OS page cache before a
+    # session, for slow disks and network shares
+    warm_page_cache: bool = GenericAttr(bool, default_value=False)
+    page_cache_warmup_threads: int = GenericAttr(
+        int,
+        default_value=4
+    )
+    # used by the director, degrees around the departure runway whose
+    # scenery agents fetch before FGFS starts, None to not
+    scenery_prefetch_radius: int = GenericAttr(
+        int,
+        default_value=1,
+        allow_none=True
+    )
+    # keep FGFS output in logs_dir as well as in memory
+    fgfs_log_to_file: bool = GenericAttr(bool, default_value=False)
+    http_server: str = GenericAttr(
+        str,
+        validators=[must_be_http_server, ],
+        default_value='development'
+    )
+    # every director following /events holds on to one of these
+    http_threads: int = GenericAttr(
+        int,
+        default_value=16
+    )
 
     _PERSISTABLE_KEYS = [
         'aircraft_path',
@@ -213,6 +304,25 @@ class Config:
         'fghome_path',
         'terrasync_path',
         'fgfs_startup_time',
+        'max_concurrent_installs',
+        'remote_revision_ttl',
+        'aircraft_store_revisions',
+        'aircraft_budget_gb',
+        'terrasync_budget_gb',
+        'prefetch_window',
+        'prefetch_bandwidth_kbps',
+        'max_concurrent_prefetches',
+        'fleet_prefetch_bandwidth_kbps',
+        'fleet_prefetch_concurrency',
+        'terrasync_proxy_path',
+        'terrasync_upstream',
+        'terrasync_dirindex_ttl',
+        'warm_page_cache',
+        'page_cache_warmup_threads',
+        'scenery_prefetch_radius',
+        'fgfs_log_to_file',
+        'http_server',
+        'http_threads',
         'uuid'
     ]
 
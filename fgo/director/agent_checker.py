@@ -1,13 +1,49 @@
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
 import logging
+import typing
+import random
+import time
 
 from PyQt5.QtCore import pyqtSlot, QTimer, QObject
 
 from fgo.director.registry import Registry
 from fgo.director.signals import AgentCheckerSignals
 from fgo.director.agent_directory_settings import  AgentDirectorySettings
+from fgo.director.agent_event_stream import AgentEventStream
 from fgo.director import queries
 
+
+@dataclass
+class AgentPoll:
+    ''' What one poll of an agent found out, None for anything that hasn't changed '''
+    info: dict = None
+    directories: AgentDirectorySettings = None
+    ai_scenarios: typing.List[dict] = None
+    version: str = None
+    # upstream of the agent's TerraSync proxy, only looked at when directories is set
+    terrasync_proxy_upstream: str = None
+    # etags of the sections in the agent's status report, None if it wasn't asked for one
+    etags: typing.Dict[str, str] = None
+    # the agent predates status reports and answered LEGACY_STATUS instead
+    legacy: bool = False
+
+
 class AgentCheckerWorker(QObject):
+    # a classroom's worth of agents are polled at the same time
+    MAX_CONCURRENT_POLLS = 64
+    # seconds an agent has to answer its status report
+    POLL_DEADLINE = 5
+    # milliseconds between looking for agents that are due a poll
+    TICK_INTERVAL = 250
+    # seconds between polls of agents the launch sequence is waiting on,
+    # of other agents, and of agents that are offline
+    WAITING_POLL_INTERVAL = 0.5
+    POLL_INTERVAL = 10
+    OFFLINE_POLL_INTERVAL = 30
+    # intervals are spread by this fraction either way so polls don't bunch up
+    POLL_JITTER = 0.2
+
     def __init__(self):
         super(AgentCheckerWorker, self).__init__()
         self.signals = AgentCheckerSignals()
@@ -15,9 +51,24 @@ class AgentCheckerWorker(QObject):
         self._running = True
         self._previous_candidate_status = {}
         self._previous_agent_status = {}
-        self._ai_scenarios_loaded = []
-        self._version_loaded = []
-        self._directories_loaded = []
+        # hostname -> etags of the status report sections we have, by the
+        # name of the variable they are passed back as
+        self._etags = {}
+        # hostnames of agents that predate status reports
+        self._legacy_hosts = set()
+        self._event_streams = {}
+        self._wait_list = []
+        # hostname -> time.monotonic() at which the agent is next polled
+        self._next_poll_at = {}
+        # hostname -> (agent, future) of polls that haven't been merged yet
+        self._polls = {}
+        # hostnames whose running poll is out of date, it is polled again
+        # once that finishes rather than twice at once
+        self._stale_polls = set()
+        self._poll_executor = ThreadPoolExecutor(
+            max_workers=self.MAX_CONCURRENT_POLLS,
+            thread_name_prefix='fgo-agent-poll'
+        )
 
         self._counter_timer = None
 
@@ -28,138 +79,338 @@ class AgentCheckerWorker(QObject):
         self._check_agents()
         self._counter_timer = QTimer()
         self._counter_timer.timeout.connect(self._check_agents)
-        self._counter_timer.start(10000)
+        self._counter_timer.start(self.TICK_INTERVAL)
         logging.debug('started agent checker')
 
+    @pyqtSlot(list)
+    def handle_wait_list_changed(self, hostnames):
+        self._wait_list = hostnames
+        now = time.monotonic()
+
+        for hostname in hostnames:
+            # poll them now rather than when they are next due at the slower interval
+            self._next_poll_at[hostname] = min(self._next_poll_at.get(hostname, now), now)
+
     @pyqtSlot(str)
     def handle_taint_agent_status(self, hostname):
-        self._remove_host_from_loaded_lists(hostname)
+        self._etags.pop(hostname, None)
         target = self.registry.get_agent(hostname)
         previous_status = target.status
         next_status = 'PENDING'
         target.status = next_status
         self.signals.agent_status_changed.emit(hostname, previous_status, next_status)
+        # the agent won't push an event if its status is unchanged, so ask it
+        # now rather than leaving it pending until it is next due
+        if not target.backing_off:
+            self._submit_poll(target)
+
         self.signals.agents_changed.emit()
 
+    @pyqtSlot(str, dict)
+    def handle_agent_event(self, hostname, info_res):
+        agent = self.registry.find_agent_by_host(hostname)
+
+        if agent is None or agent.backing_off:
+            return
+
+        # whatever a poll still in flight finds out is older than this
+        self._cancel_poll(hostname)
+        agent_changed = self._apply_poll(agent, AgentPoll(info=info_res))
+        self._next_poll_at[hostname] = time.monotonic() + self._poll_interval(agent)
+
+        if hostname not in self._etags:
+            # we don't have its config, AI scenarios and version yet
+            self._submit_poll(agent)
+
+        if agent_changed:
+            self.signals.agents_changed.emit()
+
+    @pyqtSlot(str)
+    def handle_agent_event_stream_closed(self, hostname):
+        # poll straight away so that an agent which went away is noticed now,
+        # merging the poll will try to follow its events again
+        agent = self.registry.find_agent_by_host(hostname)
+
+        if agent is None or agent.backing_off:
+            return
+
+        self._submit_poll(agent)
+
     def _check_agents(self):
-        logging.debug('Checking agent status')
         something_changed = False
+        now = time.monotonic()
+
+        for hostname in list(self._event_streams.keys()):
+            if self.registry.find_agent_by_host(hostname) is None:
+                self._event_streams.pop(hostname).stop()
+
+        # polls that have finished since the last tick are merged in one go,
+        # those still waiting on a slow agent hold nobody else up
+        for hostname, (agent, future) in list(self._polls.items()):
+            if not future.done():
+                continue
+
+            del self._polls[hostname]
+
+            if self.registry.find_agent_by_host(hostname) is None:
+                # removed while it was being polled
+                self._next_poll_at.pop(hostname, None)
+                self._stale_polls.discard(hostname)
+                continue
+
+            if hostname in self._stale_polls:
+                self._stale_polls.discard(hostname)
+
+                if not agent.backing_off:
+                    self._submit_poll(agent)
+
+                continue
+
+            something_changed = self._apply_poll(agent, future.result()) or something_changed
+            self._next_poll_at[hostname] = now + self._poll_interval(agent)
+            stream = self._event_streams.get(hostname)
+
+            if agent.online and (stream is None or not (stream.is_alive() or stream.unsupported)):
+                self._follow_event_stream(agent)
 
         for agent in self.registry.get_agents():
             hostname = agent.host
-            logging.debug(f"Checking {hostname}")
 
-            if agent.failed:
-                logging.debug("Skipping because agent is failed")
+            if hostname in self._polls or now < self._next_poll_at.get(hostname, now):
                 continue
 
-            logging.debug("Agent is not failed")
-            client = agent.client()
-
-            agent_is_primary_candidate = False
-
-            this_agent_changed = False
-
-            if client:
-                agent_is_online = True
-                info_res = client.execute(queries.INFO)
-                logging.debug(f"Raw result: {info_res}")
-
-                if agent.info_hash != info_res:
-                    #  don't flag this as a `agent_changed` or `something_changed`
-                    #  event because we want to ignore timestamp & id
-                    this_agent_changed = True
-                    agent.info_hash = info_res
-
-                agent_info_status = info_res['info']['status']
-                agent_is_primary_candidate = agent_info_status == 'READY'
-
-                if agent_info_status in ['ERROR', 'UNKNOWN']:
-                    self._remove_host_from_loaded_lists(hostname)
-
-                if hostname not in self._directories_loaded:
-                    logging.info(f"Asking {hostname} for its directories")
-                    res = client.execute(queries.CONFIG)
-                    logging.debug(f"Config Query result for {hostname}:\n\n{res}")
-                    agent.directories = AgentDirectorySettings.from_gql_query(res["config"])
-                    self._directories_loaded.append(hostname)
-                    this_agent_changed = True
-
-                if agent_is_primary_candidate and hostname not in self._ai_scenarios_loaded:
-                    logging.info(f"Asking {hostname} for its list of AI Scenarios")
-                    ai_scenario_res = client.execute(queries.AI_SCENARIOS)
-                    agent.ai_scenarios = sorted([scenario['name'] for scenario in ai_scenario_res['aiScenarios']])
-                    self._ai_scenarios_loaded.append(hostname)
-                    this_agent_changed = True
-
-                if agent_is_primary_candidate and hostname not in self._version_loaded:
-                    logging.info(f"Asking {hostname} for its version")
-                    version_res = client.execute(queries.VERSION)
-                    agent.version = version_res['version']['versionString']
-                    self._version_loaded.append(hostname)
-                    this_agent_changed = True
-
-                previous_status = agent.status
-
-                if agent_info_status != previous_status:
-                    this_agent_changed = True
-                    agent.status = agent_info_status
-                    self.signals.agent_status_changed.emit(
-                        hostname,
-                        previous_status,
-                        agent_info_status
-                    )
+            if agent.backing_off:
+                logging.debug(f"Skipping {hostname} because we are backing off from it")
+                continue
+
+            stream = self._event_streams.get(hostname)
+
+            if stream is not None and stream.connected:
+                logging.debug(f"Skipping {hostname} because it pushes its status")
+                continue
+
+            self._submit_poll(agent)
+
+        if something_changed:
+            self.signals.agents_changed.emit()
+
+    def _poll_interval(self, agent) -> float:
+        if agent.host in self._wait_list:
+            interval = self.WAITING_POLL_INTERVAL
+        elif agent.online:
+            interval = self.POLL_INTERVAL
+        else:
+            interval = self.OFFLINE_POLL_INTERVAL
+
+        return interval * random.uniform(1 - self.POLL_JITTER, 1 + self.POLL_JITTER)
+
+    def _follow_event_stream(self, agent):
+        stream = AgentEventStream(agent.host, agent.port)
+        stream.signals.agent_event_received.connect(self.handle_agent_event)
+        stream.signals.agent_event_stream_closed.connect(self.handle_agent_event_stream_closed)
+        self._event_streams[agent.host] = stream
+        stream.start()
+
+    def _submit_poll(self, agent):
+        ''' Polls the agent on the poll executor, the next tick after it finishes merges the result '''
+        self._cancel_poll(agent.host)
+
+        if agent.host in self._polls:
+            # polled again once the poll that is running finishes
+            return
+
+        logging.debug(f"Checking {agent.host}")
+        self._polls[agent.host] = (agent, self._poll_executor.submit(self._poll_agent, agent))
+
+    def _cancel_poll(self, hostname):
+        '''
+        Forgets a poll that hasn't started yet, one that has is left to
+        finish, its result is thrown away and the agent is polled again
+        '''
+        in_flight = self._polls.get(hostname)
+
+        if in_flight is None:
+            return
+
+        if in_flight[1].cancel():
+            del self._polls[hostname]
+        else:
+            self._stale_polls.add(hostname)
+
+    def _poll_agent(self, agent) -> AgentPoll:
+        '''
+        Asks an agent for its status report, passing the etags of the
+        sections we have so that only those which changed are sent, in a
+        single request which gives up after POLL_DEADLINE. Runs on the poll
+        executor, so it leaves the registry and signals alone apart from
+        the agent's fail count, which its client keeps.
+        '''
+        hostname = agent.host
+        poll = AgentPoll()
+        client = agent.client()
+
+        if client is None:
+            logging.debug(f"Skipping {hostname} because we are backing off from it")
+            return poll
+
+        if hostname in self._legacy_hosts:
+            return self._poll_legacy_agent(agent, client)
+
+        try:
+            res = client.execute(
+                queries.STATUS_REPORT,
+                variable_values=self._etags.get(hostname, {}),
+                timeout=self.POLL_DEADLINE
+            )['statusReport']
+            logging.debug(f"Status report of {hostname}:\n\n{res}")
+            poll.etags = {key: res[key] for key in ['infoEtag', 'configEtag', 'aiScenariosEtag', 'versionEtag']}
+
+            if res['info'] is not None:
+                poll.info = {**agent.info_hash, 'info': res['info']}
             else:
-                agent_is_online = False
-                agent.status = None
+                # unchanged, which is an answer all the same
+                poll.info = agent.info_hash
+
+            if res['config'] is not None:
+                poll.directories = AgentDirectorySettings.from_gql_query(res['config'])
+                config = {entry['key']: entry['value'] for entry in res['config']}
+
+                if config.get('terrasync_proxy_path') is not None:
+                    poll.terrasync_proxy_upstream = config.get('terrasync_upstream')
+
+            if res['aiScenarios'] is not None:
+                poll.ai_scenarios = res['aiScenarios']
+
+            if res['version'] is not None:
+                poll.version = res['version']['versionString']
+        except Exception as e:
+            if queries.NO_STATUS_REPORT in f"{e}":
+                logging.info(f"{hostname} predates status reports, asking it for everything on each poll")
+                return self._poll_legacy_agent(agent, client)
+
+            logging.warning(f"Unable to check {hostname}: {e}")
+
+        return poll
+
+    def _poll_legacy_agent(self, agent, client) -> AgentPoll:
+        ''' Asks an agent that predates status reports for everything _poll_agent would have '''
+        poll = AgentPoll(legacy=True)
+
+        try:
+            res = client.execute(queries.LEGACY_STATUS, timeout=self.POLL_DEADLINE)
+            poll.info = {**agent.info_hash, 'info': res['info']}
+            poll.directories = AgentDirectorySettings.from_gql_query(res['config'])
+            # nor do they tell us about carriers
+            poll.ai_scenarios = [{'name': scenario['name'], 'carriers': []} for scenario in res['aiScenarios']]
+            poll.version = res['version']['versionString']
+            # there is nothing to pass back, but having them stops agent events
+            # asking for a full poll every time
+            poll.etags = {}
+        except Exception as e:
+            logging.warning(f"Unable to check {agent.host}: {e}")
+
+        return poll
+
+    def _apply_poll(self, agent, poll: AgentPoll) -> bool:
+        ''' Merges what _poll_agent found out into the agent, returns True if anything about it changed '''
+        hostname = agent.host
+        info_res = poll.info
+        agent_is_primary_candidate = False
+
+        this_agent_changed = False
+
+        if info_res is not None:
+            agent_is_online = True
+            logging.debug(f"Raw result: {info_res}")
+
+            if agent.info_hash != info_res:
+                #  don't flag this as a `agent_changed` or `something_changed`
+                #  event because we want to ignore timestamp & id
+                this_agent_changed = True
+                agent.info_hash = info_res
+
+            agent_info_status = info_res['info']['status']
+            agent_is_primary_candidate = agent_info_status == 'READY'
 
-                if agent.failed:
-                    # agent is now failed, emit agent just failed message
-                    this_agent_changed = True
-                    self.signals.agent_failed.emit(hostname)
+            if poll.etags is not None:
+                self._etags[hostname] = poll.etags
 
-            # send online / offline message once
-            if agent_is_online != agent.online:
+            if poll.legacy:
+                self._legacy_hosts.add(hostname)
+
+            if poll.directories is not None:
+                agent.directories = poll.directories
+                agent.terrasync_proxy_upstream = poll.terrasync_proxy_upstream
+                this_agent_changed = True
+
+            if poll.ai_scenarios is not None:
+                agent.ai_scenarios = sorted([scenario['name'] for scenario in poll.ai_scenarios])
+                agent.carriers = sorted({
+                    carrier for scenario in poll.ai_scenarios for carrier in scenario['carriers']
+                })
                 this_agent_changed = True
-                if agent_is_online:
-                    self.signals.agent_gone_online.emit(hostname)
-                else:
-                    self.signals.agent_gone_offline.emit(hostname)
-
-                agent.online = agent_is_online
-
-            # send primary candidate yes/no message once
-            emit_candidate_message = False
-            if hostname in self._previous_candidate_status.keys():
-                if self._previous_candidate_status[hostname] != agent_is_primary_candidate:
-                    emit_candidate_message = True
-                    self._previous_candidate_status[hostname] = agent_is_primary_candidate
-            else:
-                emit_candidate_message = True
-                self._previous_candidate_status[hostname] = agent_is_primary_candidate
 
-            if emit_candidate_message:
+            if poll.version is not None:
+                agent.version = poll.version
                 this_agent_changed = True
-                if agent_is_primary_candidate:
-                    self.signals.primary_candidate_add.emit(hostname)
-                else:
-                    self.signals.primary_candidate_remove.emit(hostname)
 
-            if this_agent_changed:
-                self.signals.agent_info_updated.emit(hostname, agent.to_update_dict())
+            previous_status = agent.status
 
-            something_changed = something_changed or this_agent_changed
+            if agent_info_status != previous_status:
+                this_agent_changed = True
+                agent.status = agent_info_status
+                self.signals.agent_status_changed.emit(
+                    hostname,
+                    previous_status,
+                    agent_info_status
+                )
+        else:
+            agent_is_online = False
+            agent.status = None
+            # so that it is sent everything in one go when it is back, and
+            # asked for a status report again in case it has been upgraded
+            self._etags.pop(hostname, None)
+            self._legacy_hosts.discard(hostname)
 
-        if something_changed:
-            self.signals.agents_changed.emit()
+            if agent.failed:
+                # fail_count and retry_at have moved on
+                this_agent_changed = True
+
+            if agent.fail_count == agent.FAIL_LIMIT:
+                # agent has just failed, emit agent just failed message
+                self.signals.agent_failed.emit(hostname)
+
+        # send online / offline message once
+        if agent_is_online != agent.online:
+            this_agent_changed = True
+            if agent_is_online:
+                self.signals.agent_gone_online.emit(hostname)
+            else:
+                self.signals.agent_gone_offline.emit(hostname)
+
+            agent.online = agent_is_online
+
+        # send primary candidate yes/no message once
+        emit_candidate_message = False
+        if hostname in self._previous_candidate_status.keys():
+            if self._previous_candidate_status[hostname] != agent_is_primary_candidate:
+                emit_candidate_message = True
+                self._previous_candidate_status[hostname] = agent_is_primary_candidate
+        else:
+            emit_candidate_message = True
+            self._previous_candidate_status[hostname] = agent_is_primary_candidate
+
+        if emit_candidate_message:
+            this_agent_changed = True
+            if agent_is_primary_candidate:
+                self.signals.primary_candidate_add.emit(hostname)
+            else:
+                self.signals.primary_candidate_remove.emit(hostname)
+
+        if this_agent_changed:
+            self.signals.agent_info_updated.emit(hostname, agent.to_update_dict())
 
-    def _remove_host_from_loaded_lists(self, hostname):
-        if hostname in self._ai_scenarios_loaded:
-            self._ai_scenarios_loaded.remove(hostname)
-        if hostname in self._version_loaded:
-            self._version_loaded.remove(hostname)
-        if hostname in self._directories_loaded:
-            self._directories_loaded.remove(hostname)
+        return this_agent_changed
 
     def load_registry_from_save(self, dictionary):
         self.registry.load_dict(dictionary)
@@ -0,0 +1,74 @@
+import threading
+import logging
+import json
+
+import requests
+from graphql.language.printer import print_ast
+
+from fgo.director import queries
+from fgo.director.signals import AgentEventStreamSignals
+
+
+class AgentEventStream(threading.Thread):
+    '''
+    Follows an agent's /events Server-Sent Events stream and emits every
+    INFO result it pushes. The agent checker only polls agents that have no
+    stream connected.
+    '''
+    CONNECT_TIMEOUT = 5
+    # agents send a keep-alive every 15 seconds, give up after missing a few
+    READ_TIMEOUT = 45
+
+    def __init__(self, hostname: str, port: str):
+        super(AgentEventStream, self).__init__(name=f"fgo-events-{hostname}", daemon=True)
+        self.hostname = hostname
+        self.url = f"http://{hostname}:{port}/events"
+        self.signals = AgentEventStreamSignals()
+        self.connected = False
+        # older agents have no /events endpoint, those are only ever polled
+        self.unsupported = False
+        self._stopped = False
+
+    def stop(self):
+        self._stopped = True
+
+    def run(self):
+        try:
+            with requests.get(
+                self.url,
+                params={'query': print_ast(queries.INFO)},
+                stream=True,
+                timeout=(self.CONNECT_TIMEOUT, self.READ_TIMEOUT)
+            ) as response:
+                if response.status_code == 404:
+                    self.unsupported = True
+
+                response.raise_for_status()
+                self.connected = True
+                logging.info(f"Following event stream of {self.hostname}")
+                event_type = None
+                data_lines = []
+
+                for line in response.iter_lines(decode_unicode=True):
+                    if self._stopped:
+                        break
+
+                    if line.startswith('event:'):
+                        event_type = line[len('event:'):].strip()
+                    elif line.startswith('data:'):
+                        data_lines.append(line[len('data:'):].strip())
+                    elif line == '' and data_lines:
+                        self._dispatch(event_type, '\n'.join(data_lines))
+                        event_type = None
+                        data_lines = []
+        except (requests.exceptions.RequestException, ValueError) as e:
+            logging.debug(f"Event stream of {self.hostname} ended: {e}")
+        finally:
+            self.connected = False
+            self.signals.agent_event_stream_closed.emit(self.hostname)
+
+    def _dispatch(self, event_type, data):
+        if event_type == 'info':
+            self.signals.agent_event_received.emit(self.hostname, json.loads(data))
+        else:
+            logging.warning(f"Event stream of {self.hostname} sent {event_type}: {data}")
@@ -11,7 +11,7 @@ import os
 
 import yaml
 
-from PyQt5.QtWidgets import QApplication, QMainWindow, QInputDialog, QLineEdit, QMenu, QMessageBox, QLabel, QProgressBar, QFileDialog, QCheckBox
+from PyQt5.QtWidgets import QApplication, QMainWindow, QInputDialog, QLineEdit, QMenu, QMessageBox, QLabel, QProgressBar, QFileDialog, QCheckBox, QCompleter
 from PyQt5.QtCore import pyqtSlot, Qt, QTimer, QThread, QModelIndex, QPoint, QThreadPool
 
 from fgo.config import Config
@@ -30,8 +30,10 @@ from fgo.director.select_airport_dialog import SelectAirportDialog
 from fgo.director.show_errors_dialog import ShowErrorsDialog
 from fgo.director.configure_agent_paths_dialog import ConfigureAgentPathsDialog
 from fgo.director.parking_cache_updater_worker import ParkingCacheUpdaterWorker
+from fgo.director.scenery_prefetch_worker import SceneryPrefetchWorker
 from fgo.director import parking_record
 from fgo.director import parking_data
+from fgo.director import scenery_data
 from fgo.director.select_parking_location_dialog import SelectParkingLocationDialog
 from fgo.director import aircraft_data
 from fgo.director.select_aircraft_dialog import SelectAircraftDialog
@@ -110,6 +112,7 @@ class MainWindow(QMainWindow, Ui_MainWindow):
         self.agent_checker_worker.signals.primary_candidate_add.connect(self.handle_primary_candidate_add)
         self.agent_checker_worker.signals.primary_candidate_remove.connect(self.handle_primary_candidate_remove)
         self.agent_checker_worker.signals.agent_status_changed.connect(self.handle_agent_state_changed)
+        self.signals.wait_list_changed.connect(self.agent_checker_worker.handle_wait_list_changed)
         # connect UI signals and worker signals before starting agent checker thread
         self._agent_checker_thread.start()
 
@@ -120,6 +123,7 @@ class MainWindow(QMainWindow, Ui_MainWindow):
         self.signals.agent_custom_settings_updated.connect(self.registry.handle_agent_custom_settings_updated)
 
         self._ai_scenarios = []
+        self._carriers = []
 
         self._cancel_requested = None
         self._stage_watchdog_timer = None
@@ -154,6 +158,7 @@ class MainWindow(QMainWindow, Ui_MainWindow):
         self.controls_enabled = True
         self.parking_cache_loaded = True
         self.parking_cache_threadpool = QThreadPool()
+        self.scenery_prefetch_threadpool = QThreadPool()
 
     def _retrieve_web_panels(self):
         current_aircraft = self.pbAircraft.text()
@@ -366,6 +371,19 @@ class MainWindow(QMainWindow, Ui_MainWindow):
         logging.debug("update_agent_view called")
         self.registry_model.updateModel()
         self.tvAgents.resizeColumnsToContents()
+        self._update_carrier_completer()
+
+    def _update_carrier_completer(self):
+        ''' Offers the carriers found in the primary's AI scenarios '''
+        carriers = self.registry.get_carriers_from_host(self.cbPrimaryAgent.currentText())
+
+        if carriers == self._carriers:
+            return
+
+        self._carriers = carriers
+        completer = QCompleter(carriers, self.leCarrier)
+        completer.setCaseSensitivity(Qt.CaseInsensitive)
+        self.leCarrier.setCompleter(completer)
 
     @pyqtSlot(str)
     def handle_primary_candidate_add(self, host):
@@ -417,6 +435,12 @@ class MainWindow(QMainWindow, Ui_MainWindow):
         reset_fail_count_action.setEnabled(False)
         show_errors_action = menu.addAction("Show errors")
         show_errors_action.setEnabled(False)
+        show_fgfs_log_action = menu.addAction("Show FlightGear log")
+        show_fgfs_log_action.setEnabled(False)
+        prefetch_aircraft_action = menu.addAction("Prefetch scenario aircraft on all agents")
+        prefetch_aircraft_action.setEnabled(False)
+        reconfigure_session_action = menu.addAction("Apply position and time of day to session")
+        reconfigure_session_action.setEnabled(self._state == DirectorState.IN_SESSION)
         menu.addSeparator()
         stop_flightgear_action = menu.addAction("Stop Flightgear")
         stop_flightgear_action.setEnabled(False)
@@ -438,10 +462,14 @@ class MainWindow(QMainWindow, Ui_MainWindow):
             if self.registry.is_agent_online(hostname):
                 rescan_environment_action.setEnabled(True)
                 manage_directories_action.setEnabled(True)
+                show_fgfs_log_action.setEnabled(True)
 
             if self.registry.agent_has_errors(hostname):
                 show_errors_action.setEnabled(True)
 
+            if self._selected_aircraft_directory:
+                prefetch_aircraft_action.setEnabled(True)
+
             if self.registry.is_agent_running_fgfs(hostname):
                 stop_flightgear_action.setEnabled(True)
 
@@ -480,6 +508,36 @@ class MainWindow(QMainWindow, Ui_MainWindow):
         if res == show_errors_action:
             ShowErrorsDialog(hostname, self.registry.get_errors_for_agent(hostname)).exec_()
 
+        if res == show_fgfs_log_action:
+            fgfs_log = self.registry.get_fgfs_log_for_agent(hostname)
+            ShowErrorsDialog(hostname, f"FlightGear output on {hostname}:\n\n{fgfs_log}").exec_()
+
+        if res == prefetch_aircraft_action:
+            ok, error_str = self.registry.prefetch_aircraft(
+                [self._selected_aircraft_directory],
+                [agent.host for agent in self.registry.all_agents if agent.online],
+                self._config.fleet_prefetch_bandwidth_kbps,
+                self._config.fleet_prefetch_concurrency
+            )
+
+            if ok:
+                QMessageBox.information(
+                    self,
+                    "Prefetch queued",
+                    f"Agents will install {self._selected_aircraft_directory} during their prefetch windows",
+                    buttons=QMessageBox.Ok
+                )
+            else:
+                ShowErrorsDialog(hostname, error_str).exec_()
+
+        if res == reconfigure_session_action:
+            ok, error_str = self.registry.reconfigure_session(self._map_form_to_scenario_settings())
+
+            if ok:
+                self.save_scenario(self._last_session_path)
+            else:
+                ShowErrorsDialog(hostname, error_str).exec_()
+
         if res == manage_directories_action:
             original_directories = self.registry.get_directories_for_agent(hostname)
             if original_directories is None:
@@ -545,6 +603,8 @@ class MainWindow(QMainWindow, Ui_MainWindow):
             self.pbLaunch.setEnabled(True)
             self.pbManageAIScenarios.setEnabled(True)
 
+        self._update_carrier_completer()
+
     @pyqtSlot()
     def on_pbManageAIScenarios_clicked(self):
         current_primary = self._selected_primary
@@ -628,18 +688,79 @@ class MainWindow(QMainWindow, Ui_MainWindow):
         self._cancel_requested = False
 
         if scenario_settings.skip_aircraft_install or scenario_settings.aircraft in [None, "c172p"]:
+            # with nothing to install there's no time to prefetch scenery in,
+            # TerraSync would race the prefetcher for the same tiles
             self._stage_count = 1 + len(self._selected_secondary_hostnames)
-            self._wait_list = [primary_hostname]
+            self._set_wait_list([primary_hostname])
             self._state = DirectorState.WAITING_FOR_PRIMARY
+            self._warm_page_caches()
             self.registry.start_primary()
         else:
-            self._stage_count = 2 + 2 * len(self._selected_secondary_hostnames)
-            self._wait_list = copy.deepcopy(selected_agent_hostnames)
+            self._prefetch_scenery(scenario_settings, selected_agent_hostnames)
+            # every agent is sent the install, those that are up to date
+            # answer it without running svn
+            self.registry.choose_aircraft_seeds(selected_agent_hostnames)
+            self._stage_count = len(selected_agent_hostnames) + 1 + len(self._selected_secondary_hostnames)
+            self._set_wait_list(copy.deepcopy(selected_agent_hostnames))
             self._state = DirectorState.INSTALLING_AIRCRAFT
-            self.registry.install_aircraft()
+            self.registry.install_aircraft(selected_agent_hostnames)
 
         self._status_label.setText(self._state.name)
 
+    def _prefetch_scenery(self, scenario_settings: ScenarioSettings, hostnames: typing.List[str]):
+        '''
+        Has the agents fetch the scenery around the departure runway while
+        aircraft install instead of when FGFS gets there. Tiles the agents
+        haven't got to by the time the install is done may be fetched by
+        TerraSync as well.
+        '''
+        tiles = self._scenery_tiles(scenario_settings)
+
+        if tiles:
+            worker = SceneryPrefetchWorker(self.registry, tiles, hostnames)
+            worker.signals.scenery_prefetch_requested.connect(self.handle_scenery_prefetch_requested)
+            self.scenery_prefetch_threadpool.start(worker)
+
+    def handle_scenery_prefetch_requested(self, ok: bool, error: str):
+        if not ok:
+            # FGFS fetches whatever is missing itself
+            logging.warning(f"Unable to prefetch scenery: {error}")
+
+    def _warm_page_caches(self):
+        '''
+        Has the agents read the aircraft, now that it is installed, and the
+        scenery around the departure runway into their page caches ahead of
+        FGFS
+        '''
+        scenario_settings = self.registry.scenario_settings
+        ok, error = self.registry.warm_page_cache(
+            scenario_settings.aircraft_directory,
+            self._scenery_tiles(scenario_settings),
+            [self._selected_primary] + self._selected_secondary_hostnames
+        )
+
+        if not ok:
+            logging.warning(f"Unable to warm page caches: {error}")
+
+    def _scenery_tiles(self, scenario_settings: ScenarioSettings) -> typing.List[str]:
+        ''' Returns the scenery tiles around the departure runway, none if we don't know where that is '''
+        radius = self._config.scenery_prefetch_radius
+
+        if radius is None or scenario_settings.selected_airport_option != 1 or not scenario_settings.airport:
+            return []
+
+        runway = scenario_settings.runway if scenario_settings.selected_runway_option == 1 else None
+        positions = scenery_data.get_runway_positions(self._config.nav_db, scenario_settings.airport, runway)
+
+        if not positions and runway is not None:
+            # not a runway the nav db knows about, the airport will do
+            positions = scenery_data.get_runway_positions(self._config.nav_db, scenario_settings.airport)
+
+        if not positions:
+            logging.info(f"No runways known for {scenario_settings.airport}, not preparing scenery")
+
+        return scenery_data.get_scenery_tiles(positions, radius)
+
     def _figure_out_primary_and_secondaries(self):
         primary_hostname = self.cbPrimaryAgent.currentText()
         logging.info(f"Primary is: {primary_hostname}")
@@ -692,6 +813,7 @@ class MainWindow(QMainWindow, Ui_MainWindow):
             self.registry.stop_fgfs()
 
         self._state = DirectorState.IDLE
+        self._set_wait_list([])
         self._status_label.setText(self._state.name)
         self.pbWebPanels.setEnabled(False)
         self._unlock_scenario_controls()
@@ -714,7 +836,7 @@ class MainWindow(QMainWindow, Ui_MainWindow):
         def advance_stage(hostname_):
             logging.debug(f"handle_agent_state_changed.advance_stage hostname: {hostname_}")
             self._stages_passed += 1
-            self._wait_list.remove(hostname_)
+            self._set_wait_list([hostname for hostname in self._wait_list if hostname != hostname_])
             self._status_progress_bar.setValue(int((self._stages_passed / self._stage_count) * 100))
             next_state = copy.copy(self._state)
 
@@ -723,7 +845,8 @@ class MainWindow(QMainWindow, Ui_MainWindow):
                 self._stage_started_datetime = datetime.now()
                 self._status_timer_label.setText(f"{self.STAGE_TIMEOUT}")
                 if current_state == DirectorState.INSTALLING_AIRCRAFT:
-                    self._wait_list = [self._selected_primary]
+                    self._set_wait_list([self._selected_primary])
+                    self._warm_page_caches()
                     self.registry.start_primary()
                     next_state = DirectorState.WAITING_FOR_PRIMARY
 
@@ -734,7 +857,7 @@ class MainWindow(QMainWindow, Ui_MainWindow):
                         self.pbWebPanels.setEnabled(True)
 
                     if len(self._selected_secondary_hostnames) > 0:
-                        self._wait_list = copy.deepcopy(self._selected_secondary_hostnames)
+                        self._set_wait_list(copy.deepcopy(self._selected_secondary_hostnames))
                         self.registry.start_secondaries()
                         next_state = DirectorState.WAITING_FOR_SECONDARIES
                     else:
@@ -751,6 +874,10 @@ class MainWindow(QMainWindow, Ui_MainWindow):
                 self._status_label.setText(next_state.name)
                 self._state = next_state
 
+                if next_state == DirectorState.IN_SESSION:
+                    # where and when can change without a relaunch, see reconfigure_session
+                    self._set_session_controls_enabled_state(True)
+
         if hostname in self._wait_list:
             if agent_next_state == 'ERROR':
                 QMessageBox.critical(
@@ -771,6 +898,11 @@ class MainWindow(QMainWindow, Ui_MainWindow):
             if current_state == DirectorState.WAITING_FOR_SECONDARIES and state_transition(['FGFS_START_REQUESTED', 'FGFS_STARTING', 'PENDING'], 'FGFS_RUNNING'):
                 advance_stage(hostname)
 
+    def _set_wait_list(self, hostnames: typing.List[str]):
+        self._wait_list = hostnames
+        # the agent checker polls these more often until they move on
+        self.signals.wait_list_changed.emit(list(hostnames))
+
     def _lock_scenario_controls(self):
         self._set_scenario_controls_enabled_state(False)
 
@@ -811,6 +943,20 @@ class MainWindow(QMainWindow, Ui_MainWindow):
 
         self.controls_enabled = enabled
 
+    def _set_session_controls_enabled_state(self, enabled: bool):
+        self.cbTimeOfDay.setEnabled(enabled)
+        self.rbAirport.setEnabled(enabled)
+        self.pbSelectAirport.setEnabled(enabled)
+        self.leAirport.setEnabled(enabled)
+        self.rbCarrier.setEnabled(enabled)
+        self.leCarrier.setEnabled(enabled)
+        self.rbDefaultRunway.setEnabled(enabled)
+        self.rbRunway.setEnabled(enabled)
+        self.leRunway.setEnabled(enabled)
+        self.rbParking.setEnabled(enabled)
+        self.leParking.setEnabled(enabled)
+        self.pbSelectParking.setEnabled(enabled and self.parking_cache_loaded)
+
 
     def _map_form_to_scenario_settings(self):
         ''' reads form values and returns a Registry.ScenarioSettings object '''
@@ -0,0 +1,120 @@
+import hashlib
+import typing
+
+from graphql.execution import ExecutionResult
+from graphql.language.printer import print_ast
+from gql.transport.requests import RequestsHTTPTransport
+import requests
+
+PERSISTED_QUERY_NOT_FOUND = 'PersistedQueryNotFound'
+# what agents that predate persisted queries answer a hash with
+NO_QUERY_STRING = 'Must provide query string.'
+
+# sha256 of every document that is sent hash first, see persisted()
+_persisted_hashes = set()
+
+
+def _sha256(query_str: str) -> str:
+    return hashlib.sha256(query_str.encode('utf-8')).hexdigest()
+
+
+def persisted(document):
+    '''
+    Marks a document that is sent over and over unchanged, with its values
+    passed as variables, and returns it. Only these are sent hash first,
+    documents built with their values in them would miss every time and
+    fill the agent's cache with documents that never come again.
+    '''
+    _persisted_hashes.add(_sha256(print_ast(document)))
+    return document
+
+
+class PersistedQueryTransport(RequestsHTTPTransport):
+    '''
+    Sends the sha256 of each persisted() document first and only sends the
+    document itself when the agent has not seen it yet, see
+    https://github.com/apollographql/apollo-link-persisted-queries#protocol
+    Other documents are sent as they are.
+
+    Agents that predate persisted queries answer the hash with an error of
+    their own, they get the full document on the retry as well.
+
+    on_reachable and on_unreachable are called after each request, depending
+    on whether the agent answered at all.
+    '''
+    def __init__(
+        self,
+        url,
+        on_reachable: typing.Callable[[], None] = None,
+        on_unreachable: typing.Callable[[], None] = None,
+        **kwargs
+    ):
+        super(PersistedQueryTransport, self).__init__(url, **kwargs)
+        self._on_reachable = on_reachable
+        self._on_unreachable = on_unreachable
+
+    def execute(self, document, variable_values=None, timeout=None):
+        query_str = print_ast(document)
+        sha256 = _sha256(query_str)
+        payload = {
+            'variables': variable_values or {}
+        }
+
+        if sha256 not in _persisted_hashes:
+            payload['query'] = query_str
+            result = self._post(payload, timeout)
+            return ExecutionResult(errors=result.get('errors'), data=result.get('data'))
+
+        payload['extensions'] = {
+            'persistedQuery': {
+                'version': 1,
+                'sha256Hash': sha256
+            }
+        }
+        result = self._post(payload, timeout)
+        messages = [error.get('message') for error in result.get('errors') or [] if isinstance(error, dict)]
+
+        if PERSISTED_QUERY_NOT_FOUND in messages or NO_QUERY_STRING in messages:
+            payload['query'] = query_str
+            result = self._post(payload, timeout)
+
+        return ExecutionResult(errors=result.get('errors'), data=result.get('data'))
+
+    def _post(self, payload, timeout):
+        post_args = {
+            'headers': self.headers,
+            'auth': self.auth,
+            'cookies': self.cookies,
+            'timeout': timeout or self.default_timeout,
+            'verify': self.verify,
+            # extensions don't survive form encoding
+            'json': payload,
+        }
+        post_args.update(self.kwargs)
+
+        try:
+            response = self.session.request(self.method, self.url, **post_args)
+        except (requests.exceptions.ConnectionError, requests.exceptions.Timeout):
+            if self._on_unreachable is not None:
+                self._on_unreachable()
+
+            raise
+
+        if self._on_reachable is not None:
+            self._on_reachable()
+
+        try:
+            result = response.json()
+
+            if not isinstance(result, dict):
+                raise ValueError
+        except ValueError:
+            result = {}
+
+        if 'errors' not in result and 'data' not in result:
+            response.raise_for_status()
+            raise requests.HTTPError(
+                "Server did not return a GraphQL result", response=response
+            )
+
+        return result
@@ -1,44 +1,81 @@
 import textwrap
+import json
 import logging
 import typing
 
 from gql import gql
 
+from fgo.director.persisted_query_transport import persisted
 from fgo.director.agent_directory_settings import AgentDirectorySettings
 from fgo.director.scenario_settings import ScenarioSettings
 from fgo.director.custom_agent_settings import CustomAgentSettings
 
-AIRCRAFT = gql('''
+INFO = persisted(gql('''
 {
-  info {
-    aircraft {
-        id
-        name
-        version
+    info {
+        status
+        uuid
+        os
+        errors {
+            id
+            code
+            description
+        }
+        aircraft {
+            name
+            revision
+        }
     }
-  }
-}
-''')
-
-AI_SCENARIOS = gql('''
-{
-    aiScenarios {
-        name
+    version {
+        versionString
     }
 }
-''')
-
-CONFIG = gql('''
-{
-    config {
-        id
-        key
-        value
+'''))
+
+# etags are passed as variables so that the document, and with it its
+# persisted query hash, stays the same from one poll to the next
+STATUS_REPORT = persisted(gql('''
+query ($infoEtag: String, $configEtag: String, $aiScenariosEtag: String, $versionEtag: String) {
+    statusReport(infoEtag: $infoEtag, configEtag: $configEtag, aiScenariosEtag: $aiScenariosEtag, versionEtag: $versionEtag) {
+        info {
+            status
+            uuid
+            os
+            errors {
+                id
+                code
+                description
+            }
+            aircraft {
+                name
+                revision
+            }
+        }
+        infoEtag
+        config {
+            id
+            key
+            value
+        }
+        configEtag
+        aiScenarios {
+            name
+            carriers
+        }
+        aiScenariosEtag
+        version {
+            versionString
+        }
+        versionEtag
     }
 }
-''')
+'''))
+# what an agent without statusReport answers it with
+NO_STATUS_REPORT = 'Cannot query field "statusReport"'
 
-INFO = gql('''
+# everything STATUS_REPORT asks for, for agents that predate it and
+# persisted queries, which is also why it isn't persisted
+LEGACY_STATUS = gql('''
 {
     info {
         status
@@ -50,38 +87,72 @@ INFO = gql('''
             description
         }
     }
-    version {
-        versionString
+    config {
+        id
+        key
+        value
+    }
+    aiScenarios {
+        name
     }
-}
-''')
-
-VERSION = gql('''
-{
     version {
         versionString
     }
 }
 ''')
+
 # mutations
-RESCAN_ENVIRONMENT = gql('''
+RESCAN_ENVIRONMENT = persisted(gql('''
 mutation {
     rescanEnvironment {
         ok
     }
-}''')
+}'''))
 
-STOP_FLIGHTGEAR = gql('''mutation {
+STOP_FLIGHTGEAR = persisted(gql('''mutation {
     stopFlightGear {
         ok
         error
     }
-}''')
+}'''))
+
+def AircraftInstallQuery(aircraft, force=False, peers: typing.List[str] = None):
+    return gql(textwrap.dedent(f'''
+        mutation {{
+          installOrUpdateAircraft(svnName: "{aircraft}", force: {'true' if force else 'false'}, peers: {json.dumps(peers or [])}) {{
+            ok
+            error
+          }}
+        }}
+    '''))
 
-def AircraftInstallQuery(aircraft):
+def PrefetchAircraftQuery(aircraft_names: typing.List[str], peers: typing.List[str] = None, bandwidth_kbps: int = None):
+    bandwidth_arg = '' if bandwidth_kbps is None else f", bandwidthKbps: {bandwidth_kbps}"
     return gql(textwrap.dedent(f'''
         mutation {{
-          installOrUpdateAircraft(svnName: "{aircraft}") {{
+          prefetchAircraft(svnNames: {json.dumps(aircraft_names)}, peers: {json.dumps(peers or [])}{bandwidth_arg}) {{
+            ok
+            error
+          }}
+        }}
+    '''))
+
+def PrefetchSceneryQuery(tiles: typing.List[str], terrasync_endpoint: str = None):
+    endpoint_arg = '' if not terrasync_endpoint else f", terrasyncEndpoint: {json.dumps(terrasync_endpoint)}"
+    return gql(textwrap.dedent(f'''
+        mutation {{
+          prefetchScenery(tiles: {json.dumps(tiles)}{endpoint_arg}) {{
+            ok
+            error
+          }}
+        }}
+    '''))
+
+def WarmPageCacheQuery(aircraft: str = None, tiles: typing.List[str] = None):
+    aircraft_arg = '' if aircraft is None else f"aircraft: {json.dumps(aircraft)}, "
+    return gql(textwrap.dedent(f'''
+        mutation {{
+          warmPageCache({aircraft_arg}tiles: {json.dumps(tiles or [])}) {{
             ok
             error
           }}
@@ -226,6 +297,45 @@ def StartFlightGear(hostname, scenario_settings: ScenarioSettings, custom_settin
     logging.info(f"StartFlightGear query for {hostname}:\n\n{memo}")
     return gql(memo)
 
+def ReconfigureFlightGear(scenario_settings: ScenarioSettings):
+    ''' Applies the scenario's position and time of day to a running FlightGear '''
+    settings = []
+
+    if scenario_settings.selected_airport_option == 1 and scenario_settings.airport:
+        settings.append(f"airportCode: {json.dumps(scenario_settings.airport)}")
+    elif scenario_settings.selected_airport_option == 2 and scenario_settings.carrier:
+        settings.append(f"carrier: {json.dumps(scenario_settings.carrier)}")
+
+    if scenario_settings.selected_runway_option == 1 and scenario_settings.runway:
+        settings.append(f"runway: {json.dumps(scenario_settings.runway)}")
+    elif scenario_settings.selected_runway_option == 2 and scenario_settings.parking:
+        settings.append(f"parkpos: {json.dumps(scenario_settings.parking)}")
+
+    if scenario_settings.time_of_day:
+        settings.append(f"timeOfDay: {scenario_settings.time_of_day.upper()}")
+
+    return gql(textwrap.dedent(f'''
+        mutation {{
+          reconfigureFlightGear(settings: {{ {', '.join(settings)} }}) {{
+            ok
+            error
+            commands
+          }}
+        }}
+    '''))
+
+# asked for again with a new sinceOffset every time the log is refreshed
+FGFS_LOG = persisted(gql('''
+query ($sinceOffset: Int) {
+    fgfsLog(sinceOffset: $sinceOffset) {
+        offset
+        lines
+        nextOffset
+    }
+}
+'''))
+
+
 def RemoteDirectoryListingQuery(remote_directory):
     return gql(textwrap.dedent(f'''
         {{
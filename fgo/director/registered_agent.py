@@ -1,13 +1,14 @@
 from dataclasses import dataclass, field
+import datetime
 import logging
 import typing
-import urllib3
+import time
 
 import requests
 from gql import Client, gql
-from gql.transport.requests import RequestsHTTPTransport
 
 from fgo.director import queries
+from fgo.director.persisted_query_transport import PersistedQueryTransport
 from fgo.director.scenario_settings import ScenarioSettings
 from fgo.director.custom_agent_settings import CustomAgentSettings
 from fgo.director.agent_directory_settings import AgentDirectorySettings
@@ -15,7 +16,14 @@ from fgo.director.agent_directory_settings import AgentDirectorySettings
 
 @dataclass
 class RegisteredAgent:
+    # consecutive failures before we back off from an agent
     FAIL_LIMIT = 3
+    # seconds backed off after FAIL_LIMIT is reached, doubled each failure after that
+    BACKOFF_INITIAL = 10
+    BACKOFF_LIMIT = 300
+    CONNECT_TIMEOUT = 3
+    READ_TIMEOUT = 30
+    FGFS_LOG_LIMIT = 2000
 
     host: str
     info_hash: dict = field(default_factory=dict)
@@ -26,10 +34,19 @@ class RegisteredAgent:
     zeroconf_name: str = None
     custom_settings: CustomAgentSettings = field(default_factory=CustomAgentSettings)
     fail_count: int = 0
+    # time.monotonic() at which a failed agent is given another try
+    retry_at: float = 0
     selected: bool = True
     ai_scenarios: typing.List[str] = field(default_factory=list)
+    carriers: typing.List[str] = field(default_factory=list)
     version: typing.Union[str, None] = None
     directories: AgentDirectorySettings = None
+    # None if the agent doesn't run a TerraSync proxy
+    terrasync_proxy_upstream: typing.Union[str, None] = None
+    fgfs_log: typing.List[str] = field(default_factory=list)
+    fgfs_log_offset: int = 0
+    # kept between requests so that its connections are reused
+    _client: Client = field(default=None, init=False, repr=False, compare=False)
 
     def _update_info_hash(self, key, value):
         current_info_value = self.info_hash.get('info', { key : None })
@@ -48,6 +65,37 @@ class RegisteredAgent:
     def failed(self) -> bool:
         return self.fail_count >= self.FAIL_LIMIT
 
+    @property
+    def backing_off(self) -> bool:
+        ''' True while a failed agent is left alone, after that one request is let through to see if it is back '''
+        return self.failed and time.monotonic() < self.retry_at
+
+    def record_failure(self):
+        self.fail_count += 1
+
+        if self.failed:
+            backoff = min(self.BACKOFF_LIMIT, self.BACKOFF_INITIAL * 2 ** (self.fail_count - self.FAIL_LIMIT))
+            self.retry_at = time.monotonic() + backoff
+            logging.info(f"{self.host} has failed {self.fail_count} times in a row, trying again in {backoff}s")
+
+    def reset_fail_count(self):
+        self.fail_count = 0
+        self.retry_at = 0
+
+    @property
+    def aircraft(self) -> typing.List[typing.Dict[str, typing.Union[str, int, None]]]:
+        ''' Returns the name and svn revision of each aircraft the agent has '''
+        return self.info_hash.get('info', {}).get('aircraft') or []
+
+    @aircraft.setter
+    def aircraft(self, new_aircraft):
+        self._update_info_hash('aircraft', new_aircraft)
+
+    @property
+    def aircraft_revisions(self) -> typing.Dict[str, typing.Union[int, None]]:
+        ''' Returns the svn revision of each aircraft the agent has, None for those that aren't working copies '''
+        return {record['name']: record['revision'] for record in self.aircraft}
+
     @property
     def errors(self) -> typing.List[typing.Dict[str, str]]:
         ''' Returns list of errors '''
@@ -60,7 +108,10 @@ class RegisteredAgent:
         client = self.client()
 
         if client:
-            client.execute(queries.RESCAN_ENVIRONMENT)
+            try:
+                client.execute(queries.RESCAN_ENVIRONMENT)
+            except requests.exceptions.RequestException as e:
+                logging.warning(f"Unable to ask {self.host} to rescan its environment: {e}")
 
     @errors.setter
     def errors(self, new_errors):
@@ -74,6 +125,7 @@ class RegisteredAgent:
         memo = {}
         memo['status'] = self.status
         memo['fail_count'] = self.fail_count
+        memo['retry_at'] = self.retry_at
         memo['online'] = self.online
         memo['uuid'] = self.uuid
         memo['host'] = self.host
@@ -81,9 +133,12 @@ class RegisteredAgent:
         memo['port'] = self.port
         memo['errors'] = self.errors
         memo['os'] = self.os
+        memo['aircraft'] = self.aircraft
         memo['ai_scenarios'] = self.ai_scenarios
+        memo['carriers'] = self.carriers
         memo['version'] = self.version
         memo['directories'] = self.directories
+        memo['terrasync_proxy_upstream'] = self.terrasync_proxy_upstream
         return memo
 
     def apply_update_dict(self, update_dictionary: typing.Dict[str, typing.Union[str, list, None]]):
@@ -91,16 +146,20 @@ class RegisteredAgent:
         logging.debug(f"Applying update dict: {update_dictionary}")
         self.status = update_dictionary['status']
         self.fail_count = update_dictionary['fail_count']
+        self.retry_at = update_dictionary['retry_at']
         self.online = update_dictionary['online']
         self.os = update_dictionary['os']
+        self.aircraft = update_dictionary['aircraft']
         self.uuid = update_dictionary['uuid']
         self.host = update_dictionary['host']
         self.zeroconf_name = update_dictionary['zeroconf_name']
         self.port = update_dictionary['port']
         self.errors = update_dictionary['errors']
         self.ai_scenarios = update_dictionary['ai_scenarios']
+        self.carriers = update_dictionary['carriers']
         self.version = update_dictionary['version']
         self.directories = update_dictionary['directories']
+        self.terrasync_proxy_upstream = update_dictionary['terrasync_proxy_upstream']
         return self
 
     def to_dict(self) -> dict:
@@ -109,11 +168,15 @@ class RegisteredAgent:
         res = self.to_update_dict()
         # remove runtime data
         res.pop('fail_count', None)
+        res.pop('retry_at', None)
         res.pop('status', None)
         res.pop('online', None)
         res.pop('errors', None)
+        res.pop('aircraft', None)
         res.pop('ai_scenarios', None)
+        res.pop('carriers', None)
         res.pop('directories', None)
+        res.pop('terrasync_proxy_upstream', None)
         # add persistable selection/config not part of update packet
         res['hostname'] = self.host
         res['selected'] = self.selected
@@ -132,43 +195,118 @@ class RegisteredAgent:
         res.custom_settings = res.custom_settings.apply_update_dict(dictionary['custom_settings'])
         return res
 
-    def client(self):
+    def client(self) -> typing.Union[Client, None]:
+        '''
+        Returns None while we are backing off from the agent. The client keeps
+        its connections to the agent open between requests, each request
+        times out after (CONNECT_TIMEOUT, READ_TIMEOUT) seconds unless it is
+        executed with a timeout of its own, and whether the agent answers it
+        or not counts towards fail_count.
+        '''
         url = f"http://{self.host}:{self.port}/graphql"
-        headers = {
-            'Accept': 'text/html'
-        }
 
-        if self.fail_count == self.FAIL_LIMIT:
+        if self.backing_off:
             return None
 
-        try:
-            request = requests.get(
-                url,
-                headers=headers
+        if self.failed:
+            # half open, hold everybody else off until this request is answered
+            self.retry_at = time.monotonic() + self.CONNECT_TIMEOUT + self.READ_TIMEOUT
+
+        if self._client is None or self._client.transport.url != url:
+            # host and port change when an agent turns up somewhere else
+            self._client = Client(
+                transport=PersistedQueryTransport(
+                    url=url,
+                    headers={
+                        'Accept': 'text/html'
+                    },
+                    timeout=(self.CONNECT_TIMEOUT, self.READ_TIMEOUT),
+                    on_reachable=self.reset_fail_count,
+                    on_unreachable=self._unreachable
+                )
             )
-            request.raise_for_status()
-        except (ConnectionRefusedError, urllib3.exceptions.MaxRetryError, urllib3.exceptions.NewConnectionError, requests.exceptions.ConnectionError) as e:
-            logging.debug(f"Could not connect to {self.host}:{e}")
-            self.fail_count += 1
-            return None
 
-        return Client(
-            transport=RequestsHTTPTransport(
-                url=url,
-                headers=headers
-            )
-        )
+        return self._client
+
+    def _not_responding_error(self) -> str:
+        retrying_at = datetime.datetime.now() + datetime.timedelta(seconds=max(0, self.retry_at - time.monotonic()))
+        return f"{self.host} is not responding, retrying at {retrying_at:%H:%M:%S}"
 
-    def install_aircraft(self, aircraft) -> typing.Tuple[bool, str]:
-        ''' Instruct this agent to install/update an aircraft'''
+    def _unreachable(self):
+        logging.debug(f"Could not connect to {self.host}")
+        self.record_failure()
+
+    def install_aircraft(self, aircraft, peers: typing.List[str] = None) -> typing.Tuple[bool, str]:
+        ''' Instruct this agent to install/update an aircraft, copying it from peers if they have it '''
         client = self.client()
-        res = client.execute(queries.AircraftInstallQuery(aircraft))
+
+        if client is None:
+            return False, self._not_responding_error()
+
+        try:
+            res = client.execute(queries.AircraftInstallQuery(aircraft, peers=peers))
+        except requests.exceptions.RequestException as e:
+            return False, f"{e}"
 
         return res['installOrUpdateAircraft']['ok'], res['installOrUpdateAircraft']['error']
 
+    def prefetch_aircraft(
+        self,
+        aircraft_names: typing.List[str],
+        peers: typing.List[str] = None,
+        bandwidth_kbps: int = None
+    ) -> typing.Tuple[bool, str]:
+        ''' Instruct this agent to install aircraft during its prefetch window '''
+        client = self.client()
+
+        if client is None:
+            return False, self._not_responding_error()
+
+        try:
+            res = client.execute(queries.PrefetchAircraftQuery(aircraft_names, peers, bandwidth_kbps))
+        except requests.exceptions.RequestException as e:
+            return False, f"{e}"
+
+        return res['prefetchAircraft']['ok'], res['prefetchAircraft']['error']
+
+    def prefetch_scenery(self, tiles: typing.List[str], terrasync_endpoint: str = None) -> typing.Tuple[bool, str]:
+        ''' Instruct this agent to fetch scenery tiles in the background '''
+        client = self.client()
+
+        if client is None:
+            return False, self._not_responding_error()
+
+        try:
+            res = client.execute(queries.PrefetchSceneryQuery(tiles, terrasync_endpoint))
+        except requests.exceptions.RequestException as e:
+            return False, f"{e}"
+
+        return res['prefetchScenery']['ok'], res['prefetchScenery']['error']
+
+    def warm_page_cache(self, aircraft: str = None, tiles: typing.List[str] = None) -> typing.Tuple[bool, str]:
+        ''' Instruct this agent to read an aircraft and scenery tiles into its page cache, if it is set up to '''
+        client = self.client()
+
+        if client is None:
+            return False, self._not_responding_error()
+
+        try:
+            res = client.execute(queries.WarmPageCacheQuery(aircraft, tiles))
+        except requests.exceptions.RequestException as e:
+            return False, f"{e}"
+
+        return res['warmPageCache']['ok'], res['warmPageCache']['error']
+
     def apply_directory_changes(self, updated_directories: AgentDirectorySettings):
         client = self.client()
-        res = client.execute(queries.SetDirectoriesQuery(updated_directories))
+
+        if client is None:
+            return False, self._not_responding_error()
+
+        try:
+            res = client.execute(queries.SetDirectoriesQuery(updated_directories))
+        except requests.exceptions.RequestException as e:
+            return False, f"{e}"
         ok = True
         error_str = ""
 
@@ -197,23 +335,91 @@ class RegisteredAgent:
     def fetch_remote_directory_list(self, remote_path):
         """ Ask this agent for a directory listing """
         client = self.client()
-        res = client.execute(queries.RemoteDirectoryListingQuery(remote_path))
+
+        if client is None:
+            logging.warning(f"Unable to list {remote_path}: {self._not_responding_error()}")
+            return [], []
+
+        try:
+            res = client.execute(queries.RemoteDirectoryListingQuery(remote_path))
+        except requests.exceptions.RequestException as e:
+            logging.warning(f"Unable to list {remote_path} on {self.host}: {e}")
+            return [], []
+
         return res['directoryList']['directories'], res['directoryList']['files']
 
+    def fetch_fgfs_log(self) -> str:
+        ''' Fetches FGFS output this agent has produced since we last asked '''
+        client = self.client()
+
+        if client is None:
+            return '\n'.join(self.fgfs_log)
+
+        while True:
+            try:
+                res = client.execute(queries.FGFS_LOG, variable_values={'sinceOffset': self.fgfs_log_offset})['fgfsLog']
+            except requests.exceptions.RequestException as e:
+                logging.warning(f"Unable to fetch the FGFS log from {self.host}: {e}")
+                break
+
+            if res['offset'] < self.fgfs_log_offset:
+                # the agent restarted and its offsets started over
+                self.fgfs_log.clear()
+            elif res['offset'] > self.fgfs_log_offset and self.fgfs_log:
+                self.fgfs_log.append(f"... {res['offset'] - self.fgfs_log_offset} lines dropped by the agent ...")
+
+            self.fgfs_log.extend(res['lines'])
+            self.fgfs_log_offset = res['nextOffset']
+
+            if not res['lines']:
+                break
+
+        del self.fgfs_log[:-self.FGFS_LOG_LIMIT]
+
+        return '\n'.join(self.fgfs_log)
+
     def start_fgfs(self, scenario_settings: ScenarioSettings) -> typing.Tuple[bool, str]:
         '''Instruct FGFS to start up'''
         client = self.client()
-        res = client.execute(queries.StartFlightGear(
-            self.host,
-            scenario_settings,
-            self.custom_settings,
-        ))
+
+        if client is None:
+            return False, self._not_responding_error()
+
+        try:
+            res = client.execute(queries.StartFlightGear(
+                self.host,
+                scenario_settings,
+                self.custom_settings,
+            ))
+        except requests.exceptions.RequestException as e:
+            return False, f"{e}"
         logging.info(f"start_fgfs hostname {self.host} assembled args {res['startFlightGear']['assembledArgs']}")
         return res['startFlightGear']['ok'], res['startFlightGear']['error']
 
+    def reconfigure_fgfs(self, scenario_settings: ScenarioSettings) -> typing.Tuple[bool, str]:
+        ''' Instruct this agent to move the running FGFS to the scenario's position and time of day '''
+        client = self.client()
+
+        if client is None:
+            return False, self._not_responding_error()
+
+        try:
+            res = client.execute(queries.ReconfigureFlightGear(scenario_settings))
+        except requests.exceptions.RequestException as e:
+            return False, f"{e}"
+        logging.info(f"reconfigure_fgfs hostname {self.host} ran {res['reconfigureFlightGear']['commands']}")
+        return res['reconfigureFlightGear']['ok'], res['reconfigureFlightGear']['error']
+
     def stop_fgfs(self) -> typing.Tuple[bool, str]:
         ''' Instruct this agent to stop FGFS'''
         client = self.client()
-        res = client.execute(queries.STOP_FLIGHTGEAR)
+
+        if client is None:
+            return False, self._not_responding_error()
+
+        try:
+            res = client.execute(queries.STOP_FLIGHTGEAR)
+        except requests.exceptions.RequestException as e:
+            return False, f"{e}"
 
         return res['stopFlightGear']['ok'], res['stopFlightGear']['error']
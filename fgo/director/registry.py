@@ -1,3 +1,4 @@
+import dataclasses
 import logging
 import typing
 
@@ -15,6 +16,8 @@ class Registry(QObject):
         self.signals = RegistrySignals()
         self._agents: typing.List[RegisteredAgent] = []
         self._scenario_settings: ScenarioSettings = None
+        # agents known to have the scenario's aircraft at the newest revision
+        self._aircraft_seeds: typing.List[RegisteredAgent] = []
 
     @property
     def scenario_settings(self) -> ScenarioSettings:
@@ -112,7 +115,7 @@ class Registry(QObject):
         agent = self.find_agent_by_host(host)
 
         if agent:
-            agent.fail_count = 0
+            agent.reset_fail_count()
 
     def rescan_environment(self, host: str):
         '''Asks the specified host to rescan its environment'''
@@ -156,7 +159,7 @@ class Registry(QObject):
 
         if memo:
             memo = memo[0]
-            memo.fail_count = 0
+            memo.reset_fail_count()
             memo.online = True
             memo.host = hostname
             logging.debug(f"found agent matches a known agent")
@@ -269,6 +272,14 @@ class Registry(QObject):
         if target:
             return target.fetch_remote_directory_list(remote_path)
 
+    def get_fgfs_log_for_agent(self, hostname: str) -> str:
+        target = self.find_agent_by_host(hostname)
+
+        if target:
+            return target.fetch_fgfs_log()
+
+        return ""
+
     def apply_directory_changes_to_agent(self, hostname: str, updated_directories: AgentDirectorySettings):
         target = self.find_agent_by_host(hostname)
         return target.apply_directory_changes(updated_directories)
@@ -289,6 +300,14 @@ class Registry(QObject):
         if target:
             return target.ai_scenarios
 
+    def get_carriers_from_host(self, hostname) -> typing.List[str]:
+        target = self.find_agent_by_host(hostname)
+
+        if target:
+            return target.carriers
+
+        return []
+
     def to_dict(self) -> list:
         '''Returns a dictionary containing serialisable agents in dictionary form'''
         return [agent.to_dict() for agent in self._agents]
@@ -299,9 +318,24 @@ class Registry(QObject):
         for agent_hash in agents_list:
             self._agents.append(RegisteredAgent.from_dict(agent_hash))
 
-    def install_aircraft(self) -> typing.Tuple[bool, str]:
+    def choose_aircraft_seeds(self, hostnames: typing.List[str]):
         '''
-        Instruct all selected agents to install aircraft
+        Picks the agents the others copy the scenario's aircraft from when it
+        is installed: those that have the newest revision any of them has,
+        going by the aircraft the agent checker last saw they have
+        '''
+        aircraft = self.scenario_settings.aircraft_directory
+        target_agents = [agent for agent in self.all_agents if agent.host in hostnames]
+        revisions = {agent.host: agent.aircraft_revisions.get(aircraft) for agent in target_agents}
+        logging.debug(f"Registry.choose_aircraft_seeds, {aircraft} revisions: {revisions}")
+        known_revisions = [revision for revision in revisions.values() if revision is not None]
+        self._aircraft_seeds = [
+            agent for agent in target_agents if known_revisions and revisions[agent.host] == max(known_revisions)
+        ]
+
+    def install_aircraft(self, hostnames: typing.List[str] = None) -> typing.Tuple[bool, str]:
+        '''
+        Instruct all selected agents, or just the given ones, to install aircraft
 
         Returns:
             - bool: ok
@@ -309,13 +343,27 @@ class Registry(QObject):
         '''
         scenario_settings = self.scenario_settings
         aircraft = scenario_settings.aircraft_directory
-        all_scenario_selected_hostnames = ([scenario_settings.primary] + scenario_settings.secondaries)
-        logging.debug(f"Registry.install_aircraft, all_scenario_selected_hostnames: f{all_scenario_selected_hostnames}")
-        target_agents = [agent for agent in self.all_agents if agent.host in all_scenario_selected_hostnames]
+
+        if hostnames is None:
+            hostnames = [scenario_settings.primary] + scenario_settings.secondaries
+
+        logging.debug(f"Registry.install_aircraft, hostnames: f{hostnames}")
+        target_agents = [agent for agent in self.all_agents if agent.host in hostnames]
         logging.debug(f"Registry.install_aircraft, target_agents: f{target_agents}")
+        ok = True
+        # agents copy the aircraft from each other over the LAN, if nobody
+        # has it yet the first agent fetches it from svn for the rest. Seeds
+        # bring themselves up to date from svn and are given no peers, they
+        # would wait on each other otherwise
+        seeds = list(self._aircraft_seeds)
+
+        if not seeds and target_agents:
+            seeds = target_agents[:1]
+
         for agent in target_agents:
+            peers = [] if agent in seeds else [f"{seed.host}:{seed.port}" for seed in seeds]
             logging.info(f"***************** Instructing {agent.host} to install {aircraft} *****************")
-            ok, error = agent.install_aircraft(aircraft)
+            ok, error = agent.install_aircraft(aircraft, peers)
 
             if not ok:
                 msg = f"Error installing aircraft on {agent.host}:{error}"
@@ -325,6 +373,114 @@ class Registry(QObject):
 
         return ok, None
 
+    def prefetch_aircraft(
+        self,
+        aircraft_names: typing.List[str],
+        hostnames: typing.List[str],
+        fleet_bandwidth_kbps: int = None,
+        fleet_concurrency: int = 2
+    ) -> typing.Tuple[bool, str]:
+        '''
+        Instruct agents to install aircraft during their prefetch windows
+
+        Only fleet_concurrency agents fetch from svn, sharing
+        fleet_bandwidth_kbps between them, each aircraft is fetched by one of
+        them and the other agents copy it from that one.
+
+        Returns:
+            - bool: ok
+            - str: error message
+        '''
+        target_agents = [agent for agent in self.all_agents if agent.host in hostnames]
+
+        if not target_agents or not aircraft_names:
+            return True, None
+
+        seeds = target_agents[:max(1, fleet_concurrency)]
+        seed_bandwidth_kbps = None
+
+        if fleet_bandwidth_kbps is not None:
+            seed_bandwidth_kbps = max(1, fleet_bandwidth_kbps // len(seeds))
+
+        # aircraft name -> the seed fetching it from svn, spread round robin
+        assignments = {aircraft: seeds[index % len(seeds)] for index, aircraft in enumerate(aircraft_names)}
+
+        for agent in target_agents:
+            own = [aircraft for aircraft, seed in assignments.items() if seed is agent]
+            logging.info(f"Instructing {agent.host} to prefetch {aircraft_names}")
+
+            if own:
+                ok, error = agent.prefetch_aircraft(own, bandwidth_kbps=seed_bandwidth_kbps)
+
+                if not ok:
+                    return ok, f"Error prefetching aircraft on {agent.host}:{error}"
+
+            for aircraft, seed in assignments.items():
+                if seed is agent:
+                    continue
+
+                ok, error = agent.prefetch_aircraft([aircraft], peers=[f"{seed.host}:{seed.port}"])
+
+                if not ok:
+                    return ok, f"Error prefetching aircraft on {agent.host}:{error}"
+
+        return True, None
+
+    def prefetch_scenery(self, tiles: typing.List[str], hostnames: typing.List[str]) -> typing.Tuple[bool, str]:
+        '''
+        Instruct agents to fetch scenery tiles in the background, from the
+        TerraSync endpoint their sessions will use
+
+        Returns:
+            - bool: ok
+            - str: error message
+        '''
+        terrasync_endpoint = self._with_terrasync_proxy(self.scenario_settings).terra_sync_endpoint
+        target_agents = [agent for agent in self.all_agents if agent.host in hostnames]
+        errors = []
+
+        for agent in target_agents:
+            logging.info(f"Instructing {agent.host} to prefetch {len(tiles)} scenery tiles")
+
+            try:
+                ok, error = agent.prefetch_scenery(tiles, terrasync_endpoint)
+            except Exception as e:
+                ok, error = False, f"{e}"
+
+            if not ok:
+                errors.append(f"Error prefetching scenery on {agent.host}:{error}")
+
+        if errors:
+            return False, '\n'.join(errors)
+
+        return True, None
+
+    def warm_page_cache(self, aircraft: str, tiles: typing.List[str], hostnames: typing.List[str]) -> typing.Tuple[bool, str]:
+        '''
+        Instruct agents that are set up to warm their page cache to read the
+        aircraft and scenery tiles into it
+
+        Returns:
+            - bool: ok
+            - str: error message
+        '''
+        target_agents = [agent for agent in self.all_agents if agent.host in hostnames]
+        errors = []
+
+        for agent in target_agents:
+            try:
+                ok, error = agent.warm_page_cache(aircraft, tiles)
+            except Exception as e:
+                ok, error = False, f"{e}"
+
+            if not ok:
+                errors.append(f"Error warming the page cache on {agent.host}:{error}")
+
+        if errors:
+            return False, '\n'.join(errors)
+
+        return True, None
+
     def start_primary(self) -> typing.Tuple[bool, str]:
         '''
         Instruct the primary to start up
@@ -333,7 +489,7 @@ class Registry(QObject):
             - bool: ok
             - str: error message
         '''
-        scenario_settings = self.scenario_settings
+        scenario_settings = self._with_terrasync_proxy(self.scenario_settings)
         primary_hostname = scenario_settings.primary
         target = self.get_agent(primary_hostname)
         logging.info(f"Starting primary {primary_hostname}")
@@ -352,7 +508,7 @@ class Registry(QObject):
             - bool: ok
             - str: error message
         '''
-        scenario_settings = self.scenario_settings
+        scenario_settings = self._with_terrasync_proxy(self.scenario_settings)
         secondary_hostnames = scenario_settings.secondaries
         target_agents = [agent for agent in self._agents if agent.host in secondary_hostnames]
         for agent in target_agents:
@@ -367,6 +523,59 @@ class Registry(QObject):
 
         return ok, None
 
+    def _with_terrasync_proxy(self, scenario_settings: ScenarioSettings) -> ScenarioSettings:
+        '''
+        Points TerraSync at an agent's caching proxy if one fetches from the
+        server the scenario would have used
+        '''
+        wanted = (scenario_settings.terra_sync_endpoint or '').rstrip('/')
+
+        for agent in self.all_agents:
+            if not agent.online:
+                continue
+
+            # from the config the agent checker polls
+            upstream = agent.terrasync_proxy_upstream
+
+            if upstream is not None and (not wanted or upstream.rstrip('/') == wanted):
+                proxy = f"http://{agent.host}:{agent.port}/terrasync"
+                logging.info(f"Using the TerraSync proxy at {proxy} for {upstream}")
+                return dataclasses.replace(scenario_settings, terra_sync_endpoint=proxy)
+
+        return scenario_settings
+
+    def reconfigure_session(self, scenario_settings: ScenarioSettings) -> typing.Tuple[bool, str]:
+        '''
+        Moves the running session to the position and time of day in
+        scenario_settings, the primary first and then the secondaries, and
+        makes scenario_settings the session's settings
+
+        Returns:
+            - bool: ok
+            - str: error message
+        '''
+        scenario_settings = dataclasses.replace(
+            scenario_settings,
+            primary=self.scenario_settings.primary,
+            secondaries=self.scenario_settings.secondaries
+        )
+        hostnames = [scenario_settings.primary] + scenario_settings.secondaries
+
+        for hostname in hostnames:
+            agent = self.find_agent_by_host(hostname)
+
+            if agent is None:
+                continue
+
+            logging.info(f"Instructing {hostname} to reconfigure Flight Gear")
+            ok, error = agent.reconfigure_fgfs(scenario_settings)
+
+            if not ok:
+                return ok, f"Error reconfiguring FlightGear on {hostname}:{error}"
+
+        self.scenario_settings = scenario_settings
+        return True, None
+
     def stop_fgfs(self, target_hostname = None):
         stop_hostname_list = []
 
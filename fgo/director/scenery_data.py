@@ -0,0 +1,60 @@
+import typing
+from pathlib import Path
+
+from PyQt5.QtSql import QSqlDatabase, QSqlQuery
+
+from fgo.util import tile_path
+
+
+def get_runway_positions(nav_db: Path, airport_code: str, runway: str = None) -> typing.List[typing.Tuple[float, float]]:
+    ''' Returns (lat, lon) of the runway, or of every runway and helipad at the airport if runway is None '''
+    positions = []
+    db = QSqlDatabase.addDatabase("QSQLITE")
+    db.setDatabaseName(str(nav_db))
+    assert db.open()
+
+    select_query = QSqlQuery(db)
+    select_query.setForwardOnly(True)
+
+    if runway is None:
+        select_query.prepare('''
+            SELECT lat, lon
+            FROM runways
+            WHERE airport_code = ?
+        ''')
+        select_query.addBindValue(airport_code)
+    else:
+        select_query.prepare('''
+            SELECT lat, lon
+            FROM runways
+            WHERE airport_code = ?
+            AND location = ?
+        ''')
+        select_query.addBindValue(airport_code)
+        select_query.addBindValue(runway)
+
+    select_query.exec_()
+    if select_query.lastError().type() > 0:
+        assert False, select_query.lastError().text()
+
+    while select_query.next():
+        positions.append((float(select_query.value(0)), float(select_query.value(1))))
+
+    db.close()
+
+    return positions
+
+
+def get_scenery_tiles(positions: typing.List[typing.Tuple[float, float]], radius: int) -> typing.List[str]:
+    '''
+    Returns the TerraSync tiles, e.g. e010n50/e013n52, within radius
+    degrees of any of the positions
+    '''
+    tiles = set()
+
+    for lat, lon in positions:
+        for lat_offset in range(-radius, radius + 1):
+            for lon_offset in range(-radius, radius + 1):
+                tiles.add(tile_path(lat + lat_offset, lon + lon_offset))
+
+    return sorted(tiles)
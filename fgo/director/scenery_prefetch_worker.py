@@ -0,0 +1,26 @@
+import logging
+import typing
+
+from PyQt5.QtCore import QRunnable
+
+from fgo.director import signals
+
+
+class SceneryPrefetchWorker(QRunnable):
+    ''' Asks agents to prefetch scenery tiles, one request per agent, away from the UI thread '''
+
+    def __init__(self, registry, tiles: typing.List[str], hostnames: typing.List[str]):
+        super(SceneryPrefetchWorker, self).__init__()
+        self.registry = registry
+        self.tiles = tiles
+        self.hostnames = hostnames
+        self.signals = signals.SceneryPrefetchSignals()
+
+    def run(self):
+        logging.info(f"Asking {self.hostnames} to prefetch {len(self.tiles)} scenery tiles")
+        ok, error = self.registry.prefetch_scenery(self.tiles, self.hostnames)
+
+        self.signals.scenery_prefetch_requested.emit(
+            ok,
+            error or ''
+        )
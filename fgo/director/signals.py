@@ -51,6 +51,20 @@ class AgentCheckerSignals(QObject):
     )
 
 
+class AgentEventStreamSignals(QObject):
+    agent_event_received = pyqtSignal(
+        str, dict,
+        name='agentEventReceived',
+        arguments=['Hostname or IP Address', 'INFO query result']
+    )
+
+    agent_event_stream_closed = pyqtSignal(
+        str,
+        name='agentEventStreamClosed',
+        arguments=['Hostname or IP Address']
+    )
+
+
 class RegistrySignals(QObject):
     registry_updated = pyqtSignal(
         name='registryUpdated'
@@ -91,6 +105,12 @@ class MainUISignals(QObject):
                    'Dictionary of updated custom settings']
     )
 
+    wait_list_changed = pyqtSignal(
+        list,
+        name='waitListChanged',
+        arguments=['Hostnames the launch sequence is waiting on']
+    )
+
 
 class ZeroConfSignals(QObject):
     zeroconf_agent_found = pyqtSignal(
@@ -124,3 +144,11 @@ class ParkingCacheUpdaterSignals(QObject):
         name='parkingCacheReady',
         arguments=['airport code', 'records']
     )
+
+
+class SceneryPrefetchSignals(QObject):
+    scenery_prefetch_requested = pyqtSignal(
+        bool, str,
+        name='sceneryPrefetchRequested',
+        arguments=['ok', 'error message']
+    )
@@ -8,29 +8,190 @@ from . import types
 class InstallOrUpdateAircraft(graphene.Mutation):
     class Arguments:
         svn_name = graphene.String()
+        svn_names = graphene.List(graphene.String)
+        force = graphene.Boolean(default_value=False, description="Run svn update even if the aircraft hasn't changed upstream")
+        peers = graphene.List(graphene.String, description="host:port of agents to copy the aircraft from before using svn")
 
     ok = graphene.Boolean()
     error = graphene.String()
+    job_ids = graphene.List(graphene.ID)
 
-    def mutate(self, ctx, svn_name):
-        ok = True
-        error = None
-        #
-        # if app is in state ready, change state to aircraft install requested
-        # change state_meta to be the svn_name
-        #
-        app_context = ctx.context
+    def mutate(self, ctx, svn_name=None, svn_names=None, force=False, peers=None):
+        ok, error, job_ids = _queue_install_jobs(
+            ctx.context,
+            list(filter(None, [svn_name] + (svn_names or []))),
+            lambda install_queue, name, svn_base_url: install_queue.submit(name, svn_base_url, force, peers)
+        )
+
+        return InstallOrUpdateAircraft(ok=ok, error=error, job_ids=job_ids)
+
+
+class RestoreAircraft(graphene.Mutation):
+    ''' Puts back a revision kept in the aircraft store, without going near svn '''
+    class Arguments:
+        svn_name = graphene.String(required=True)
+        revision = graphene.Int(description="Defaults to the newest revision in the store")
+
+    ok = graphene.Boolean()
+    error = graphene.String()
+    job_ids = graphene.List(graphene.ID)
+
+    def mutate(self, ctx, svn_name, revision=None):
+        ok, error, job_ids = _queue_install_jobs(
+            ctx.context,
+            [svn_name],
+            lambda install_queue, name, svn_base_url: install_queue.submit(
+                name, svn_base_url, restore=True, restore_revision=revision)
+        )
+
+        return RestoreAircraft(ok=ok, error=error, job_ids=job_ids)
+
+
+def _queue_install_jobs(app_context, requested, submit):
+    '''
+    Queues a job for each aircraft with submit(install_queue, svn_name,
+    svn_base_url), if the agent is otherwise idle changes state to
+    installing aircraft until the queue has drained
+    '''
+    ok = True
+    error = None
+    job_ids = []
+    queued = False
+
+    with app_context['context_lock']:
         current_status = app_context['info'].status
-        if current_status != types.Status.READY:
+        svn_base_url = app_context.get('aircraft_svn_base_url')
+
+        if current_status in [
+            types.Status.SCANNING,
+            types.Status.ERROR,
+            # FGFS is about to load an aircraft we can't tell yet
+            types.Status.FGFS_START_REQUESTED
+        ] or svn_base_url is None:
             ok = False
             error = f"Unable to install/update aircraft, current state is {current_status}"
+        elif len(requested) == 0:
+            ok = False
+            error = "No aircraft specified"
+        else:
+            # svn and restores replace files under FGFS's feet
+            in_use = sorted(set(requested) & app_context['disk_budget'].session_aircraft())
+
+            if in_use:
+                ok = False
+                error = f"Unable to install/update {', '.join(in_use)} while FlightGear is using it"
 
         if ok:
-            with app_context['context_lock']:
-                app_context['info'].status = types.Status.INSTALLING_AIRCRAFT
-                app_context['state_meta'] = svn_name
+            queued = True
+            install_queue = app_context['install_queue']
+
+            if current_status == types.Status.READY:
+                # forget failures of jobs that finished while FGFS was running
+                install_queue.take_failures()
+                app_context['info'] = app_context['info'].evolve(
+                    status=types.Status.INSTALLING_AIRCRAFT)
+
+            errors = []
+
+            for name in requested:
+                try:
+                    job_ids.append(submit(install_queue, name, svn_base_url).id)
+                except ValueError as e:
+                    errors.append(f"{e}")
+
+            if errors:
+                ok = False
+                error = '\n'.join(errors)
+
+    if queued:
+        app_context['wake_supervisor']()
+
+    return ok, error, job_ids
+
+
+class EnforceDiskBudget(graphene.Mutation):
+    ''' Removes least recently used aircraft and scenery tiles until they are within budget '''
+    ok = graphene.Boolean()
+    evicted = graphene.List(types.DiskUsageEntry)
+    freed_bytes = graphene.Float()
+
+    def mutate(self, ctx):
+        evicted = ctx.context['disk_budget'].enforce()
+
+        return EnforceDiskBudget(
+            ok=True,
+            evicted=[record.to_gql() for record in evicted],
+            freed_bytes=sum(record.bytes for record in evicted)
+        )
+
+
+class WarmPageCache(graphene.Mutation):
+    ''' Reads an aircraft and scenery tiles into the OS page cache, if the agent is set up to '''
+    class Arguments:
+        aircraft = graphene.String(description="Aircraft directory")
+        tiles = graphene.List(graphene.String, description="e.g. e010n50/e013n52")
+
+    ok = graphene.Boolean()
+    error = graphene.String()
+    job = graphene.Field(types.PageCacheWarmup, description="None when warm_page_cache is off")
+
+    def mutate(self, ctx, aircraft=None, tiles=None):
+        page_cache_warmer = ctx.context['page_cache_warmer']
+
+        if not page_cache_warmer.enabled:
+            return WarmPageCache(ok=True)
+
+        try:
+            job = page_cache_warmer.submit(aircraft, tiles)
+        except ValueError as e:
+            return WarmPageCache(ok=False, error=f"{e}")
+
+        return WarmPageCache(ok=True, job=job.to_gql())
+
+
+class PrefetchAircraft(graphene.Mutation):
+    ''' Installs aircraft in the background during the agent's prefetch window '''
+    class Arguments:
+        svn_names = graphene.List(graphene.String, required=True)
+        peers = graphene.List(graphene.String, description="host:port of agents to copy the aircraft from before using svn")
+        bandwidth_kbps = graphene.Int(description="Replaces the agent's prefetch bandwidth limit")
+
+    ok = graphene.Boolean()
+    error = graphene.String()
+    requests = graphene.List(types.PrefetchRequest)
+
+    def mutate(self, ctx, svn_names, peers=None, bandwidth_kbps=None):
+        if len(svn_names) == 0:
+            return PrefetchAircraft(ok=False, error="No aircraft specified", requests=[])
+
+        requests = ctx.context['prefetcher'].request(svn_names, peers, bandwidth_kbps)
 
-        return InstallOrUpdateAircraft(ok=ok, error=error)
+        return PrefetchAircraft(ok=True, requests=[request.to_gql() for request in requests])
+
+
+class PrefetchScenery(graphene.Mutation):
+    ''' Fetches scenery tiles into terrasync_path in the background '''
+    class Arguments:
+        tiles = graphene.List(graphene.String, required=True, description="e.g. e010n50/e013n52")
+        terrasync_endpoint = graphene.String(description="Defaults to the agent's TerraSync upstream")
+
+    ok = graphene.Boolean()
+    error = graphene.String()
+    job = graphene.Field(types.SceneryJob)
+
+    def mutate(self, ctx, tiles, terrasync_endpoint=None):
+        if len(tiles) == 0:
+            return PrefetchScenery(ok=False, error="No tiles specified")
+
+        if ctx.context['config'].terrasync_path is None:
+            return PrefetchScenery(ok=False, error="terrasync_path is not set")
+
+        try:
+            job = ctx.context['scenery_prefetcher'].submit(tiles, terrasync_endpoint)
+        except ValueError as e:
+            return PrefetchScenery(ok=False, error=f"{e}")
+
+        return PrefetchScenery(ok=True, job=job.to_gql())
 
 
 class RescanEnvironment(graphene.Mutation):
@@ -39,10 +200,12 @@ class RescanEnvironment(graphene.Mutation):
     def mutate(self, ctx):
         app_context = ctx.context
 
-        if app_context['info'].status != types.Status.SCANNING:
-            with app_context['context_lock']:
-                app_context['info'].status = types.Status.SCANNING
-                app_context['info'].errors = None
+        with app_context['context_lock']:
+            if app_context['info'].status != types.Status.SCANNING:
+                app_context['info'] = app_context['info'].evolve(
+                    status=types.Status.SCANNING, errors=None)
+
+        app_context['wake_supervisor']()
 
         return RescanEnvironment(ok=True)
 
@@ -77,8 +240,10 @@ class SetConfig(graphene.Mutation):
 
                 setattr(config, key, value)
                 config.save()
-                app_context['info'].status = types.Status.SCANNING
-                app_context['info'].errors = None
+                app_context['info'] = app_context['info'].evolve(
+                    status=types.Status.SCANNING, errors=None)
+
+            app_context['wake_supervisor']()
 
         return SetConfig(ok=ok, error=error)
 
@@ -97,32 +262,78 @@ class StartFlightGear(graphene.Mutation):
         error = None
 
         app_context = ctx.context
-        current_status = app_context['info'].status
 
-        if current_status != types.Status.READY:
-            ok = False
-            error = f"Unable to start FlightGear, current state is {current_status}"
+        with app_context['context_lock']:
+            current_status = app_context['info'].status
 
-        if ok:
-            assembled_args = session_args.assemble_args()
-            app_context['info'].status = types.Status.FGFS_START_REQUESTED
-            app_context['state_meta'] = assembled_args
+            if current_status != types.Status.READY:
+                ok = False
+                error = f"Unable to start FlightGear, current state is {current_status}"
 
-            with app_context['context_lock']:
+            if ok:
+                assembled_args = session_args.assemble_args()
                 config = app_context['config']
                 # see if we need to add in a --fg-aircraft arg
                 if config.aircraft_path is not None:
                     aircraft_path = str(config.aircraft_path)
-                    app_context['state_meta'].append(f"--fg-aircraft={aircraft_path}")
+                    assembled_args.append(f"--fg-aircraft={aircraft_path}")
 
                 # see if we need to add in a --terrasync-dir arg
                 if '--enable-terrasync' in assembled_args and config.terrasync_path is not None:
                     terrasync_path = str(config.terrasync_path)
-                    app_context['state_meta'].append(f"--terrasync-dir={terrasync_path}")
+                    assembled_args.append(f"--terrasync-dir={terrasync_path}")
+
+                app_context['info'] = app_context['info'].evolve(
+                    status=types.Status.FGFS_START_REQUESTED)
+                app_context['state_meta'] = assembled_args
+
+        if ok:
+            app_context['wake_supervisor']()
 
         return StartFlightGear(assembled_args=assembled_args, ok=ok, error=error)
 
 
+class ReconfigureFlightGear(graphene.Mutation):
+    ''' Moves the aircraft or changes the time of day without restarting FGFS '''
+    class Arguments:
+        settings = types.FlightGearReconfigureInput(required=True)
+
+    ok = graphene.Boolean()
+    error = graphene.String()
+    commands = graphene.List(graphene.String, description="fgcommands that were run")
+
+    def mutate(self, ctx, settings: types.FlightGearReconfigureInput):
+        app_context = ctx.context
+
+        with app_context['context_lock']:
+            current_status = app_context['info'].status
+            fgfs_probe = app_context['fgfs_probe']
+            fg_process = app_context['fg_process']
+
+        if current_status != types.Status.FGFS_RUNNING:
+            return ReconfigureFlightGear(ok=False, error=f"Unable to reconfigure FlightGear, current state is {current_status}")
+
+        if fgfs_probe is None or not fgfs_probe.available:
+            return ReconfigureFlightGear(ok=False, error="FlightGear is running without its httpd or telnet server")
+
+        # secondaries fly wherever the primary's FDM puts them
+        reposition = fg_process is None or '--fdm=null' not in fg_process.args
+        commands = []
+
+        if reposition:
+            for path, value in settings.assemble_properties():
+                if not fgfs_probe.set(path, value):
+                    return ReconfigureFlightGear(ok=False, error=f"Unable to set {path}", commands=commands)
+
+        for command, args in settings.assemble_commands(reposition):
+            if not fgfs_probe.run(command, args):
+                return ReconfigureFlightGear(ok=False, error=f"Unable to run {command}", commands=commands)
+
+            commands.append(command)
+
+        return ReconfigureFlightGear(ok=True, commands=commands)
+
+
 class StopFlightGear(graphene.Mutation):
     ok = graphene.Boolean()
     error = graphene.String()
@@ -132,14 +343,20 @@ class StopFlightGear(graphene.Mutation):
         error = None
 
         app_context = ctx.context
-        current_status = app_context['info'].status
 
-        if current_status != types.Status.FGFS_RUNNING:
-            ok = False
-            error = f"Unable to stop FlightGear, current state is {current_status}"
+        with app_context['context_lock']:
+            current_status = app_context['info'].status
+
+            if current_status != types.Status.FGFS_RUNNING:
+                ok = False
+                error = f"Unable to stop FlightGear, current state is {current_status}"
+
+            if ok:
+                app_context['info'] = app_context['info'].evolve(
+                    status=types.Status.FGFS_STOP_REQUESTED)
+                app_context['state_meta'] = None
 
         if ok:
-            app_context['info'].status = types.Status.FGFS_STOP_REQUESTED
-            app_context['state_meta'] = None
+            app_context['wake_supervisor']()
 
         return StopFlightGear(ok=ok, error=error)
@@ -0,0 +1,119 @@
+from collections import OrderedDict
+from functools import partial
+import threading
+import hashlib
+import typing
+
+from flask import request
+from flask_graphql import GraphQLView
+from graphql import parse, validate
+from graphql.backend.base import GraphQLBackend, GraphQLDocument
+from graphql.execution import execute, ExecutionResult
+from graphql_server import HttpQueryError, load_json_variables
+
+
+PERSISTED_QUERY_NOT_FOUND = 'PersistedQueryNotFound'
+
+
+def query_hash(query: str) -> str:
+    return hashlib.sha256(query.encode('utf-8')).hexdigest()
+
+
+class PersistedQueryBackend(GraphQLBackend):
+    '''
+    Parses and validates each distinct document once and keeps the result
+    keyed by the sha256 of its text, so repeat queries go straight to
+    execution and clients can send just the hash.
+    '''
+    # directors only send a handful of documents, this bounds what graphiql
+    # or a dashboard sending ad hoc queries can make us hold on to
+    MAX_DOCUMENTS = 256
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._documents: typing.Dict[str, GraphQLDocument] = OrderedDict()
+
+    def document_from_string(self, schema, document_string):
+        key = query_hash(document_string)
+
+        with self._lock:
+            document = self._documents.get(key)
+
+            if document is not None:
+                self._documents.move_to_end(key)
+                return document
+
+        document_ast = parse(document_string)
+        validation_errors = validate(schema, document_ast)
+
+        if validation_errors:
+            # not kept, so that a schema change never serves a stale error
+            return GraphQLDocument(
+                schema=schema,
+                document_string=document_string,
+                document_ast=document_ast,
+                execute=lambda *args, **kwargs: ExecutionResult(errors=validation_errors, invalid=True)
+            )
+
+        document = GraphQLDocument(
+            schema=schema,
+            document_string=document_string,
+            document_ast=document_ast,
+            execute=partial(execute, schema, document_ast)
+        )
+
+        with self._lock:
+            self._documents[key] = document
+
+            while len(self._documents) > self.MAX_DOCUMENTS:
+                self._documents.popitem(last=False)
+
+        return document
+
+    def lookup(self, sha256_hash: str) -> typing.Union[str, None]:
+        ''' Returns the text of a document we have already seen '''
+        with self._lock:
+            document = self._documents.get(sha256_hash)
+
+        if document is None:
+            return None
+
+        return document.document_string
+
+
+class PersistedQueryView(GraphQLView):
+    '''
+    GraphQLView that understands the automatic persisted query protocol, see
+    https://github.com/apollographql/apollo-link-persisted-queries#protocol
+
+    A request carrying extensions.persistedQuery.sha256Hash and no query is
+    answered from the backend, or with a PersistedQueryNotFound error which
+    tells the client to send the hash along with the full query.
+    '''
+    def parse_body(self):
+        data = super(PersistedQueryView, self).parse_body()
+
+        if not isinstance(data, dict):
+            return data
+
+        extensions = load_json_variables(data.get('extensions') or request.args.get('extensions'))
+        persisted_query = (extensions or {}).get('persistedQuery')
+
+        if not persisted_query:
+            return data
+
+        sha256_hash = persisted_query.get('sha256Hash')
+        query = data.get('query') or request.args.get('query')
+
+        if query:
+            if query_hash(query) != sha256_hash:
+                raise HttpQueryError(400, 'provided sha does not match query')
+
+            return data
+
+        query = self.backend.lookup(sha256_hash)
+
+        if query is None:
+            raise HttpQueryError(200, PERSISTED_QUERY_NOT_FOUND)
+
+        return {**data, 'query': query}
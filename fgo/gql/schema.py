@@ -1,6 +1,8 @@
 from pathlib import Path
 import platform
+import hashlib
 import string
+import json
 import time
 
 import graphene
@@ -18,38 +20,170 @@ def get_windows_drives():
 
     return drives
 
+def get_etag(value) -> str:
+    ''' Hashes what a resolver returned, ignoring ids and timestamps which change on their own '''
+    def plain(value):
+        if isinstance(value, graphene.ObjectType):
+            return {
+                key: plain(getattr(value, key, None))
+                for key in value._meta.fields.keys() if key not in ['id', 'timestamp']
+            }
+
+        if isinstance(value, (list, tuple)):
+            return [plain(item) for item in value]
+
+        return value
+
+    return hashlib.md5(json.dumps(plain(value), sort_keys=True, default=str).encode()).hexdigest()
+
 class Mutations(graphene.ObjectType):
     install_or_update_aircraft = mutations.InstallOrUpdateAircraft.Field()
+    enforce_disk_budget = mutations.EnforceDiskBudget.Field()
+    prefetch_aircraft = mutations.PrefetchAircraft.Field()
+    prefetch_scenery = mutations.PrefetchScenery.Field()
+    reconfigure_flight_gear = mutations.ReconfigureFlightGear.Field()
     rescan_environment = mutations.RescanEnvironment.Field()
+    restore_aircraft = mutations.RestoreAircraft.Field()
     set_config = mutations.SetConfig.Field()
     start_flight_gear = mutations.StartFlightGear.Field()
     stop_flight_gear = mutations.StopFlightGear.Field()
+    warm_page_cache = mutations.WarmPageCache.Field()
 
 class Query(graphene.ObjectType):
     ai_scenarios = graphene.List(types.AIScenario)
+    aircraft_snapshots = graphene.List(types.AircraftSnapshot, svn_name=graphene.String())
     config = graphene.List(types.ConfigEntry)
     directory_list = graphene.Field(types.DirectoryList, base_path=graphene.String(default_value="/"))
+    disk_usage = graphene.List(
+        types.DiskUsage,
+        limit=graphene.Int(default_value=50, description="Number of entries to list for each kind")
+    )
+    fgfs_log = graphene.Field(
+        types.FgfsLog,
+        since_offset=graphene.Int(default_value=0),
+        limit=graphene.Int(default_value=500)
+    )
     info = graphene.Field(types.Info)
+    install_jobs = graphene.List(types.InstallJob)
+    metrics = graphene.List(
+        types.MetricSeries,
+        window=graphene.Int(default_value=60, description="Number of seconds to aggregate over")
+    )
+    page_cache_warmups = graphene.List(types.PageCacheWarmup)
+    prefetch_requests = graphene.List(types.PrefetchRequest)
+    scenery_jobs = graphene.List(types.SceneryJob)
+    status_report = graphene.Field(
+        types.StatusReport,
+        info_etag=graphene.String(),
+        config_etag=graphene.String(),
+        ai_scenarios_etag=graphene.String(),
+        version_etag=graphene.String(),
+        description="Pass the etags of the sections you already have, those that are unchanged are left out"
+    )
+    terrasync_proxy = graphene.Field(types.TerraSyncProxy)
     version = graphene.Field(types.Version)
 
     def resolve_ai_scenarios(self, ctx):
-        config = ctx.context['config']
-        fgroot_path = config.fgroot_path
-        scenarios = []
+        return [
+            types.AIScenario(
+                name=scenario.name,
+                description=scenario.description,
+                carriers=scenario.carriers,
+                ships=scenario.ships
+            )
+            for scenario in ctx.context['ai_scenario_index'].scenarios()
+        ]
+
+    def resolve_aircraft_snapshots(self, ctx, svn_name=None):
+        return [
+            types.AircraftSnapshot(
+                svn_name=snapshot.svn_name,
+                revision=snapshot.revision,
+                created_at=snapshot.created_at,
+                files=snapshot.files,
+                bytes=snapshot.bytes
+            )
+            for snapshot in ctx.context['aircraft_store'].snapshots(svn_name)
+        ]
+
+    def resolve_disk_usage(self, ctx, limit):
+        disk_budget = ctx.context['disk_budget']
+        records = disk_budget.usage()
+        res = []
 
-        if fgroot_path:
-            for scenario_path in fgroot_path.glob(f"{Path('AI', '*.xml')}"):
-                scenarios.append(
-                    types.AIScenario(
-                        name=scenario_path.stem
-                    )
-                )
+        for kind in disk_budget.KINDS:
+            kind_records = [record for record in records if record.kind == kind]
+            budget = disk_budget.budget(kind)
+            res.append(types.DiskUsage(
+                kind=kind,
+                bytes=sum(record.bytes for record in kind_records),
+                files=sum(record.files for record in kind_records),
+                budget_bytes=budget,
+                entries=[record.to_gql() for record in kind_records[:limit]]
+            ))
 
-        return scenarios
+        return res
 
     def resolve_info(self, ctx):
         return ctx.context['info']
 
+    def resolve_fgfs_log(self, ctx, since_offset, limit):
+        offset, lines, next_offset = ctx.context['fgfs_log'].read(since_offset, limit)
+        return types.FgfsLog(offset=offset, lines=lines, next_offset=next_offset)
+
+    def resolve_install_jobs(self, ctx):
+        return [job.to_gql() for job in ctx.context['install_queue'].jobs()]
+
+    def resolve_metrics(self, ctx, window):
+        res = []
+
+        for name, (min_, avg, max_, last, samples) in ctx.context['metrics_sampler'].aggregate(window).items():
+            res.append(types.MetricSeries(
+                name=name,
+                min=min_,
+                avg=avg,
+                max=max_,
+                last=last,
+                samples=samples
+            ))
+
+        return res
+
+    def resolve_page_cache_warmups(self, ctx):
+        return [job.to_gql() for job in ctx.context['page_cache_warmer'].jobs()]
+
+    def resolve_prefetch_requests(self, ctx):
+        return [request.to_gql() for request in ctx.context['prefetcher'].requests()]
+
+    def resolve_scenery_jobs(self, ctx):
+        return [job.to_gql() for job in ctx.context['scenery_prefetcher'].jobs()]
+
+    def resolve_status_report(self, ctx, info_etag=None, config_etag=None, ai_scenarios_etag=None, version_etag=None):
+        res = types.StatusReport()
+
+        for name, value, known_etag in [
+            ('info', Query.resolve_info(self, ctx), info_etag),
+            ('config', Query.resolve_config(self, ctx), config_etag),
+            ('ai_scenarios', Query.resolve_ai_scenarios(self, ctx), ai_scenarios_etag),
+            ('version', Query.resolve_version(self, ctx), version_etag),
+        ]:
+            etag = get_etag(value)
+            setattr(res, f"{name}_etag", etag)
+            setattr(res, name, None if etag == known_etag else value)
+
+        return res
+
+    def resolve_terrasync_proxy(self, ctx):
+        proxy = ctx.context['terrasync_proxy']
+
+        return types.TerraSyncProxy(
+            enabled=proxy.enabled,
+            upstream=proxy.upstream,
+            hits=proxy.hits,
+            misses=proxy.misses,
+            upstream_bytes=proxy.upstream_bytes
+        )
+
     def resolve_directory_list(self, ctx, base_path):
         if base_path == "/" and platform.system() == 'Windows':
             dirs = get_windows_drives()
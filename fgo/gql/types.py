@@ -1,4 +1,6 @@
 import platform
+import typing
+import time
 import logging
 import hashlib
 
@@ -23,6 +25,14 @@ class ErrorCode(graphene.Enum):
     SVN_NOT_INSTALLED = 15
     PROTOCOL_FILE_MISSING = 16
     PROTOCOL_FILE_HASH_MISMATCH = 17
+    AIRCRAFT_NOT_IN_STORE = 18
+
+
+class JobState(graphene.Enum):
+    QUEUED = 0
+    RUNNING = 1
+    DONE = 2
+    FAILED = 3
 
 
 class OS(graphene.Enum):
@@ -72,11 +82,28 @@ class Aircraft(graphene.ObjectType):
     id = graphene.ID()
     name = graphene.String()
     version = graphene.String()
+    variants = graphene.List(graphene.String)
+    revision = graphene.Int(description="svn revision of the working copy, if it is one")
+
+    def resolve_id(self, info):
+        return hashlib.md5(f"{self.name}_{self.revision}".encode()).hexdigest()
+
+
+class AircraftSnapshot(graphene.ObjectType):
+    ''' A revision of an aircraft kept in the agent's aircraft store '''
+    svn_name = graphene.String()
+    revision = graphene.Int()
+    created_at = graphene.DateTime()
+    files = graphene.Int()
+    bytes = graphene.Float()
 
 
 class AIScenario(graphene.ObjectType):
     id = graphene.ID()
     name = graphene.String()
+    description = graphene.String()
+    carriers = graphene.List(graphene.String, description="Names that can be passed to --carrier")
+    ships = graphene.List(graphene.String)
 
     def resolve_id(self, info):
         return hashlib.md5(f"{self.name}".encode()).hexdigest()
@@ -101,6 +128,23 @@ class DirectoryList(graphene.ObjectType):
         return hashlib.md5(f"{self.base_path}".encode()).hexdigest()
 
 
+class DiskUsageEntry(graphene.ObjectType):
+    ''' An aircraft, or a 1x1 degree scenery tile such as Terrain/e010n50/e013n52 '''
+    path = graphene.String()
+    bytes = graphene.Float()
+    files = graphene.Int()
+    last_used = graphene.DateTime()
+    protected = graphene.Boolean(description="In use by the running session or being installed, never removed")
+
+
+class DiskUsage(graphene.ObjectType):
+    kind = graphene.String(description="aircraft or terrasync")
+    bytes = graphene.Float()
+    files = graphene.Int()
+    budget_bytes = graphene.Float()
+    entries = graphene.List(DiskUsageEntry, description="Least recently used first")
+
+
 class Error(graphene.ObjectType):
     id = graphene.ID()
     code = graphene.Field(ErrorCode)
@@ -110,6 +154,12 @@ class Error(graphene.ObjectType):
         return hashlib.md5(f"{self.code}".encode()).hexdigest()
 
 
+class FgfsLog(graphene.ObjectType):
+    offset = graphene.Int(description="Offset of the first line returned")
+    lines = graphene.List(graphene.String)
+    next_offset = graphene.Int(description="Pass as sinceOffset to get the lines that follow")
+
+
 class Info(graphene.ObjectType):
     id = graphene.ID()
     os = graphene.Field(OS)
@@ -123,6 +173,105 @@ class Info(graphene.ObjectType):
     def resolve_id(self, info):
         return hashlib.md5(f"{self.status}_{self.timestamp}".encode()).hexdigest()
 
+    def evolve(self, **kwargs):
+        '''
+        Returns a new Info with the given fields replaced
+
+        Published Info objects are never modified in place so that resolvers
+        can read them without taking the context lock.
+        '''
+        memo = {key: getattr(self, key) for key in self._meta.fields.keys() if key != 'id'}
+        memo['timestamp'] = int(time.time())
+        return Info(**{**memo, **kwargs})
+
+
+class InstallJob(graphene.ObjectType):
+    id = graphene.ID()
+    svn_name = graphene.String()
+    state = graphene.Field(JobState)
+    files = graphene.Int(description="Number of files checked out or updated so far")
+    bytes = graphene.Float(description="Size of the files checked out or updated so far")
+    revision = graphene.Int()
+    up_to_date = graphene.Boolean(description="The working copy was already at the latest revision, no update was run")
+    copied_from_peer = graphene.Boolean()
+    restored_from_store = graphene.Boolean()
+    background = graphene.Boolean(description="Prefetched ahead of time, the agent doesn't wait for it")
+    error = graphene.Field(Error)
+    queued_at = graphene.DateTime()
+    started_at = graphene.DateTime()
+    finished_at = graphene.DateTime()
+
+
+class MetricSeries(graphene.ObjectType):
+    name = graphene.String()
+    min = graphene.Float()
+    avg = graphene.Float()
+    max = graphene.Float()
+    last = graphene.Float()
+    samples = graphene.Int()
+
+
+class PageCacheWarmup(graphene.ObjectType):
+    ''' An aircraft and scenery tiles read into the OS page cache ahead of a session '''
+    id = graphene.ID()
+    aircraft = graphene.String()
+    tiles = graphene.List(graphene.String, description="e.g. e010n50/e013n52")
+    state = graphene.Field(JobState)
+    files = graphene.Int()
+    bytes = graphene.Float(description="Size of the files warmed so far")
+    error = graphene.String()
+    queued_at = graphene.DateTime()
+    started_at = graphene.DateTime()
+    finished_at = graphene.DateTime()
+
+
+class PrefetchRequest(graphene.ObjectType):
+    ''' An aircraft to install during the agent's prefetch window '''
+    svn_name = graphene.String()
+    peers = graphene.List(graphene.String)
+    requested_at = graphene.DateTime()
+    job_id = graphene.ID(description="Set once the install job has been queued")
+
+
+class SceneryJob(graphene.ObjectType):
+    ''' Scenery tiles fetched into terrasync_path ahead of a session '''
+    id = graphene.ID()
+    tiles = graphene.List(graphene.String, description="e.g. e010n50/e013n52")
+    terrasync_endpoint = graphene.String()
+    state = graphene.Field(JobState)
+    directories = graphene.Int(description="Directories that were out of date")
+    files = graphene.Int(description="Files downloaded so far")
+    bytes = graphene.Float(description="Size of the files downloaded so far")
+    error = graphene.String()
+    queued_at = graphene.DateTime()
+    started_at = graphene.DateTime()
+    finished_at = graphene.DateTime()
+
+
+class StatusReport(graphene.ObjectType):
+    '''
+    Everything the director keeps about an agent in one answer. Each section
+    comes with an etag, a section whose etag matches the one the director
+    sent back is left out.
+    '''
+    info = graphene.Field(Info)
+    info_etag = graphene.String()
+    config = graphene.List(ConfigEntry)
+    config_etag = graphene.String()
+    ai_scenarios = graphene.List(AIScenario)
+    ai_scenarios_etag = graphene.String()
+    version = graphene.Field(lambda: Version)
+    version_etag = graphene.String()
+
+
+class TerraSyncProxy(graphene.ObjectType):
+    ''' The agent's TerraSync cache, served at /terrasync when enabled '''
+    enabled = graphene.Boolean()
+    upstream = graphene.String()
+    hits = graphene.Int()
+    misses = graphene.Int()
+    upstream_bytes = graphene.Float()
+
 
 class FlightGearStartInput(graphene.InputObjectType):
     # common to all
@@ -360,6 +509,57 @@ class FlightGearStartInput(graphene.InputObjectType):
         return res
 
 
+class FlightGearReconfigureInput(graphene.InputObjectType):
+    ''' Changes applied to a running FGFS without restarting it '''
+    carrier = graphene.String(description="Move the aircraft to an aircraft carrier")
+    airport_code = graphene.String(description="Move the aircraft to an airport")
+    runway = graphene.String()
+    parkpos = graphene.String(description="A gate at the airport (e.g. 747d11)")
+    time_of_day = graphene.Field(TimeOfDay)
+
+    @property
+    def repositions(self) -> bool:
+        return any(getattr(self, key, None) for key in ['carrier', 'airport_code', 'runway', 'parkpos'])
+
+    def assemble_properties(self) -> typing.List[typing.Tuple[str, typing.Any]]:
+        '''
+        Returns the /sim/presets properties to set before running
+        reposition, the same ones FlightGear's own location dialogs set
+
+        See http://wiki.flightgear.org/Command_line_options#Initial_Position_and_Orientation
+        '''
+        if not self.repositions:
+            return []
+
+        return [
+            ('/sim/presets/carrier', self.carrier or ''),
+            ('/sim/presets/airport-id', '' if self.carrier else self.airport_code or ''),
+            ('/sim/presets/runway', self.runway or ''),
+            ('/sim/presets/runway-requested', bool(self.runway)),
+            ('/sim/presets/parkpos', self.parkpos or ''),
+            ('/sim/presets/on-ground', True),
+            # -9999 leaves them to be worked out from the airport or carrier
+            ('/sim/presets/latitude-deg', -9999),
+            ('/sim/presets/longitude-deg', -9999),
+            ('/sim/presets/altitude-ft', -9999),
+            ('/sim/presets/heading-deg', -9999),
+            ('/sim/presets/offset-distance-nm', 0),
+            ('/sim/presets/airspeed-kt', 0),
+        ]
+
+    def assemble_commands(self, reposition: bool = True) -> typing.List[typing.Tuple[str, typing.Dict[str, typing.Any]]]:
+        ''' Returns the fgcommands to run, and their arguments, once the properties are set '''
+        res = []
+
+        if reposition and self.repositions:
+            res.append(('reposition', {}))
+
+        if self.time_of_day is not None:
+            res.append(('timeofday', {'timeofday': TimeOfDay.get(self.time_of_day).lower_name}))
+
+        return res
+
+
 class Version(graphene.ObjectType):
     id = graphene.ID()
     major = graphene.Int()
@@ -1,5 +1,6 @@
 import socket
 import logging
+import math
 from pathlib import Path
 
 import yaml
@@ -70,3 +71,22 @@ def save_config(base_dir, settings):
     with open(config_file, 'wt') as fh:
         logging.info('Saving config')
         fh.write(yaml.dump(res))
+
+
+def tile_name(lat: float, lon: float) -> str:
+    ''' Name of the 1x1 degree scenery tile holding lat, lon, e.g. e013n52 '''
+    lat = math.floor(lat)
+    lon = math.floor(lon)
+    # longitude wraps, latitude stops at the poles
+    lon = (lon + 180) % 360 - 180
+    lat = min(max(lat, -90), 89)
+
+    return f"{'e' if lon >= 0 else 'w'}{abs(lon):03d}{'n' if lat >= 0 else 's'}{abs(lat):02d}"
+
+
+def tile_path(lat: float, lon: float) -> str:
+    ''' Tile holding lat, lon within its 10x10 degree bucket, e.g. e010n50/e013n52 '''
+    lat = min(max(math.floor(lat), -90), 89)
+    lon = (math.floor(lon) + 180) % 360 - 180
+
+    return f"{tile_name(lat // 10 * 10, lon // 10 * 10)}/{tile_name(lat, lon)}"
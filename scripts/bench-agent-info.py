@@ -0,0 +1,94 @@
+#! /usr/bin/env python
+'''
+Measures how many `info` queries per second an agent answers while several
+clients poll it at once, e.g. compare
+
+    fgo agent --disable-zeroconf
+    fgo agent --disable-zeroconf --http-server waitress
+
+with
+
+    scripts/bench-agent-info.py --host localhost --clients 8 --duration 10
+'''
+from concurrent.futures import ThreadPoolExecutor
+import argparse
+import time
+
+import requests
+
+INFO_QUERY = '''
+{
+    info {
+        status
+        uuid
+        os
+        errors {
+            id
+            code
+            description
+        }
+    }
+}
+'''
+
+
+def create_parser():
+    parser_ = argparse.ArgumentParser()
+    parser_.add_argument('--host', default='localhost')
+    parser_.add_argument('--port', type=int, default=5000)
+    parser_.add_argument('--clients', type=int, default=8,
+                         help="Number of concurrent clients, each one keeps its connection alive")
+    parser_.add_argument('--duration', type=float, default=10,
+                         help="Number of seconds to run for")
+    return parser_
+
+
+def poll(url, deadline):
+    completed = 0
+    failed = 0
+    latencies = []
+
+    with requests.Session() as session:
+        while time.monotonic() < deadline:
+            started = time.monotonic()
+
+            try:
+                res = session.post(url, json={'query': INFO_QUERY}, timeout=5)
+                res.raise_for_status()
+                res.json()['data']['info']
+            except (requests.exceptions.RequestException, ValueError, KeyError, TypeError):
+                failed += 1
+                continue
+
+            latencies.append(time.monotonic() - started)
+            completed += 1
+
+    return completed, failed, latencies
+
+
+def main():
+    args = create_parser().parse_args()
+    url = f"http://{args.host}:{args.port}/graphql"
+    started = time.monotonic()
+    deadline = started + args.duration
+
+    with ThreadPoolExecutor(max_workers=args.clients) as executor:
+        results = list(executor.map(lambda _: poll(url, deadline), range(args.clients)))
+
+    elapsed = time.monotonic() - started
+    completed = sum(res[0] for res in results)
+    failed = sum(res[1] for res in results)
+    latencies = sorted(latency for res in results for latency in res[2])
+
+    print(f"{args.clients} clients, {elapsed:.1f}s against {url}")
+    print(f"  requests: {completed} ok, {failed} failed")
+    print(f"  throughput: {completed / elapsed:.1f} req/s")
+
+    if latencies:
+        p50 = latencies[len(latencies) // 2] * 1000
+        p99 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))] * 1000
+        print(f"  latency: p50 {p50:.1f}ms, p99 {p99:.1f}ms")
+
+
+if __name__ == "__main__":
+    main()